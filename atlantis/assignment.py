@@ -0,0 +1,65 @@
+def min_cost_assignment(costs):
+    """Solve the rectangular assignment problem with the Hungarian algorithm.
+
+    Every row gets a distinct column so that the total cost is minimized.
+    Runs in O(n^2 * m) for n rows and m columns.
+
+    Keyword arguments:
+    costs -- n x m cost matrix as a list of lists, with n <= m
+
+    Returns:
+    assignment -- list holding the column assigned to each row
+    """
+    n = len(costs)
+    if n == 0:
+        return []
+    m = len(costs[0])
+    inf = float("inf")
+
+    # potentials and matching are 1-indexed, index 0 is a sentinel
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    match = [0] * (m + 1)       # row matched to each column
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = costs[i0 - 1]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if used[j]: continue
+                cur = row[j - 1] - u[i0] - v[j]
+                if cur < minv[j]:
+                    minv[j] = cur
+                    way[j] = j0
+                if minv[j] < delta:
+                    delta = minv[j]
+                    j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+
+        # walk the augmenting path back
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    assignment = [-1] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            assignment[match[j] - 1] = j - 1
+    return assignment
@@ -1,10 +1,44 @@
-import json
 import math
+import time
+import threading
 from collections import defaultdict, deque
 import heapq
-from .pearl import Pearl
+
+# numpy is optional, without it the vectorized scoring falls back to pure Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .assignment import min_cost_assignment
+from .codec import dumps
+from .desk import DeskTracker
+from .pearl import Pearl, NOM, PASS
+from .profiler import Profiler
+from .timeline import Timeline
+from .topology import Topology, classify_topology
+from .tuning import load_config, pick_params
 from .worker import Worker
 
+# amount of thickness each flavor of worker dissolves per Nom of a color
+PROCESSING_RATE = {
+    "General": {
+        "Red": 1,
+        "Green": 1,
+        "Blue": 1,
+    },
+    "Vector": {
+        "Red": 1,
+        "Green": 5,
+        "Blue": 2,
+    },
+    "Matrix": {
+        "Red": 1,
+        "Green": 2,
+        "Blue": 10,
+    }
+}
+
 class Atlantis:
     """Coordinator for Pearl Processing.
 
@@ -14,40 +48,103 @@ class Atlantis:
     See Worker for information on how each worker chooses an action.
     """
 
-    def __init__(self, mode="pq"):
+    def __init__(self, mode="pq", planner="greedy", vectorized=False, replan_budget=0, steal=False, profile=False,
+                 long_run=False, config=None, calibrate=False, plan_cache=0, return_tree=False, refine=False,
+                 time_budget=0):
         """ Constructor
         
         Keyword arguments:
-        mode  -- Order of how workers will process the pearls (default "pq")
-                 - "pq" for priority queue, see worker for priority computation
-                 - "fifo" for first-in-first-out
-                 - "rr" for round-robin
+        mode    -- Order of how workers will process the pearls (default "pq")
+                   - "pq" for priority queue, see worker for priority computation
+                   - "fifo" for first-in-first-out
+                   - "rr" for round-robin
+        planner -- How new pearls are planned (default "greedy")
+                   - "greedy" plans each new pearl in arrival order
+                   - "batch" assigns the layers of all new pearls in a turn jointly
+                   - "timeline" plans each new pearl against the turns workers are booked for
+                   - "dp" plans each new pearl over all its layers at once, see search_dp
+        vectorized -- Score candidate workers with numpy arrays (default False),
+                      ignored if numpy isn't installed
+        replan_budget -- Maximum number of drifting pearls replanned per turn (default 0),
+                         0 turns replanning off, see replan_drifted. Ignored with
+                         the "timeline" planner, whose bookings can't be undone
+        steal -- Let idle workers take queued Noms off overloaded neighbors (default False),
+                 see steal_work. Ignored with the "timeline" planner as well
+        profile -- Keep a per-turn profile of process in `profiler` (default False),
+                   see Profiler
+        long_run -- Keep memory bounded for very long games (default False), caps the
+                    cached topology rows and compacts the bookkeeping after bursts, see compact
+        config  -- Tuned cost parameters per topology class (default None), a dict or the
+                   path of a JSON file written by tune.py. The entry for the class of the
+                   topology is applied when initializing, see configure
+        calibrate -- Estimate the processing rates from how much the layers of Nommed
+                     pearls thin out and plan with the estimates (default False), see
+                     calibrate_rates
+        plan_cache -- Number of plan templates kept for reuse by the "greedy" and "dp" planners
+                      (default 0), 0 turns the cache off, see plan_pearl
+        return_tree -- Walk return paths up a shortest-path tree rooted at the gatekeeper,
+                       built once per turn, instead of a search per pearl (default False),
+                       see tree_return_path
+        refine -- Refine the plans of waiting pearls in a background thread between turns
+                  and swap the better ones in at the start of the next turn (default False),
+                  see start_refining. Ignored with the "timeline" planner
+        time_budget -- Milliseconds a turn should take at most (default 0), 0 turns it off.
+                       New pearls that don't fit get a quick plan and a full one on a later
+                       turn, see plan_within_budget. Ignored with the "timeline" planner
         """
         self.mode = mode                        # Mode for processing workers
+        self.planner = planner if planner in ("greedy", "batch", "timeline", "dp") else "greedy"
         self.initialized = False                # Whether initialization has occurred or not
         self.worker_flavor = {}                 # flavor mappings for workers
         self.workers = {}                       # worker id to Worker mappings
+        self.worker_keys = {}                   # worker id to its JSON encoded key in the actions
         self.neighbors = defaultdict(set)       # Keeps track of neighboring nodes
         self.pearl_map = {}                     # pearl id to Pearl mappings
+        self.completions = deque()              # ids of pearls whose plan is done, drained every turn
+        self.turn_completed = 0                 # pearls completed on the last turn
+        self.total_completed = 0                # pearls completed so far
+        self.in_flight = 0                      # pearls with a plan left after the last turn
         self.workload = None                    # keeps track of current workload at nodes
+        self.timelines = None                   # turns each worker is booked for, timeline planner only
+        self.turn = 0                           # number of turns processed so far
+        self.topology = None                    # precomputed distances between workers
+        self.stamp = 0                          # id of the last return_path search, see return_path
+        self.use_return_tree = return_tree
+        self.return_tree = None                 # (turn, next hop to the gatekeeper) of the return tree
+        self.tree_builds = 0                    # return trees built so far
+        self.home = None                        # (turn, cost of the way home from each worker), see home_costs
+        self.settled = None                     # stamp of the last search that settled each worker
+        self.reached = None                     # stamp of the last search that reached each worker
+        self.preds = None                       # predecessor of each reached worker
+        self.dists = None                       # cost of reaching each reached worker
+        self.desks = DeskTracker()              # desks of the workers on the previous turn
+        self.vectorized = vectorized and np is not None
+        self.flavor_code = None                 # index of each worker's flavor in processing_rate
+
+        self.processing_rate = {k: dict(v) for k, v in PROCESSING_RATE.items()}
+
+        # online calibration of processing_rate
+        self.calibrate = calibrate
+        self.noms = []                          # (pearl id, worker id, plan step, layers, color, thickness) Nommed last turn
+        self.rate_sums = defaultdict(int)       # (flavor, color) to the sum of the rates seen
+        self.rate_counts = defaultdict(int)     # (flavor, color) to the number of rates seen
+        self.rate_floors = defaultdict(int)     # (flavor, color) to the most a layer it dissolved was thick
+        self.turn_corrected = 0                 # pearls replanned after going off plan on the last turn
+        self.total_corrected = 0                # pearls replanned after going off plan so far
+
+        # replanning of pearls that wait much longer than planned at a worker
+        self.replan_budget = replan_budget if self.planner != "timeline" else 0
+        self.replan_factor = 6                  # drifting once waiting this many times the planned work
+        self.located = {}                       # pearl id to (worker id, turn it arrived, work left then)
+        self.drift = []                         # heap of (turn drift is checked, pearl id, turn it arrived)
+        self.turn_replanned = 0                 # pearls replanned on the last turn
+        self.total_replanned = 0                # pearls replanned so far
 
-        self.processing_rate = {
-            "General": {
-                "Red": 1,
-                "Green": 1,
-                "Blue": 1,
-            },
-            "Vector": {
-                "Red": 1,
-                "Green": 5,
-                "Blue": 2,
-            },
-            "Matrix": {
-                "Red": 1,
-                "Green": 2,
-                "Blue": 10,
-            }
-        }
+        # work stealing by idle workers from their overloaded neighbors
+        self.steal = steal and self.planner != "timeline"
+        self.steal_threshold = 2                # queued pearls for a worker to count as overloaded
+        self.turn_stolen = 0                    # pearls handed to idle workers on the last turn
+        self.total_stolen = 0                   # pearls handed to idle workers so far
 
         # penalize passing through the origin since it needs to 
         # address incoming pearls
@@ -55,6 +152,58 @@ class Atlantis:
         self.origin_penalty = 10
         self.origin = 0
 
+        # weights of the path and workload terms of the cost in search
+        self.path_weight = 1
+        self.workload_weight = 1
+        self.config = load_config(config) if isinstance(config, str) else config
+        self.params = {}                        # parameters applied from the config
+
+        # number of cheapest workers considered for each layer in batch planning
+        self.batch_candidates = 4
+
+        # reuse of plans for pearls with the same layers
+        self.plan_cache_size = plan_cache
+        self.plan_cache = {}                    # (layers, load bucket) to (steps, workload on the route), least recently used first
+        self.plan_cache_drift = 50              # change of the workload on the route after which a template is stale
+        self.cache_hits = 0                     # plans taken from the cache so far
+        self.cache_misses = 0                   # plans searched for with the cache on so far
+
+        # refinement of the plans of waiting pearls between turns
+        self.refine_between = refine and self.planner != "timeline"
+        self.refiner = None                     # thread refining plans until the next turn, see start_refining
+        self.refine_stop = None                 # event telling the refiner to stop
+        self.refined = {}                       # pearl id to (worker id, plan, work, layers) staged for the next turn
+        self.refine_checked = {}                # pearl id to the last turn its plan was looked at
+        self.turn_refined = 0                   # plans swapped in at the start of the last turn
+        self.total_refined = 0                  # plans swapped in so far
+
+        # per-turn time budget, quick plans for the pearls that don't fit
+        self.time_budget = time_budget / 1000 if self.planner != "timeline" else 0
+        self.plan_time = None                   # running average of the seconds a full plan takes
+        self.rest_time = 0.0                    # seconds the last turn took after planning
+        self.deferred = {}                      # pearl id to layers of pearls waiting for a full plan, oldest first
+        self.turn_degraded = 0                  # new pearls given a quick plan on the last turn
+        self.degraded_fraction = 0.0            # fraction of the new pearls of the last turn given a quick plan
+        self.total_degraded = 0                 # new pearls given a quick plan so far
+        self.turn_deferred = 0                  # quick plans replaced by full ones on the last turn
+        self.total_deferred = 0                 # quick plans replaced by full ones so far
+
+        # bounded memory for long games
+        self.long_run = long_run
+        self.row_limit = 128                    # topology rows kept in long run mode
+        self.compact_floor = 64                 # pearls in flight below which nothing is compacted
+        self.peak_in_flight = 0                 # most pearls in flight since the last compaction
+
+        # the heap operations of the searches go through these so the
+        # profiler can count them, plain heapq without one
+        self.profiler = Profiler() if profile else None
+        if self.profiler is not None:
+            self.heappush = self.profiler.heappush
+            self.heappop = self.profiler.heappop
+        else:
+            self.heappush = heapq.heappush
+            self.heappop = heapq.heappop
+
     
     def initialize(self, setting):
         """Initialize the workers and get the neighbor mappings.
@@ -69,18 +218,72 @@ class Atlantis:
             wid = worker["id"]
             flavor = worker["flavor"]
             self.worker_flavor[wid] = flavor
-            self.workers[wid] = Worker(wid, self.mode)
+            self.workers[wid] = Worker(wid, self.mode, self.completions)
+            self.worker_keys[wid] = dumps(str(wid)) + ":"
+
+        if self.vectorized:
+            self.workload = np.zeros(len(self.workers), dtype=np.int64)
+            flavors = list(self.processing_rate)
+            self.flavor_code = np.array([flavors.index(self.worker_flavor[w]) for w in range(len(self.workers))])
+        else:
+            self.workload = [0 for _ in range(len(self.workers))]
+
+        if self.planner == "timeline":
+            self.timelines = [Timeline() for _ in range(len(self.workers))]
 
-        self.workload = [0 for _ in range(len(self.workers))]
+        # scratch lists of return_path, allocated once instead of per search
+        self.settled = [0] * len(self.workers)
+        self.reached = [0] * len(self.workers)
+        self.preds = [0] * len(self.workers)
+        self.dists = [0] * len(self.workers)
 
         # record neighboring nodes 
         for u, v in setting["neighbor_map"]:
             self.neighbors[u].add(v) 
             self.neighbors[v].add(u)
 
+        if self.config:
+            self.configure(pick_params(self.config, classify_topology(self.neighbors, len(self.workers))))
+
+        # path costs don't depend on the workload, so index them once
+        self.topology = Topology(self.neighbors, len(self.workers), self.origin, self.origin_penalty,
+                                 max(2, self.row_limit) if self.long_run else None)
+        self.topology.heappush = self.heappush
+        self.topology.heappop = self.heappop
+
         self.initialized = True
 
-    def search(self, pid, start, layers):
+    def configure(self, params):
+        """Apply tuned cost parameters, see tuning.PARAMETERS.
+
+        Has to be called before the topology index is built since the
+        origin penalty is baked into its distances.
+
+        Keyword arguments:
+        params -- parameter name to value mapping, missing ones keep their value
+        """
+        self.params = dict(params)
+        self.origin_penalty = params.get("origin_penalty", self.origin_penalty)
+        self.path_weight = params.get("path_weight", self.path_weight)
+        self.workload_weight = params.get("workload_weight", self.workload_weight)
+        for worker in self.workers.values():
+            worker.nom_penalty = params.get("nom_penalty", worker.nom_penalty)
+            worker.layer_weight = params.get("layer_weight", worker.layer_weight)
+
+    def layer_costs(self, layer):
+        """Number of turns each flavor of worker needs to dissolve a layer.
+
+        Keyword arguments:
+        layer -- the layer to dissolve, holds its color and thickness
+
+        Returns:
+        processing_costs -- flavor to number of turns mapping
+        """
+        target_color = layer["color"]
+        target_thickness = layer["thickness"]
+        return {k: math.ceil(target_thickness / self.processing_rate[k][target_color]) for k in self.processing_rate}
+
+    def search(self, pid, start, layers, sparse=False):
         """Generate a plan for processing based on a greedy search on each layer
 
         The entire search considers:
@@ -91,7 +294,10 @@ class Atlantis:
         Keyword arguments:
         pid    -- the id of the pearl we're processing
         start  -- the starting node (will be the origin each time)
-        layers -- The different layers we need to process for the pearl
+        layers -- The different layers we need to process for the pearl, as in the
+                  state: the last one is the outermost and is Nommed first
+        sparse -- return the workload as a worker id to turns dict holding only
+                  the workers in the plan, instead of a list over all workers (default False)
 
         Returns:
         plan     -- The plan for processing the pearl, Noms and Passes
@@ -99,84 +305,193 @@ class Atlantis:
         start    -- The last worker id in the plan for processing the pearl
         """
         plan = []
-        workload = [0 for _ in range(len(self.workers))]
+        workload = {}
 
-        # each layer is a separate search for the worker to process the layer
-        for i in range(len(layers)):
-            layer = layers[i]
-            target_color = layer["color"]
-            target_thickness = layer["thickness"]
-            processing_costs = {k: math.ceil(target_thickness / self.processing_rate[k][target_color]) for k in self.processing_rate}
-
-            # Searches to find the cost of processing every node at each worker.
-            # Cost consists of: Cost of the path 
-            #                 + Existing workload cost 
-            #                 + processing cost by the worker
-            # 
-            # Basically Dijkstra's.
-            visited = set()
-            path = {}
-            path_costs = {}
-            pq = [(0, start)]
-            curr_costs = {}
+        # each layer is a separate search for the worker to process the layer,
+        # from the outside in
+        for layer in reversed(layers):
+            processing_costs = self.layer_costs(layer)
 
-            # Assumes single connected component 
-            while len(visited) != len(self.workers):
-                cost, curr = heapq.heappop(pq)
-                if curr in visited: continue
-                visited.add(curr)
-                curr_costs[curr] = cost + processing_costs[self.worker_flavor[curr]] + self.workload[curr]
-                if curr == self.origin:
-                    curr_costs[curr] += self.origin_penalty
-                for neighbor in self.neighbors[curr]:
-                    if neighbor in visited: continue
-                    cost_new = cost + 1 
-                    if neighbor == self.origin:
-                        cost_new += self.origin_penalty
-                    if neighbor not in path_costs or cost_new < path_costs[neighbor]:
-                        path_costs[neighbor] = cost_new
-                        path[neighbor] = curr
-                        heapq.heappush(pq, (cost_new, neighbor))
-
-            # Get the best cost and candidate for processing the current layer
-            best_cost = float("inf")
-            best_cand = -1
-            for cand in curr_costs:
-                if curr_costs[cand] < best_cost:
-                    best_cost = curr_costs[cand]
-                    best_cand = cand
+            # Cost of processing the layer at each worker consists of:
+            #     Cost of the path (precomputed in the topology index)
+            #   + Existing workload cost
+            #   + processing cost by the worker
+            if self.vectorized:
+                best_cand = self.best_candidate(start, processing_costs)
+            else:
+                # Candidates are visited in (path cost, id) order so ties go to
+                # the same worker Dijkstra's would have settled first.
+                dist, order = self.topology.row(start)
+                path_weight = self.path_weight
+                workload_weight = self.workload_weight
+                best_cost = float("inf")
+                best_cand = -1
+                for cand in order:
+                    cand_cost = (dist[cand] * path_weight + processing_costs[self.worker_flavor[cand]]
+                                 + self.workload[cand] * workload_weight)
+                    if cand == self.origin:
+                        cand_cost += self.origin_penalty
+                    if cand_cost < best_cost:
+                        best_cost = cand_cost
+                        best_cand = cand
 
             # If the best candidate isn't the starting node, add the cost of the
             # path for future workload considerations
             if best_cand != start:
-                # create the path 
-                best_path = [best_cand]
-                while best_path[-1] != start:
-                    best_path.append(path[best_path[-1]])
-                best_path = best_path[::-1]
+                best_path = self.topology.path(start, best_cand)
 
                 # Add the Pass operations to the plan
                 prev = start 
                 for curr in best_path[1:]:
-                    workload[prev] += 1
+                    workload[prev] = workload.get(prev, 0) + 1
                     plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
                     prev = curr
 
             # Add the noms to the plan 
-            workload[best_cand] += processing_costs[self.worker_flavor[best_cand]]
+            workload[best_cand] = workload.get(best_cand, 0) + processing_costs[self.worker_flavor[best_cand]]
             plan.append([processing_costs[self.worker_flavor[best_cand]], {"Nom": pid}])
 
             # Set the last worker in the path as the start of the next search pass
             start = best_cand
+
+        if not sparse:
+            dense = [0 for _ in range(len(self.workers))]
+            for wid, turns in workload.items():
+                dense[wid] = turns
+            workload = dense
         return plan, workload, start
 
+    def search_dp(self, pid, start, layers):
+        """Generate a plan for processing a pearl that's best over all its layers.
+
+        A shortest path over a layered graph with a node for every
+        (layer, worker) pair, using the same costs as search: doing layer
+        i at a worker costs the path from the worker of layer i - 1 plus
+        the workload and processing cost of the worker. Unlike search, a
+        layer can go to a worker that isn't the best for it alone if that
+        makes the layers after it cheaper. The return leg to the
+        gatekeeper is priced by its hops and the queues it waits in on
+        the way, see home_costs.
+
+        Each layer is a single Dijkstra's from all the workers of the
+        previous layer at once, each starting at its cost so far, so
+        planning takes layers x (workers + edges) steps.
+
+        Keyword arguments:
+        pid    -- the id of the pearl we're processing
+        start  -- the worker the pearl is at
+        layers -- The different layers we need to process for the pearl, as in the
+                  state: the last one is the outermost and is Nommed first
+
+        Returns:
+        plan     -- The plan for processing the pearl, Noms and Passes
+        workload -- worker id to ~ the amount of turns needed there
+        start    -- The last worker id in the plan for processing the pearl
+        """
+        size = len(self.workers)
+        adjacent = self.topology.adjacent
+        origin = self.origin
+        step = self.path_weight
+        step_origin = self.path_weight * (1 + self.origin_penalty)
+
+        # cost of the layers so far ending at each worker, None if unreached
+        best = [None] * size
+        best[start] = 0
+        preds = []      # predecessor of each worker on the path to it, for every layer
+        layers = layers[::-1]   # in the order they're Nommed
+        for layer in layers:
+            processing_costs = self.layer_costs(layer)
+
+            # cheapest way to get to each worker from any worker of the last
+            # layer, a worker that stays where it is has no predecessor
+            dist = [None] * size
+            pred = [None] * size
+            tentative = list(best)
+            pq = [(cost, w) for w, cost in enumerate(best) if cost is not None]
+            heapq.heapify(pq)
+            while pq:
+                cost, curr = self.heappop(pq)
+                if dist[curr] is not None: continue
+                dist[curr] = cost
+                for neighbor in adjacent(curr):
+                    if dist[neighbor] is not None: continue
+                    cost_new = cost + (step_origin if neighbor == origin else step)
+                    if tentative[neighbor] is None or cost_new < tentative[neighbor]:
+                        tentative[neighbor] = cost_new
+                        pred[neighbor] = curr
+                        self.heappush(pq, (cost_new, neighbor))
+
+            for w in range(size):
+                if dist[w] is not None:
+                    dist[w] += processing_costs[self.worker_flavor[w]] + self.workload[w] * self.workload_weight
+                    if w == origin:
+                        dist[w] += self.origin_penalty
+            preds.append(pred)
+            best = dist
+
+        # pick the last worker with the return leg counted, ties go to the lower id
+        last = start
+        if layers:
+            home = self.home_costs()
+            last = min((cost + home[w], w) for w, cost in enumerate(best) if cost is not None and home[w] is not None)[1]
+
+        # walk back through the layers to rebuild the route of each
+        route = []
+        curr = last
+        for pred in reversed(preds):
+            path = [curr]
+            while pred[path[-1]] is not None:
+                path.append(pred[path[-1]])
+            route.append(path[::-1])
+            curr = path[-1]
+
+        plan = []
+        workload = {}
+        for layer, path in zip(layers, reversed(route)):
+            prev = path[0]
+            for curr in path[1:]:
+                workload[prev] = workload.get(prev, 0) + 1
+                plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+                prev = curr
+            nom = self.layer_costs(layer)[self.worker_flavor[prev]]
+            workload[prev] = workload.get(prev, 0) + nom
+            plan.append([nom, {"Nom": pid}])
+        return plan, workload, last
+
+    def best_candidate(self, start, processing_costs):
+        """Find the cheapest worker for a layer with numpy arrays.
+
+        Same cost as the pure Python scoring in search, computed for every
+        worker at once. Ties go to the closest worker, then the lowest id.
+
+        Keyword arguments:
+        start            -- the worker the search starts from
+        processing_costs -- flavor to number of turns mapping for the layer
+
+        Returns:
+        best_cand -- id of the cheapest worker
+        """
+        dist = self.topology.dist_array(start)
+        nom = np.array([processing_costs[flavor] for flavor in self.processing_rate])
+        costs = dist * self.path_weight + nom[self.flavor_code] + self.workload * self.workload_weight
+        costs[self.origin] += self.origin_penalty
+        cands = np.flatnonzero(costs == costs.min())
+        return int(cands[np.argmin(dist[cands])])
+
     def return_path(self, start, target):
         """Finds best return path based on workload as cost.
 
         Finds the best path for getting from start to target, 
         using the workload as the cost of visiting each node.
         
-        Basically Dijkstra's.
+        A* with the workload of the target as the lower bound of every
+        worker other than the target: every path ends by entering the
+        target, so its workload is paid whichever way the pearl goes.
+        Pricing it up front lets the target be settled as soon as a
+        neighbor of it is, instead of after every worker that's cheaper
+        to reach than the full cost of the path. The bound is the same
+        for every other worker, so they settle in the order Dijkstra's
+        would and the path found is the same one.
 
         Keyword arguments:
         start  -- Where the return path begins
@@ -189,34 +504,138 @@ class Atlantis:
         # return early if we don't need to go anywhere
         if start == target: return []
 
-        # otherwise look for a path
-        visited = set()
-        path = {}
-        costs = {}
+        # otherwise look for a path, the scratch lists are shared between
+        # searches and an entry only counts if it has this search's stamp
+        self.stamp += 1
+        stamp = self.stamp
+        settled = self.settled
+        reached = self.reached
+        path = self.preds
+        costs = self.dists
+        workload = self.workload
+        adjacent = self.topology.adjacent
         pq = [(0, start)]
 
-        # Look until we find the target, dijkstra's guarantees
-        # minimum cost path according to cost function.
+        # Look until we find the target, the costs in the queue are the cost
+        # to get to a worker + the bound, left out since it's the same for all
         #
         # Cost function is: Cost to get to current worker + workload at worker
-        while target not in visited:
-            cost, curr = heapq.heappop(pq)
-            if curr in visited: continue
-            visited.add(curr)
-            for neighbor in self.neighbors[curr]:
-                if neighbor in visited: continue
-                cost_new = cost + self.workload[neighbor] 
-                if neighbor not in costs or cost_new < costs[neighbor]:
+        while settled[target] != stamp:
+            cost, curr = self.heappop(pq)
+            if settled[curr] == stamp: continue
+            settled[curr] = stamp
+            for neighbor in adjacent(curr):
+                if settled[neighbor] == stamp: continue
+                cost_new = cost + workload[neighbor] if neighbor != target else cost
+                if reached[neighbor] != stamp or cost_new < costs[neighbor]:
+                    reached[neighbor] = stamp
                     costs[neighbor] = cost_new
                     path[neighbor] = curr
-                    heapq.heappush(pq, (cost_new, neighbor))
+                    self.heappush(pq, (cost_new, neighbor))
 
-        ret_path = [0]
+        ret_path = [target]
         while ret_path[-1] != start:
             ret_path.append(path[ret_path[-1]])
 
         return ret_path[::-1]
 
+    def build_return_tree(self):
+        """Build the shortest-path tree of return paths to the gatekeeper.
+
+        Dijkstra's from the gatekeeper over the reversed edges: stepping
+        from a worker into a neighbor costs the workload of the neighbor,
+        the same cost return_path uses. Every worker gets the next hop of
+        its cheapest path home.
+        """
+        size = len(self.workers)
+        settled = [False] * size
+        best = [None] * size
+        nxt = [None] * size
+        adjacent = self.topology.adjacent
+        best[self.origin] = 0
+        pq = [(0, self.origin)]
+        while pq:
+            cost, curr = self.heappop(pq)
+            if settled[curr]: continue
+            settled[curr] = True
+            cost_new = cost + self.workload[curr]
+            for neighbor in adjacent(curr):
+                if settled[neighbor]: continue
+                if best[neighbor] is None or cost_new < best[neighbor]:
+                    best[neighbor] = cost_new
+                    nxt[neighbor] = curr
+                    self.heappush(pq, (cost_new, neighbor))
+        self.return_tree = (self.turn, nxt)
+        self.tree_builds += 1
+
+    def home_costs(self):
+        """Cost of the way home to the gatekeeper from every worker.
+
+        Dijkstra's from the gatekeeper over the reversed edges, once per
+        turn. Stepping through a worker costs a Pass plus the turns a
+        pearl done with its layers would wait in the worker's queue, see
+        Worker.pass_wait, in the units search_dp uses for the other
+        legs. The waits are the ones of the queues now, not the planned
+        workload: a pearl gets there turns from now and, in "pq" mode,
+        is served before the Noms the workload is mostly made of.
+
+        Returns:
+        home -- cost of the way home from each worker, None if there's none
+        """
+        if self.home is not None and self.home[0] == self.turn:
+            return self.home[1]
+        size = len(self.workers)
+        origin = self.origin
+        step = self.path_weight
+        workload_weight = self.workload_weight
+        wait = [self.workers[w].pass_wait() for w in range(size)]
+        settled = [False] * size
+        best = [None] * size
+        adjacent = self.topology.adjacent
+        best[origin] = 0
+        pq = [(0, origin)]
+        while pq:
+            cost, curr = self.heappop(pq)
+            if settled[curr]: continue
+            settled[curr] = True
+            cost_new = cost + step
+            if curr != origin:
+                cost_new += wait[curr] * workload_weight
+            for neighbor in adjacent(curr):
+                if settled[neighbor]: continue
+                if best[neighbor] is None or cost_new < best[neighbor]:
+                    best[neighbor] = cost_new
+                    self.heappush(pq, (cost_new, neighbor))
+        self.home = (self.turn, best)
+        return best
+
+    def tree_return_path(self, start):
+        """Return path to the gatekeeper taken from the shortest-path tree.
+
+        The tree is built on the first return path of a turn and every
+        other return path of the turn walks up it, so return paths are
+        planned against the workload as it was when the tree was built,
+        without the work added by the pearls planned after it that turn.
+
+        Return paths of a burst of pearls mostly cross workers without any
+        workload, where return_path has to settle most of the graph before
+        it gets to the gatekeeper. With the tree that's done once per turn.
+
+        Keyword arguments:
+        start -- Where the return path begins
+
+        Returns:
+        ret_path -- The path from the start to the gatekeeper, like return_path
+        """
+        if start == self.origin: return []
+        if self.return_tree is None or self.return_tree[0] != self.turn:
+            self.build_return_tree()
+        nxt = self.return_tree[1]
+        ret_path = [start]
+        while ret_path[-1] != self.origin:
+            ret_path.append(nxt[ret_path[-1]])
+        return ret_path
+
     def plan_pearl(self, pearl):
         """Create plan for processing pearl.
 
@@ -237,28 +656,1032 @@ class Atlantis:
         layers = pearl["layers"]
         start = 0
 
+        # 0. Reuse the plan of a pearl with the same layers if the workload
+        # hasn't changed much since, see cached_plan
+        if self.plan_cache_size:
+            key = (tuple((layer["color"], layer["thickness"]) for layer in layers), len(self.pearl_map).bit_length())
+            cached = self.cached_plan(pid, key)
+            if cached is not None:
+                return cached
+
         # 1. Creates plan 
-        plan, workload, last_id = self.search(pid, start, layers)
+        if self.planner == "dp":
+            plan, workload, last_id = self.search_dp(pid, start, layers)
+        else:
+            plan, workload, last_id = self.search(pid, start, layers, sparse=True)
+
+        # 2. Adds work for plan, only the workers in the plan are touched
+        for wid, turns in workload.items():
+            self.workload[wid] += turns
+        work = sum(workload.values())
+        
+        # 3. & 4. Compute return path and add work for it
+        work += self.add_return_path(pid, plan, last_id)
+
+        if self.plan_cache_size:
+            self.cache_misses += 1
+            self.cache_plan(key, plan)
+        return plan, work
+
+    def cache_plan(self, key, plan):
+        """Keep the steps of a plan as a template, see cached_plan.
+
+        The workload of every worker on the route is kept with it, as it
+        was before the plan's own work was added.
+
+        Keyword arguments:
+        key  -- (color and thickness of each layer, bucket of pearls in flight)
+        plan -- the plan just made, its work already added to the workload
+        """
+        steps = []
+        route = {}
+        holder = self.origin
+        for count, action in plan:
+            route[holder] = route.get(holder, 0) + count
+            to = action["Pass"]["to_worker"] if "Pass" in action else -1
+            if to >= 0:
+                holder = to
+            steps.append((count, to))
+        for wid in route:
+            route[wid] = self.workload[wid] - route[wid]
+        self.plan_cache[key] = (steps, route)
+        if len(self.plan_cache) > self.plan_cache_size:
+            del self.plan_cache[next(iter(self.plan_cache))]
+
+    def cached_plan(self, pid, key):
+        """Build a plan from a cached template and add its work to the workload.
+
+        A template holds the steps of a plan made for a pearl with the same
+        layers while about as many pearls were in flight. It's only used if
+        the workload of the workers on its route changed by at most
+        `plan_cache_drift` turns in total since it was made, stale templates
+        are dropped. Reusing a template adds to the workload on its route,
+        so a burst of identical pearls doesn't pile onto the same workers.
+
+        Keyword arguments:
+        pid -- the id of the pearl we're processing
+        key -- (color and thickness of each layer, bucket of pearls in flight)
+
+        Returns:
+        (plan, work) like plan_pearl, None if there's no fresh template
+        """
+        cached = self.plan_cache.pop(key, None)
+        if cached is None:
+            return None
+        steps, route = cached
+        drift = 0
+        for wid, workload in route.items():
+            drift += abs(self.workload[wid] - workload)
+        if drift > self.plan_cache_drift:
+            return None
+        self.plan_cache[key] = cached
+
+        plan = []
+        work = 0
+        holder = self.origin
+        for count, to in steps:
+            self.workload[holder] += count
+            if to < 0:
+                plan.append([count, {"Nom": pid}])
+            else:
+                plan.append([count, {"Pass":{"pearl_id":pid,"to_worker":to}}])
+                holder = to
+            work += count
+        self.cache_hits += 1
+        return plan, work
+
+    def add_return_path(self, pid, plan, last_id):
+        """Add the Pass operations bringing a pearl back to the gatekeeper.
+
+        Keyword arguments:
+        pid     -- the id of the pearl we're processing
+        plan    -- the plan to extend with the return path
+        last_id -- the last worker id in the plan for processing the pearl
+
+        Returns:
+        work -- the amount of work added for the return path
+        """
+        work = 0
+        if self.use_return_tree:
+            path = self.tree_return_path(last_id)
+        else:
+            path = self.return_path(last_id, self.origin)
+
+        # if it's not already at the gatekeeper, add Pass operations
+        if path: 
+            prev = path[0]
+            for curr in path[1:]:
+                self.workload[prev] += 1
+                plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+                work += 1
+                prev = curr
+        return work
+
+    def quick_plan(self, pearl):
+        """Create a plan for a pearl without any search, for when time is short.
+
+        A fresh template from the plan cache is used if there's one.
+        Otherwise all the layers are Nommed at a single worker, the one
+        with the cheapest round trip from the gatekeeper plus processing
+        cost and workload. Workers are scanned in the order of the
+        gatekeeper's distance row, which the topology index always keeps,
+        until the round trip alone costs more than the best worker so far.
+
+        Keyword arguments:
+        pearl -- The pearl we need to create a plan for
+
+        Returns:
+        plan -- the plan for the pearl
+        work -- the amount of work (~turns) necessary for processing the pearl
+        """
+        pid = pearl["id"]
+        layers = pearl["layers"]
+        if self.plan_cache_size:
+            key = (tuple((layer["color"], layer["thickness"]) for layer in layers), len(self.pearl_map).bit_length())
+            cached = self.cached_plan(pid, key)
+            if cached is not None:
+                return cached
+
+        costs = [self.layer_costs(layer) for layer in layers]
+        totals = {flavor: sum(c[flavor] for c in costs) for flavor in self.processing_rate}
+        dist, order = self.topology.row(self.origin)
+        best_cost = float("inf")
+        best_cand = self.origin
+        for cand in order:
+            round_trip = 2 * dist[cand] * self.path_weight
+            if round_trip >= best_cost:
+                break
+            cand_cost = round_trip + totals[self.worker_flavor[cand]] + self.workload[cand] * self.workload_weight
+            if cand == self.origin:
+                cand_cost += self.origin_penalty
+            if cand_cost < best_cost:
+                best_cost = cand_cost
+                best_cand = cand
+
+        plan = []
+        work = 0
+        path = self.topology.path(self.origin, best_cand)
+        for prev, curr in zip(path, path[1:]):
+            self.workload[prev] += 1
+            plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+        for c in reversed(costs):
+            nom = c[self.worker_flavor[best_cand]]
+            self.workload[best_cand] += nom
+            plan.append([nom, {"Nom": pid}])
+            work += nom
+        path.reverse()
+        for prev, curr in zip(path, path[1:]):
+            self.workload[prev] += 1
+            plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+        work += 2 * (len(path) - 1)
+        return plan, work
+
+    def time_plan(self, seconds):
+        """Add the time a full plan took to the running average."""
+        if self.plan_time is None:
+            self.plan_time = seconds
+        else:
+            self.plan_time += (seconds - self.plan_time) / 5
+
+    def plan_within_budget(self, pearls, deadline):
+        """Create plans for the new pearls without going over the time budget.
+
+        New pearls get a full plan as long as the average time a full plan
+        takes still fits before the deadline, the rest get a quick_plan and
+        wait for a full one, see plan_deferred. With the "batch" planner as
+        many pearls as fit are planned as one batch. Until a full plan has
+        been timed, only one pearl is planned in full.
+
+        Keyword arguments:
+        pearls   -- the new pearls we need to create plans for
+        deadline -- time.perf_counter() by which planning should be done
+
+        Returns:
+        planned -- list of (plan, work) for each pearl, in the same order
+        """
+        clock = time.perf_counter
+        if self.planner == "batch":
+            if self.plan_time is None:
+                fit = min(1, len(pearls))
+            else:
+                fit = max(0, int((deadline - clock()) / self.plan_time))
+            start = clock()
+            planned = self.plan_batch(pearls[:fit])
+            if fit:
+                self.time_plan((clock() - start) / fit)
+        else:
+            planned = []
+            for pearl in pearls:
+                start = clock()
+                if self.plan_time is not None and start + self.plan_time > deadline:
+                    break
+                planned.append(self.plan_pearl(pearl))
+                self.time_plan(clock() - start)
+            fit = len(planned)
+
+        for pearl in pearls[fit:]:
+            planned.append(self.quick_plan(pearl))
+            self.deferred[pearl["id"]] = [dict(layer) for layer in pearl["layers"]]
+        self.turn_degraded = len(pearls) - fit
+        self.degraded_fraction = self.turn_degraded / len(pearls) if pearls else 0.0
+        self.total_degraded += self.turn_degraded
+        return planned
+
+    def plan_deferred(self, deadline):
+        """Give pearls that got a quick plan a full one, oldest first.
+
+        Only pearls that haven't left the gatekeeper or started a Nom are
+        replanned, they're still where they arrived with all their layers.
+        The others keep their quick plan. Stops once the average time of a
+        full plan no longer fits before the deadline.
+
+        Keyword arguments:
+        deadline -- time.perf_counter() by which planning should be done
+        """
+        clock = time.perf_counter
+        replaced = 0
+        while self.deferred:
+            start = clock()
+            if start + self.plan_time > deadline:
+                break
+            pid = next(iter(self.deferred))
+            layers = self.deferred.pop(pid)
+            pearl = self.pearl_map.get(pid)
+            if pearl is None or pearl.cursor or pearl.started:
+                continue
+            self.replan_pearl(pearl, self.origin, layers)
+            self.time_plan(clock() - start)
+            replaced += 1
+        self.turn_deferred = replaced
+        self.total_deferred += replaced
+
+    def timeline(self, wid):
+        """Get the timeline of a worker, synced to the current turn."""
+        timeline = self.timelines[wid]
+        if timeline.now != self.turn:
+            timeline.sync(self.turn, self.workload[wid])
+        return timeline
+
+    def book(self, wid, ready, duration):
+        """Book the earliest free turns of a worker.
+
+        Keyword arguments:
+        wid      -- id of the worker to book
+        ready    -- the first turn the work could start on
+        duration -- number of turns to book
+
+        Returns:
+        start -- the first booked turn
+        """
+        timeline = self.timeline(wid)
+        start = timeline.earliest(ready, duration)
+        timeline.book(start, duration)
+        return start
+
+    def timed_search(self, pid, start, layers, ready):
+        """Generate a plan for processing based on predicted finish times.
+
+        Same greedy search on each layer as search, except each candidate is
+        scored by the turn it would be done with the layer. The pearl reaches
+        a candidate at the turn Dijkstra's over predicted arrival turns gives,
+        where every worker on the way passes it on at its first free turn,
+        then waits for the first free stretch of turns on the candidate's
+        timeline that fits the Noms.
+
+        The chosen Passes and Noms are booked as they're added to the plan,
+        so later layers and pearls see them.
+
+        Keyword arguments:
+        pid    -- the id of the pearl we're processing
+        start  -- the starting node (will be the origin each time)
+        layers -- The different layers we need to process for the pearl, as in the
+                  state: the last one is the outermost and is Nommed first
+        ready  -- the first turn the pearl can be acted on
+
+        Returns:
+        plan     -- The plan for processing the pearl, Noms and Passes
+        workload -- ~ The amount of turns needed to process the pearl
+        start    -- The last worker id in the plan for processing the pearl
+        ready    -- The turn the last layer is predicted to be done
+        """
+        plan = []
+        workload = [0 for _ in range(len(self.workers))]
+        adjacent = self.topology.adjacent
 
-        # 2. Adds work for plan
+        for layer in reversed(layers):
+            processing_costs = self.layer_costs(layer)
+            fastest = min(processing_costs.values())
+
+            # Workers are settled in order of arrival, so once even the
+            # fastest flavor can't beat the best finish, no later one can
+            visited = set()
+            path = {}
+            arrival = {start: ready}
+            pq = [(ready, start)]
+            best_finish = float("inf")
+            best_cand = -1
+            while pq:
+                turn, curr = self.heappop(pq)
+                if curr in visited: continue
+                if turn + fastest >= best_finish: break
+                visited.add(curr)
+                timeline = self.timeline(curr)
+
+                nom = processing_costs[self.worker_flavor[curr]]
+                finish = timeline.earliest(turn, nom) + nom
+                if curr == self.origin:
+                    finish += self.origin_penalty
+                if finish < best_finish:
+                    best_finish = finish
+                    best_cand = curr
+
+                depart = timeline.earliest(turn, 1)
+                for neighbor in adjacent(curr):
+                    if neighbor in visited: continue
+                    turn_new = depart + 1
+                    if neighbor == self.origin:
+                        turn_new += self.origin_penalty
+                    if neighbor not in arrival or turn_new < arrival[neighbor]:
+                        arrival[neighbor] = turn_new
+                        path[neighbor] = curr
+                        self.heappush(pq, (turn_new, neighbor))
+
+            # Book a turn for every Pass on the way to the candidate
+            if best_cand != start:
+                best_path = [best_cand]
+                while best_path[-1] != start:
+                    best_path.append(path[best_path[-1]])
+                prev = start
+                for curr in best_path[-2::-1]:
+                    ready = self.book(prev, ready, 1) + 1
+                    workload[prev] += 1
+                    plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+                    prev = curr
+
+            # Book the Noms
+            nom = processing_costs[self.worker_flavor[best_cand]]
+            ready = self.book(best_cand, ready, nom) + nom
+            workload[best_cand] += nom
+            plan.append([nom, {"Nom": pid}])
+
+            start = best_cand
+        return plan, workload, start, ready
+
+    def timed_return_path(self, start, target, ready):
+        """Finds the return path that gets to the target the earliest.
+
+        A* over predicted arrival turns: a worker passes the pearl on at
+        the first turn it has free after the pearl arrives, and the
+        neighbor gets it the turn after. Every Pass takes at least a turn,
+        so the hop distance to the gatekeeper, taken from its row in the
+        topology index, is a lower bound on the turns left. Waiting never
+        lets a pearl arrive sooner, so the first time the target is
+        settled is the earliest.
+
+        Keyword arguments:
+        start  -- Where the return path begins
+        target -- Where we're trying to reach
+        ready  -- the first turn the pearl can be passed on
+
+        Returns:
+        ret_path -- The path to from the start to the target
+        """
+        if start == target: return []
+
+        # the gatekeeper's row has no origin penalty in it, other rows might
+        hops = self.topology.row(target)[0] if target == self.origin else None
+        adjacent = self.topology.adjacent
+
+        visited = set()
+        path = {}
+        arrival = {start: ready}
+        pq = [(ready, start)]
+        while target not in visited:
+            _, curr = self.heappop(pq)
+            if curr in visited: continue
+            visited.add(curr)
+            depart = self.timeline(curr).earliest(arrival[curr], 1)
+            for neighbor in adjacent(curr):
+                if neighbor in visited: continue
+                turn_new = depart + 1
+                if neighbor not in arrival or turn_new < arrival[neighbor]:
+                    arrival[neighbor] = turn_new
+                    path[neighbor] = curr
+                    self.heappush(pq, (turn_new + hops[neighbor] if hops else turn_new, neighbor))
+
+        ret_path = [target]
+        while ret_path[-1] != start:
+            ret_path.append(path[ret_path[-1]])
+
+        return ret_path[::-1]
+
+    def plan_timed(self, pearl):
+        """Create plan for processing pearl against the worker timelines.
+
+        Same steps as plan_pearl, with every Pass and Nom booked on the
+        timeline of the worker doing it. The workload counters are kept up
+        to date as well.
+
+        Keyword arguments:
+        pearl -- The pearl we need to create a plan for
+
+        Returns:
+        plan -- the plan for the pearl
+        work -- the amount of work (~turns) necessary for processing the pearl
+        """
+        pid = pearl["id"]
+        plan, workload, last_id, ready = self.timed_search(pid, self.origin, pearl["layers"], self.turn)
         for i in range(len(workload)):
             self.workload[i] += workload[i]
         work = sum(workload)
-        
-        # 3. Compute return path
-        path = self.return_path(last_id, start)
 
-        # 4. if it's not already at the gatekeeper, add Pass operations
-        if path: 
+        path = self.timed_return_path(last_id, self.origin, ready)
+        if path:
             prev = path[0]
             for curr in path[1:]:
+                ready = self.book(prev, ready, 1) + 1
                 self.workload[prev] += 1
                 plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
                 work += 1
                 prev = curr
         return plan, work
 
+    def watch(self, pid, wid):
+        """Start watching a pearl that just arrived at a worker for drift.
+
+        Keyword arguments:
+        pid -- id of the pearl
+        wid -- id of the worker it arrived at
+        """
+        pearl = self.pearl_map.get(pid)
+        if pearl is None:
+            return
+        self.located[pid] = (wid, self.turn, pearl.work)
+        heapq.heappush(self.drift, (self.drift_deadline(pearl), pid, self.turn))
+
+    def drift_deadline(self, pearl):
+        """Turn on which a pearl waiting from now on counts as drifting,
+        the current turn if `replan_factor` is 0."""
+        return self.turn + self.replan_factor * max(1, pearl.local_work())
+
+    def replan_drifted(self, state):
+        """Replan pearls that have been waiting at a worker for too long.
+
+        A pearl drifts when it has sat at a worker for more than
+        `replan_factor` times the work planned for it there, e.g. stuck
+        behind a congested specialist. Pearls whose Nom is under way are
+        making progress and are left alone. At most `replan_budget` pearls
+        are replanned per turn, the ones that drifted first go first and
+        the rest wait for the next turn. Pearls are checked again once
+        their next deadline comes, at the earliest on the next turn.
+
+        Keyword arguments:
+        state -- The current state of the system
+        """
+        budget = self.replan_budget
+        desks = {}
+        replanned = 0
+        rearm = []
+        while self.drift and self.drift[0][0] <= self.turn and budget:
+            _, pid, arrived = heapq.heappop(self.drift)
+            pearl = self.pearl_map.get(pid)
+            if pearl is None or self.located[pid][1] != arrived:
+                continue
+            wid, _, work = self.located[pid]
+
+            # worked on since it arrived and the Nom isn't done yet
+            if pearl.work < work and pearl.next_op() == NOM:
+                rearm.append((self.drift_deadline(pearl), pid, arrived))
+                continue
+
+            if wid not in desks:
+                desks[wid] = {p["id"]: p for p in state["workers"][wid]["desk"]}
+            self.replan_pearl(pearl, wid, desks[wid][pid]["layers"])
+            self.located[pid] = (wid, self.turn, pearl.work)
+            rearm.append((self.drift_deadline(pearl), pid, self.turn))
+            budget -= 1
+            replanned += 1
+        for entry in rearm:
+            heapq.heappush(self.drift, entry)
+        self.turn_replanned = replanned
+        self.total_replanned += replanned
+
+    def replan_pearl(self, pearl, wid, layers):
+        """Plan the rest of a pearl again from where it is now.
+
+        The work left in the old plan is taken off the workers that would
+        have done it, then the remaining layers and the return path are
+        searched from the pearl's current worker.
+
+        Keyword arguments:
+        pearl  -- the Pearl to replan
+        wid    -- id of the worker holding the pearl
+        layers -- the layers of the pearl that are left
+        """
+        holder = wid
+        for i in range(pearl.cursor, len(pearl.ops)):
+            self.workload[holder] = max(0, self.workload[holder] - pearl.counts[i])
+            if pearl.ops[i] == PASS:
+                holder = pearl.targets[i]
+
+        if self.planner == "dp":
+            plan, workload, last_id = self.search_dp(pearl.id, wid, layers)
+        else:
+            plan, workload, last_id = self.search(pearl.id, wid, layers, sparse=True)
+        for holder, turns in workload.items():
+            self.workload[holder] += turns
+        work = sum(workload.values())
+        work += self.add_return_path(pearl.id, plan, last_id)
+
+        pearl.replan(plan, work, len(layers))
+        self.workers[wid].refresh(pearl)
+
+    def steal_work(self, state):
+        """Hand queued Noms of overloaded workers to idle neighbors.
+
+        An idle worker looks at the queues of its neighbors holding at least
+        `steal_threshold` pearls for pearls whose next step is a Nom that
+        hasn't started. Such a pearl can be passed to the idle worker, nommed
+        there and passed back, or straight on if the plan was going to pass
+        it to the idle worker next anyway, or back to the gatekeeper from the
+        idle worker if it was the last layer. The pearl that saves the most
+        turns is taken, counting the wait behind the work queued ahead of it
+        at the neighbor, and only if the idle worker's flavor makes that
+        cheaper.
+
+        Idle means an empty desk and an empty queue right now. Work planned
+        for the worker later doesn't count, it has nothing to do until then.
+
+        At most one pearl is handed to each idle worker per turn. The pearl
+        stays in the neighbor's queue with the Pass as its next step. The
+        queue of each neighbor is only walked once a turn, see stealable, so
+        the wait ahead of a pearl doesn't drop for pearls taken before it
+        on the same turn.
+
+        Keyword arguments:
+        state -- The current state of the system
+        """
+        stolen = 0
+        queues = {}     # neighbor id to its stealable pearls this turn
+        for worker in state["workers"]:
+            wid = worker["id"]
+            if worker["desk"] or not self.workers[wid].idle():
+                continue
+            rates = self.processing_rate[self.worker_flavor[wid]]
+            best_saving = 0
+            best = None
+            for neighbor in self.topology.adjacent(wid):
+                if neighbor not in queues:
+                    queues[neighbor] = self.stealable(state, neighbor)
+                stealable, queued = queues[neighbor]
+                for pearl, ahead, layer in stealable:
+                    # already handed to another idle worker this turn
+                    if pearl.next_op() != NOM:
+                        continue
+                    nom = pearl.counts[pearl.cursor]
+                    nom_new = math.ceil(layer["thickness"] / rates[layer["color"]])
+
+                    # straight on if the plan passes it to the idle worker next
+                    i = pearl.cursor + 1
+                    shortcut = i < len(pearl.ops) and pearl.ops[i] == PASS and pearl.targets[i] == wid
+                    cost_new = 1 + nom_new
+                    if not shortcut and pearl.layers > 1:
+                        # passed back, behind what's still queued at the neighbor by then
+                        cost_new += 1 + max(0, queued - nom - cost_new - 1)
+                    if wid == self.origin:
+                        cost_new += self.origin_penalty
+                    cost_old = ahead + nom
+                    if cost_old - cost_new > best_saving:
+                        best_saving = cost_old - cost_new
+                        best = (pearl, neighbor, nom, nom_new, shortcut)
+
+            if best is not None:
+                pearl, neighbor, nom, nom_new, shortcut = best
+                pid = pearl.id
+                rest = pearl.plan[1:]
+                plan = [[1, {"Pass":{"pearl_id":pid,"to_worker":wid}}], [nom_new, {"Nom": pid}]]
+
+                # the neighbor now only passes the pearl on
+                self.workload[neighbor] = max(0, self.workload[neighbor] - nom + 1)
+                self.workload[wid] += nom_new
+                if pearl.layers == 1:
+                    # last layer, bring it back to the gatekeeper from the idle worker
+                    holder = neighbor
+                    for count, action in rest:
+                        self.workload[holder] = max(0, self.workload[holder] - count)
+                        if "Pass" in action:
+                            holder = action["Pass"]["to_worker"]
+                    self.add_return_path(pid, plan, wid)
+                elif shortcut:
+                    self.workload[neighbor] = max(0, self.workload[neighbor] - 1)
+                    self.workload[wid] += 1
+                    plan += rest[1:]
+                else:
+                    self.workload[wid] += 1
+                    plan += [[1, {"Pass":{"pearl_id":pid,"to_worker":neighbor}}]] + rest
+                pearl.replan(plan, sum(step[0] for step in plan), pearl.layers)
+                self.workers[neighbor].refresh(pearl)
+                stolen += 1
+        self.turn_stolen = stolen
+        self.total_stolen += stolen
+
+    def stealable(self, state, wid):
+        """Pearls an idle neighbor could take off a worker, see steal_work.
+
+        Keyword arguments:
+        state -- The current state of the system
+        wid   -- id of the worker
+
+        Returns:
+        stealable -- list of (pearl, turns of work queued ahead of it, its
+                     outer layer) for the pearls whose next step is a Nom that
+                     hasn't started, empty unless the worker is overloaded
+        queued    -- turns of work queued at the worker
+        """
+        victim = self.workers[wid]
+        if len(victim.pearls) < self.steal_threshold:
+            return [], 0
+        layers = {p["id"]: p["layers"] for p in state["workers"][wid]["desk"]}
+        stealable = []
+        queued = 0
+        for pearl, ahead in victim.queued(self.pearl_map):
+            queued = ahead + pearl.local_work()
+            if pearl.started or pearl.next_op() != NOM or not layers.get(pearl.id):
+                continue
+            # the environment Noms the last layer
+            stealable.append((pearl, ahead, layers[pearl.id][-1]))
+        return stealable, queued
+
+    def plan_turns(self, wid, steps):
+        """Estimate the turns a pearl needs to follow a plan from a worker.
+
+        On arriving at a worker the pearl waits for the work already
+        planned there, then takes its own steps at that worker. Getting
+        to the last worker of the plan, the gatekeeper, ends it.
+
+        Keyword arguments:
+        wid   -- id of the worker holding the pearl
+        steps -- (operation, count, target worker) of each step, see Pearl
+
+        Returns:
+        turns -- estimated number of turns until the pearl is back home
+        """
+        turns = 0
+        holder = wid
+        arrived = True
+        for op, count, to in steps:
+            if arrived:
+                turns += self.workload[holder]
+                arrived = False
+            turns += count
+            if op == PASS:
+                holder = to
+                arrived = True
+        return turns
+
+    def refine_candidates(self, state):
+        """Pearls whose plans can be refined before the next turn.
+
+        Only queued pearls that weren't acted on this turn and whose next
+        Nom hasn't been started are taken: they'll be at the same worker
+        with the same layers next turn. Pearls that were looked at longest
+        ago come first, then the ones at the busiest workers, so passes
+        that get cut short still get to every pearl.
+
+        Keyword arguments:
+        state -- the state of the turn that was just processed
+
+        Returns:
+        candidates -- list of (pearl id, worker id, layers left)
+        """
+        candidates = []
+        for worker in state["workers"]:
+            wid = worker["id"]
+            queue = self.workers[wid]
+            if not queue.pearls:
+                continue
+            last = queue.last[0].id if queue.last is not None else None
+            for p in worker["desk"]:
+                pid = p["id"]
+                pearl = self.pearl_map.get(pid)
+                if pearl is None or pid == last or pid not in queue.seen or pearl.started or pearl.finished:
+                    continue
+                candidates.append((self.refine_checked.get(pid, -1), -self.workload[wid], pid, wid,
+                                   [dict(layer) for layer in p["layers"]]))
+        candidates.sort(key=lambda c: c[:3])
+        return [c[2:] for c in candidates]
+
+    def refine(self, candidates, stop=None):
+        """Look for better plans for waiting pearls, see refine_candidates.
+
+        Each pearl is searched again from the worker holding it, against
+        the workload without its old plan. The new plan is kept if it's
+        estimated to bring the pearl home sooner, see plan_turns, and
+        staged in `refined` until apply_refined swaps it in. The workload
+        is updated right away so later pearls see it. Stops early once
+        `stop` is set, a pearl is either refined or left as it was.
+
+        Keyword arguments:
+        candidates -- list of (pearl id, worker id, layers left)
+        stop       -- threading.Event to stop at, None to go through every candidate (default None)
+        """
+        for pid, wid, layers in candidates:
+            if stop is not None and stop.is_set():
+                break
+            pearl = self.pearl_map.get(pid)
+            if pearl is None or pid in self.refined:
+                continue
+            self.refine_checked[pid] = self.turn
+
+            # take the work left in the old plan off its workers
+            removed = []
+            holder = wid
+            old = []
+            for i in range(pearl.cursor, len(pearl.ops)):
+                turns = min(self.workload[holder], pearl.counts[i])
+                self.workload[holder] -= turns
+                removed.append((holder, turns))
+                old.append((pearl.ops[i], pearl.counts[i], pearl.targets[i]))
+                if pearl.ops[i] == PASS:
+                    holder = pearl.targets[i]
+
+            if self.planner == "dp":
+                plan, workload, last_id = self.search_dp(pid, wid, layers)
+            else:
+                plan, workload, last_id = self.search(pid, wid, layers, sparse=True)
+            if self.use_return_tree:
+                path = self.tree_return_path(last_id)
+            else:
+                path = self.return_path(last_id, self.origin)
+            for curr in path[1:]:
+                plan.append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+            new = [(NOM, count, -1) if "Nom" in action else (PASS, count, action["Pass"]["to_worker"])
+                   for count, action in plan]
+
+            if self.plan_turns(wid, new) < self.plan_turns(wid, old):
+                for holder, turns in workload.items():
+                    self.workload[holder] += turns
+                for prev in path[:-1]:
+                    self.workload[prev] += 1
+                self.refined[pid] = (wid, plan, sum(count for count, _ in plan), len(layers))
+            else:
+                for holder, turns in removed:
+                    self.workload[holder] += turns
+
+    def start_refining(self, state):
+        """Start refining plans in a background thread, see refine.
+
+        The thread has the coordinator to itself until stop_refining is
+        called at the start of the next turn, in the meantime the caller
+        only waits for the next state, e.g. on stdin.
+
+        Keyword arguments:
+        state -- the state of the turn that was just processed
+        """
+        self.refine_stop = threading.Event()
+        self.refiner = threading.Thread(target=self.refine, args=(self.refine_candidates(state), self.refine_stop),
+                                        daemon=True)
+        self.refiner.start()
+
+    def stop_refining(self):
+        """Stop the refiner and swap in the plans it staged.
+
+        The refiner checks for the stop between pearls, so this waits for
+        at most the search of one pearl.
+        """
+        if self.refiner is None:
+            return
+        self.refine_stop.set()
+        self.refiner.join()
+        self.refiner = None
+        self.apply_refined()
+
+    def apply_refined(self):
+        """Swap the plans staged by refine into their pearls."""
+        for pid, (wid, plan, work, layers) in self.refined.items():
+            pearl = self.pearl_map.get(pid)
+            if pearl is None:
+                continue
+            pearl.replan(plan, work, layers)
+            self.workers[wid].refresh(pearl)
+            if pid in self.located:
+                self.located[pid] = self.located[pid][:2] + (work,)
+        self.turn_refined = len(self.refined)
+        self.total_refined += self.turn_refined
+        self.refined = {}
+
+    def plan_batch(self, pearls):
+        """Create plans for all pearls that arrived in the same turn.
+
+        Layers are assigned in rounds: round i places the i-th layer from
+        the outside of every pearl that has one, starting from wherever its
+        previous layer ended up.
+        Each round is a min-cost assignment of layers to worker slots.
+        Putting a layer in the k-th slot from the back of a worker's queue
+        costs k times its processing cost, since the k - 1 layers behind it
+        wait for it as well. This minimizes the total time the round takes
+        instead of letting the first pearl grab the best specialist.
+
+        Only the cheapest `batch_candidates` workers of each layer are
+        considered, which keeps the assignment small on large topologies.
+
+        Keyword arguments:
+        pearls -- the new pearls we need to create plans for
+
+        Returns:
+        planned -- list of (plan, work) for each pearl, in the same order
+        """
+        if len(pearls) <= 1:
+            return [self.plan_pearl(pearl) for pearl in pearls]
+
+        plans = [[] for _ in pearls]
+        works = [0 for _ in pearls]
+        starts = [self.origin for _ in pearls]
+        rounds = max(len(pearl["layers"]) for pearl in pearls)
+
+        for i in range(rounds):
+            items = [k for k in range(len(pearls)) if len(pearls[k]["layers"]) > i]
+
+            # cheapest workers for each layer, same cost as the greedy search
+            candidates = []
+            for k in items:
+                processing_costs = self.layer_costs(pearls[k]["layers"][-1 - i])
+                dist, order = self.topology.row(starts[k])
+                costs = []
+                for cand in order:
+                    cand_cost = dist[cand] * self.path_weight + self.workload[cand] * self.workload_weight
+                    if cand == self.origin:
+                        cand_cost += self.origin_penalty
+                    nom = processing_costs[self.worker_flavor[cand]]
+                    costs.append((cand_cost + nom, cand_cost, nom, cand))
+                costs.sort(key=lambda c: c[0])
+                candidates.append(costs[:self.batch_candidates])
+
+            # one slot per layer that could end up at each worker
+            slots = []
+            slot_count = defaultdict(int)
+            for costs in candidates:
+                for _, _, _, cand in costs:
+                    slot_count[cand] += 1
+                    slots.append((cand, slot_count[cand]))
+            column = {slot: j for j, slot in enumerate(slots)}
+
+            unreachable = float("inf")
+            matrix = []
+            for costs in candidates:
+                row = [unreachable] * len(slots)
+                for _, cand_cost, nom, cand in costs:
+                    for k in range(1, slot_count[cand] + 1):
+                        row[column[(cand, k)]] = cand_cost + k * nom
+                matrix.append(row)
+
+            assignment = min_cost_assignment(matrix)
+
+            # Add the Passes and Noms to each plan and record the workload
+            for k, j in zip(items, assignment):
+                pid = pearls[k]["id"]
+                best_cand = slots[j][0]
+                start = starts[k]
+                if best_cand != start:
+                    prev = start
+                    for curr in self.topology.path(start, best_cand)[1:]:
+                        self.workload[prev] += 1
+                        works[k] += 1
+                        plans[k].append([1, {"Pass":{"pearl_id":pid,"to_worker":curr}}])
+                        prev = curr
+                nom = self.layer_costs(pearls[k]["layers"][-1 - i])[self.worker_flavor[best_cand]]
+                self.workload[best_cand] += nom
+                works[k] += nom
+                plans[k].append([nom, {"Nom": pid}])
+                starts[k] = best_cand
+
+        for k in range(len(pearls)):
+            works[k] += self.add_return_path(pearls[k]["id"], plans[k], starts[k])
+        return list(zip(plans, works))
+
     
+    def remember_nom(self, worker, last):
+        """Keep the outer layer of a pearl that is Nommed this turn, so the
+        thinning can be measured on the next turn, see calibrate_rates.
+
+        Keyword arguments:
+        worker -- the state of the worker taking the action
+        last   -- (pearl, index of the plan step) of the action
+        """
+        pearl, step = last
+        if pearl.ops[step] != NOM:
+            return
+        for p in worker["desk"]:
+            if p["id"] == pearl.id:
+                if p["layers"]:
+                    layer = p["layers"][-1]
+                    self.noms.append((pearl.id, worker["id"], step, len(p["layers"]), layer["color"], layer["thickness"]))
+                return
+
+    def observe_rate(self, flavor, color, thinned, dissolved):
+        """Update the rate estimate of a flavor of worker on a color.
+
+        A layer that was only thinned out gives the rate, a layer that was
+        dissolved only shows the rate is at least its thickness. The
+        estimate is the mean of the rates seen, but never below the thickest
+        layer dissolved in one Nom, nor below 1. A layer that didn't get
+        thinner wasn't Nommed, e.g. the action was dropped, and is ignored.
+
+        Keyword arguments:
+        flavor    -- flavor of the worker that did the Nom
+        color     -- color of the layer
+        thinned   -- thickness the layer lost
+        dissolved -- whether the layer is gone
+        """
+        if thinned <= 0:
+            return
+        key = (flavor, color)
+        if dissolved:
+            self.rate_floors[key] = max(self.rate_floors[key], thinned)
+        else:
+            self.rate_sums[key] += thinned
+            self.rate_counts[key] += 1
+        rate = self.processing_rate[flavor][color]
+        if self.rate_counts[key]:
+            rate = self.rate_sums[key] / self.rate_counts[key]
+        rate = max(rate, self.rate_floors[key], 1)
+        if rate != self.processing_rate[flavor][color]:
+            # cached plans were made with the old rate
+            self.plan_cache.clear()
+        self.processing_rate[flavor][color] = rate
+
+    def calibrate_rates(self, state):
+        """Measure the Noms of the last turn and fix the plans they upset.
+
+        Each pearl Nommed on the last turn is looked up on the desk of the
+        worker that Nommed it. How much its outer layer thinned out updates
+        the rate estimate of the worker's flavor, see observe_rate, which
+        new plans are made with. If the layer isn't where the plan expects
+        it to be, i.e. it's gone while Noms are left for it or the Noms left
+        don't match its thickness, the rest of the pearl is replanned from
+        the worker with the estimates. Plans aren't corrected with the
+        "timeline" planner, whose bookings can't be undone.
+
+        Keyword arguments:
+        state -- The current state of the system
+        """
+        noms = self.noms
+        self.noms = []
+        corrected = 0
+        for pid, wid, step, count, color, thickness in noms:
+            desk = state["workers"][wid]["desk"]
+            layers = None
+            for p in desk:
+                if p["id"] == pid:
+                    layers = p["layers"]
+                    break
+            if layers is None:
+                continue
+
+            flavor = self.worker_flavor[wid]
+            dissolved = len(layers) < count
+            if dissolved:
+                self.observe_rate(flavor, color, thickness, True)
+            else:
+                self.observe_rate(flavor, color, thickness - layers[-1]["thickness"], False)
+
+            pearl = self.pearl_map.get(pid)
+            if pearl is None or self.planner == "timeline":
+                continue
+            on_step = pearl.cursor == step and not pearl.finished
+            if dissolved:
+                off_plan = on_step
+            else:
+                needed = math.ceil(layers[-1]["thickness"] / self.processing_rate[flavor][color])
+                off_plan = not on_step or pearl.counts[step] != needed
+            if off_plan:
+                self.replan_pearl(pearl, wid, layers)
+                if pid in self.located:
+                    self.located[pid] = (wid, self.turn, pearl.work)
+                corrected += 1
+        self.turn_corrected = corrected
+        self.total_corrected += corrected
+
+    def compact(self):
+        """Shrink the bookkeeping after a burst of pearls has drained.
+
+        Dicts and sets keep the room they grew to when entries are removed,
+        so after a burst the pearl map, the drift heap and the queues of the
+        workers stay as big as they were at the peak. They are rebuilt at
+        their current size, and drift checks of pearls that are gone or
+        moved on are dropped instead of waiting for their deadline.
+        """
+        self.pearl_map = dict(self.pearl_map)
+        self.located = dict(self.located)
+        self.refine_checked = dict(self.refine_checked)
+        self.deferred = dict(self.deferred)
+        self.drift = [entry for entry in self.drift
+                      if entry[1] in self.located and self.located[entry[1]][1] == entry[2]]
+        heapq.heapify(self.drift)
+        for worker in self.workers.values():
+            worker.compact()
+        self.peak_in_flight = self.in_flight
+
     def process(self, state):
         """Processes the state and any associated state changes.
 
@@ -271,38 +1694,124 @@ class Atlantis:
                                  {[worker_id]: "Pass": {"pearl_id":[pearl_id],"to_worker":[to_worker_id]}}
 
         """
+        started = time.perf_counter()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(self.turn)
+
+        # Take the coordinator back from the refiner
+        if self.refiner is not None:
+            self.stop_refining()
+            if profiler is not None:
+                profiler.mark("refinement")
+
         if not self.initialized:
             self.initialize(state)
+        if profiler is not None:
+            profiler.mark("initialize")
+
+        # Learn the processing rates from the Noms of the last turn
+        if self.calibrate:
+            self.calibrate_rates(state)
+            if profiler is not None:
+                profiler.mark("calibration")
 
         # for each new pearl, create a plan and create a pearl 
         # that tracks the plan 
         gatekeeper = state["workers"][0]
-        for pearl in gatekeeper["desk"]:
+        new_pearls = [pearl for pearl in gatekeeper["desk"] if pearl["id"] not in self.pearl_map]
+        if self.time_budget:
+            deadline = started + self.time_budget - self.rest_time
+            planned = self.plan_within_budget(new_pearls, deadline)
+        elif self.planner == "batch":
+            planned = self.plan_batch(new_pearls)
+        elif self.planner == "timeline":
+            planned = [self.plan_timed(pearl) for pearl in new_pearls]
+        else:
+            planned = [self.plan_pearl(pearl) for pearl in new_pearls]
+        for pearl, (plan, work) in zip(new_pearls, planned):
             pid = pearl["id"]
-            if pid not in self.pearl_map:
-                plan, work = self.plan_pearl(pearl)
-                self.pearl_map[pid] = Pearl(pid, plan, work, len(pearl["layers"]))
+            self.pearl_map[pid] = Pearl(pid, plan, work, len(pearl["layers"]))
+            if work == 0:
+                self.completions.append(pid)
 
-        # Designate the actions for each worker
-        actions = {}
-        for worker in state["workers"]:
+        # Use the time left for full plans of pearls that got a quick one
+        if self.time_budget:
+            if self.deferred and self.plan_time is not None:
+                self.plan_deferred(deadline)
+            planned_at = time.perf_counter()
+        if profiler is not None:
+            profiler.mark("planning")
+
+        deltas = [self.desks.diff(worker["id"], worker["desk"]) for worker in state["workers"]]
+        if profiler is not None:
+            profiler.mark("dispatch")
+
+        # Watch where pearls are waiting and replan the ones that drifted
+        if self.replan_budget:
+            for worker, delta in zip(state["workers"], deltas):
+                if delta is not None:
+                    for pid in delta[0]:
+                        self.watch(pid, worker["id"])
+            self.replan_drifted(state)
+
+        # Let idle workers take work off their overloaded neighbors
+        if self.steal:
+            self.steal_work(state)
+        if profiler is not None:
+            profiler.mark("replanning")
+
+        # Designate the actions for each worker, only the changes to each
+        # desk are handed over and idle workers with unchanged desks are skipped
+        actions = []
+        for worker, delta in zip(state["workers"], deltas):
             wid = worker["id"]
-            desk = worker["desk"]
-            act = self.workers[wid].process(desk, self.pearl_map)
+            if delta is None:
+                if self.workers[wid].idle():
+                    continue
+                delta = ((), ())
+            arrivals, departures = delta
+            act = self.workers[wid].process_delta(arrivals, departures, self.pearl_map)
             if act is not None:
-                actions[wid] = act
+                actions.append(self.worker_keys[wid] + act)
                 if self.workload[wid]:
                     self.workload[wid] -= 1
+                if self.calibrate:
+                    self.remember_nom(worker, self.workers[wid].last)
+        if profiler is not None:
+            profiler.mark("dispatch")
 
-        # Clean up finished pearls
-        finished_pearls = set()
-        for pid in self.pearl_map:
-            if self.pearl_map[pid].work == 0:
-                finished_pearls.add(pid)
-        for pid in finished_pearls:
+        # Clean up finished pearls, workers report them as they complete
+        completed = 0
+        while self.completions:
+            pid = self.completions.popleft()
             self.pearl_map.pop(pid, None)
+            self.located.pop(pid, None)
+            self.refine_checked.pop(pid, None)
+            self.deferred.pop(pid, None)
+            completed += 1
+        self.turn_completed = completed
+        self.total_completed += completed
+        self.in_flight = len(self.pearl_map)
+        self.turn += 1
+        if self.long_run:
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.peak_in_flight >= self.compact_floor and self.in_flight * 4 <= self.peak_in_flight:
+                self.compact()
+        if profiler is not None:
+            profiler.mark("cleanup")
+
+        # Join the pre-encoded actions so that atlantis output can be processed
+        actions_string = "{" + ",".join(actions) + "}"
+        if self.time_budget:
+            self.rest_time = time.perf_counter() - planned_at
+        if profiler is not None:
+            profiler.mark("serialization")
+            profiler.end([len(self.workers[wid].pearls) for wid in range(len(self.workers))],
+                         {"degraded_fraction": self.degraded_fraction} if self.time_budget else None)
 
-        # Dump actions string so that atlantis output can be processed
-        actions_string = json.dumps(actions)
+        # Improve plans while the next state is on its way
+        if self.refine_between:
+            self.start_refining(state)
         return actions_string
 
@@ -0,0 +1,167 @@
+import re
+import json
+
+# orjson is optional, the standard library json module is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Decode a JSON document.
+
+    Keyword arguments:
+    data -- JSON document as str or bytes
+
+    Returns:
+    obj -- the decoded object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Encode an object as a JSON string.
+
+    Keyword arguments:
+    obj -- the object to encode, integer keys are written as strings
+
+    Returns:
+    data -- the JSON string
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
+
+# a JSON string literal, escapes included
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+# the colon after a key and the start of a list value, or an empty list
+LIST_VALUE = re.compile(rb"\s*:\s*\[(\s*\])?")
+
+
+def depth(data):
+    """Brackets and braces opened minus closed in a run of JSON, strings skipped.
+
+    Keyword arguments:
+    data -- raw JSON that starts and ends outside of a string
+
+    Returns:
+    depth -- the nesting depth at the end of data relative to its start,
+             None if data ends inside a string
+    """
+    data = STRING.sub(b"", data)
+    if b'"' in data:
+        return None
+    return data.count(b"[") + data.count(b"{") - data.count(b"]") - data.count(b"}")
+
+
+def skip_field(data, key):
+    """Cut a top level field holding a list of lists out of a raw JSON object.
+
+    Only meant for fields like the neighbor map, i.e. lists of lists of
+    numbers, which can't hold a "]]" anywhere but at their end. The
+    key is only cut where it's a key of the outer object: a string
+    equal to it inside a pearl, or a field of the same name nested in
+    one, is left alone. Whether a match is at the top level is found
+    by counting brackets on whichever side of it is shorter, with
+    strings skipped, so it costs about as much as a scan of the short
+    side.
+
+    Keyword arguments:
+    data -- raw JSON object as bytes
+    key  -- name of the field to cut out, as bytes
+
+    Returns:
+    data -- the JSON object without the field, unchanged if the field
+            is missing or doesn't look like a top level list of lists
+    """
+    quoted = b'"' + key + b'"'
+    start = data.find(quoted)
+    while start != -1:
+        end = cut_end(data, start + len(quoted))
+        if end is not None and is_top_level(data, start, end):
+            # drop the comma separating the field from its neighbors
+            head = data[:start].rstrip()
+            tail = data[end:].lstrip()
+            if head.endswith(b","):
+                head = head[:-1]
+            elif tail.startswith(b","):
+                tail = tail[1:]
+            return head + tail
+        start = data.find(quoted, start + 1)
+    return data
+
+
+def cut_end(data, after):
+    """Where the list of lists following a key ends.
+
+    Keyword arguments:
+    data  -- raw JSON object as bytes
+    after -- position right after the quoted key
+
+    Returns:
+    end -- position right after the value, None if the key isn't
+           followed by a colon and a list of lists without strings
+    """
+    match = LIST_VALUE.match(data, after)
+    if match is None:
+        return None
+    if match.group(1):
+        return match.end()
+    begin = match.end() - 1
+    end = data.find(b"]]", begin)
+    if end == -1:
+        return None
+    end += 2
+    # without strings the brackets are all real, balanced ones end the value
+    if data.find(b'"', begin, end) != -1 or data.count(b"[", begin, end) != data.count(b"]", begin, end):
+        return None
+    return end
+
+
+def is_top_level(data, start, end):
+    """Whether a field is a field of the outer object.
+
+    Keyword arguments:
+    data  -- raw JSON object as bytes
+    start -- position of the quote opening the key
+    end   -- position right after the value
+
+    Returns:
+    top -- True if the key opens a string and sits one level deep
+    """
+    # a quote escaped by an odd number of backslashes is inside a string
+    escapes = 0
+    while start - escapes > 0 and data[start - escapes - 1] == ord("\\"):
+        escapes += 1
+    if escapes % 2:
+        return False
+    if start < len(data) - end:
+        return depth(data[:start]) == 1
+    return depth(data[end:]) == -1
+
+
+def decode_state(data, initialized):
+    """Decode a state, skipping what the coordinator no longer reads.
+
+    The neighbor map is only needed to initialize the coordinator and is
+    usually the largest part of a state, so later states are decoded
+    without it.
+
+    Keyword arguments:
+    data        -- raw state as bytes
+    initialized -- whether the coordinator has been initialized already
+
+    Returns:
+    state -- the decoded state
+    """
+    if not initialized:
+        return loads(data)
+    state = loads(skip_field(data, b"neighbor_map"))
+    # a neighbor map skip_field couldn't place is decoded and dropped
+    state.pop("neighbor_map", None)
+    return state
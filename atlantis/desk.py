@@ -0,0 +1,35 @@
+class DeskTracker:
+    """Keeps track of the desk of every worker between turns.
+
+    Most desks don't change from one turn to the next, so instead of
+    handing the whole desk to a worker every turn only the pearls that
+    arrived or departed since the previous turn are passed along.
+    """
+
+    def __init__(self):
+        """Constructor for DeskTracker."""
+        self.desks = {}     # worker id to pearl ids on the desk last turn
+
+    def diff(self, wid, desk):
+        """Compare a desk against the previous turn.
+
+        Keyword arguments:
+        wid  -- id of the worker owning the desk
+        desk -- current desk of the worker, list of pearls
+
+        Returns:
+        arrivals   -- ids of pearls new to the desk, in desk order
+        departures -- ids of pearls that left the desk
+        None if the desk did not change.
+        """
+        ids = [pearl["id"] for pearl in desk]
+        prev = self.desks.get(wid, [])
+        if ids == prev:
+            return None
+        self.desks[wid] = ids
+
+        prev_ids = set(prev)
+        curr_ids = set(ids)
+        arrivals = [pid for pid in ids if pid not in prev_ids]
+        departures = [pid for pid in prev if pid not in curr_ids]
+        return arrivals, departures
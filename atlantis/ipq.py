@@ -0,0 +1,108 @@
+class IndexedHeap:
+    """Binary min-heap of ids that can be addressed by id.
+
+    Entries are ordered by (cost, id), the same order a heap of
+    (cost, id) tuples would give. Keeping the position of every id
+    allows changing the cost of an entry or removing it in O(log n)
+    instead of pushing duplicates or rebuilding the heap.
+    """
+
+    def __init__(self):
+        """Constructor for IndexedHeap."""
+        self.heap = []      # ids in heap order
+        self.cost = {}      # id to cost
+        self.pos = {}       # id to index in heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def __contains__(self, key):
+        return key in self.pos
+
+    def less(self, a, b):
+        """Whether id a goes before id b."""
+        cost_a = self.cost[a]
+        cost_b = self.cost[b]
+        return cost_a < cost_b or (cost_a == cost_b and a < b)
+
+    def swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.pos[heap[i]] = i
+        self.pos[heap[j]] = j
+
+    def sift_up(self, i):
+        heap = self.heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self.less(heap[i], heap[parent]):
+                break
+            self.swap(i, parent)
+            i = parent
+
+    def sift_down(self, i):
+        heap = self.heap
+        size = len(heap)
+        while True:
+            smallest = i
+            left = 2 * i + 1
+            right = left + 1
+            if left < size and self.less(heap[left], heap[smallest]):
+                smallest = left
+            if right < size and self.less(heap[right], heap[smallest]):
+                smallest = right
+            if smallest == i:
+                break
+            self.swap(i, smallest)
+            i = smallest
+
+    def push(self, key, cost):
+        """Add an id with a cost, or change its cost if it's already there."""
+        if key in self.pos:
+            self.update(key, cost)
+            return
+        self.cost[key] = cost
+        self.pos[key] = len(self.heap)
+        self.heap.append(key)
+        self.sift_up(len(self.heap) - 1)
+
+    def peek(self):
+        """Get the (cost, id) with the lowest cost without removing it."""
+        key = self.heap[0]
+        return self.cost[key], key
+
+    def pop(self):
+        """Remove and return the (cost, id) with the lowest cost."""
+        key = self.heap[0]
+        cost = self.cost[key]
+        self.remove(key)
+        return cost, key
+
+    def update(self, key, cost):
+        """Change the cost of an id, moving it up or down as needed."""
+        old = self.cost[key]
+        self.cost[key] = cost
+        if cost < old:
+            self.sift_up(self.pos[key])
+        elif cost > old:
+            self.sift_down(self.pos[key])
+
+    def remove(self, key):
+        """Remove an id from the heap."""
+        i = self.pos.pop(key)
+        del self.cost[key]
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.pos[last] = i
+            self.sift_up(i)
+            self.sift_down(self.pos[last])
+
+    def compact(self):
+        """Rebuild the lookup dicts at their current size, dicts don't shrink
+        when entries are removed."""
+        self.cost = dict(self.cost)
+        self.pos = dict(self.pos)
@@ -1,52 +1,143 @@
-from collections import deque
+import json
+from array import array
+
+# operation codes of plan steps
+NOM = 0
+PASS = 1
 
 class Pearl:
-    """Pearl object holding pearl planning information"""
+    """Pearl object holding pearl planning information.
+
+    The plan is kept as parallel arrays of operation codes, target workers
+    and remaining counts with a cursor at the current step, so live pearls
+    don't hold on to a dict per step. Action dicts are only built when an
+    action is handed out.
+
+    Each step also carries its action pre-encoded as a JSON fragment, built
+    once with the plan, so the coordinator can write its output by joining
+    fragments instead of encoding dicts every turn.
+    """
+
+    __slots__ = ("id", "ops", "targets", "counts", "fragments", "cursor", "started", "work", "finished", "layers")
+
     def __init__(self, pid, plan, work, layers):
         """Constructor for Pearl.
 
-        Keyword arguments: 
+        Keyword arguments:
         pid    -- id of pearl
-        plan   -- computed plan for dissolving layers of pearl
+        plan   -- computed plan for dissolving layers of pearl,
+                  list of [count, {"Nom": pid}] or [count, {"Pass": {...}}] steps
         work   -- amount of turns necessary for finishing work on the pearl based on plan
         layers -- number of layers to dissolve for the pearl
         """
         self.id = pid
-        self.plan = deque(plan)
-        # import sys
-        # print(self.plan, file=sys.stderr)
+        self.load(plan)
         self.work = work
         self.finished = False
         self.layers = layers
 
+    def load(self, plan):
+        """Store the steps of a plan and point the cursor at the first one.
+
+        Keyword arguments:
+        plan -- list of [count, action] steps, see the constructor
+        """
+        self.ops = array("b")           # NOM or PASS
+        self.targets = array("q")       # worker the pearl is passed to, -1 for Noms
+        self.counts = array("q")        # remaining number of turns of each step
+        self.fragments = []             # JSON encoded action of each step
+        pid_json = json.dumps(self.id)
+        nom = '{"Nom":' + pid_json + '}'
+        for count, action in plan:
+            if "Nom" in action:
+                self.ops.append(NOM)
+                self.targets.append(-1)
+                self.fragments.append(nom)
+            else:
+                to = action["Pass"]["to_worker"]
+                self.ops.append(PASS)
+                self.targets.append(to)
+                self.fragments.append('{"Pass":{"pearl_id":' + pid_json + ',"to_worker":' + json.dumps(to) + '}}')
+            self.counts.append(count)
+        self.cursor = 0
+        self.started = False            # whether the current step has been partly done
+
+    def replan(self, plan, work, layers):
+        """Replace the rest of the plan with a new one.
+
+        Keyword arguments:
+        plan   -- the new plan from wherever the pearl is now
+        work   -- amount of turns necessary for finishing the new plan
+        layers -- number of layers still to dissolve
+        """
+        self.load(plan)
+        self.work = work
+        self.layers = layers
+        self.finished = layers == 0
+
+    def local_work(self):
+        """Number of turns the current holder is planned to work on the pearl,
+        up to and including the Pass that sends it on."""
+        work = 0
+        for i in range(self.cursor, len(self.ops)):
+            work += self.counts[i]
+            if self.ops[i] == PASS:
+                break
+        return work
+
+    @property
+    def plan(self):
+        """Remaining steps of the plan as [count, action] pairs, mostly for debugging."""
+        return [[self.counts[i], self.action(i)] for i in range(self.cursor, len(self.ops))]
+
+    def action(self, i):
+        """Build the action of step i of the plan."""
+        if self.ops[i] == NOM:
+            return {"Nom": self.id}
+        return {"Pass": {"pearl_id": self.id, "to_worker": self.targets[i]}}
+
+    def next_op(self):
+        """Operation code of the next step of the plan."""
+        return self.ops[self.cursor]
+
     def peek(self):
         """Look at the next step of the plan."""
-        return self.plan[0]
+        return self.counts[self.cursor], self.action(self.cursor)
 
-    def process(self):
-        """Gets the next action.
+    def advance(self):
+        """Moves the plan forward by one turn.
 
-        Returns the next action that needs to be taken.
-        Moves plan forward as necessary. 
         If all the layers are removed, then the pearl is marked as finished.
 
-        Also keeps track of the amount of work left for the pearl, 
+        Also keeps track of the amount of work left for the pearl,
         mostly for debugging purposes.
-        
+
         Returns:
-        action -- next action to perform for the Pearl,
-                  type is either Nom or Pass
+        i -- index of the step that was acted on, see action and fragments
         """
-        action = self.peek()
-        action[0] -= 1
-        if action[0] == 0:
-            self.plan.popleft()
-            if "Nom" in action[1]:
+        i = self.cursor
+        self.counts[i] -= 1
+        self.started = self.counts[i] > 0
+        if self.counts[i] == 0:
+            self.cursor += 1
+            if self.ops[i] == NOM:
                 self.layers -= 1
 
-                # No more layers: we're done with the plan or we're just passing the 
+                # No more layers: we're done with the plan or we're just passing the
                 # pearl back to the gatekeeper
                 if self.layers == 0:
                     self.finished = True
         self.work -= 1
-        return action[1]
\ No newline at end of file
+        return i
+
+    def process(self):
+        """Gets the next action.
+
+        Returns the next action that needs to be taken.
+        Moves plan forward as necessary, see advance.
+
+        Returns:
+        action -- next action to perform for the Pearl,
+                  type is either Nom or Pass
+        """
+        return self.action(self.advance())
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import heapq
+from collections import deque
+
+# phases of Atlantis.process, in the order they run
+PHASES = ("refinement", "initialize", "calibration", "planning", "replanning", "dispatch", "cleanup", "serialization")
+
+class Profiler:
+    """Per-turn profile of the coordinator.
+
+    Each turn gets a record with the time spent in every phase of
+    Atlantis.process, the number of heap pushes and pops done by the
+    Dijkstra's searches and the queue depth of every worker. Records are
+    kept in a ring buffer holding the last `capacity` turns, which can be
+    dumped to a file as JSON lines.
+
+    The environment kills the coordinator at the end of a run without a
+    signal it could catch, so a dump on exit never happens there. With
+    autosave every record is also appended to the file as its turn ends,
+    see save.
+
+    The coordinator only touches the profiler if one is attached, so a
+    coordinator without one doesn't pay for it.
+    """
+
+    def __init__(self, capacity=1024):
+        """Constructor for Profiler.
+
+        Keyword arguments:
+        capacity -- number of turns kept in the ring buffer (default 1024)
+        """
+        self.records = deque(maxlen=capacity)
+        self.clock = time.perf_counter
+        self.pushes = 0         # heap pushes on the current turn
+        self.pops = 0           # heap pops on the current turn
+        self.phases = None      # phase to seconds spent on the current turn
+        self.turn = None        # the current turn
+        self.last = 0.0         # time of the last mark
+        self.file = None        # file records are appended to, see autosave
+        self.path = None        # path of that file
+        self.saved = 0          # records in that file
+
+    def heappush(self, heap, item):
+        """heapq.heappush that counts the push."""
+        self.pushes += 1
+        heapq.heappush(heap, item)
+
+    def heappop(self, heap):
+        """heapq.heappop that counts the pop."""
+        self.pops += 1
+        return heapq.heappop(heap)
+
+    def begin(self, turn):
+        """Start the record of a turn.
+
+        Keyword arguments:
+        turn -- number of the turn
+        """
+        self.turn = turn
+        self.phases = {}
+        self.pushes = 0
+        self.pops = 0
+        self.last = self.clock()
+
+    def mark(self, phase):
+        """Close a phase, the time since the previous mark is added to it.
+
+        A phase can be marked more than once a turn, its times add up.
+
+        Keyword arguments:
+        phase -- name of the phase that just ended, see PHASES
+        """
+        now = self.clock()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end(self, depths, counters=None):
+        """Store the record of the turn in the ring buffer.
+
+        Keyword arguments:
+        depths   -- number of pearls queued at each worker
+        counters -- other numbers of the turn to add to the record, e.g.
+                    "degraded_fraction" (default None)
+        """
+        record = {
+            "turn": self.turn,
+            "phases_us": {phase: seconds * 1e6 for phase, seconds in self.phases.items()},
+            "heap_pushes": self.pushes,
+            "heap_pops": self.pops,
+            "queue_depths": depths,
+        }
+        if counters:
+            record.update(counters)
+        self.records.append(record)
+        if self.file is not None:
+            self.save(record)
+
+    def autosave(self, path):
+        """Append every record to a file as its turn ends.
+
+        Keyword arguments:
+        path -- file to write to, emptied first
+        """
+        self.path = path
+        self.file = open(path, "w")
+        self.saved = 0
+
+    def save(self, record):
+        """Append a record to the autosave file and flush it.
+
+        Once the file holds twice the capacity it's rewritten with only
+        the buffered records, so it holds at least the last `capacity`
+        turns and never more than twice that.
+
+        Keyword arguments:
+        record -- the record of the turn that just ended
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.saved += 1
+        if self.saved >= 2 * self.records.maxlen:
+            self.file.close()
+            self.dump(self.path)
+            self.file = open(self.path, "a")
+            self.saved = len(self.records)
+
+    def close(self):
+        """Stop appending records to the autosave file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def summary(self):
+        """Mean time per phase and mean counters over the buffered turns.
+
+        Returns:
+        summary -- dict with the number of turns, mean phase times in
+                   microseconds, mean heap pushes and pops, the deepest queue
+                   and the mean fraction of degraded plans if it was recorded
+        """
+        count = len(self.records)
+        if not count:
+            return {"turns": 0}
+        phases = {}
+        for record in self.records:
+            for phase, us in record["phases_us"].items():
+                phases[phase] = phases.get(phase, 0.0) + us
+        summary = {
+            "turns": count,
+            "phases_us": {phase: us / count for phase, us in phases.items()},
+            "heap_pushes": sum(r["heap_pushes"] for r in self.records) / count,
+            "heap_pops": sum(r["heap_pops"] for r in self.records) / count,
+            "max_queue_depth": max(max(r["queue_depths"], default=0) for r in self.records),
+        }
+        if "degraded_fraction" in self.records[-1]:
+            summary["degraded_fraction"] = sum(r.get("degraded_fraction", 0.0) for r in self.records) / count
+        return summary
+
+    def dump(self, path):
+        """Write the buffered records to a file, one JSON object per line.
+
+        The records are written to a temporary file that then replaces
+        the file, so a process killed halfway leaves the old one whole.
+
+        Keyword arguments:
+        path -- file to write to
+        """
+        with open(path + ".tmp", "w") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,215 @@
+import math
+import random
+from .atlantis import PROCESSING_RATE
+from .codec import loads
+
+TOPOLOGIES = ("line", "ring", "grid", "star", "random")
+COLORS = ("Red", "Green", "Blue")
+
+def generate_topology(kind, size, rng):
+    """Generate the neighbor map of a connected topology.
+
+    Keyword arguments:
+    kind -- shape of the topology, one of TOPOLOGIES
+    size -- number of workers
+    rng  -- random.Random used for random topologies
+
+    Returns:
+    neighbor_map -- list of [u, v] pairs of neighboring worker ids
+    """
+    edges = []
+    if kind == "line" or kind == "ring":
+        edges = [[i, i + 1] for i in range(size - 1)]
+        if kind == "ring" and size > 2:
+            edges.append([size - 1, 0])
+    elif kind == "grid":
+        width = math.ceil(math.sqrt(size))
+        for i in range(size):
+            if (i + 1) % width and i + 1 < size:
+                edges.append([i, i + 1])
+            if i + width < size:
+                edges.append([i, i + width])
+    elif kind == "star":
+        edges = [[0, i] for i in range(1, size)]
+    elif kind == "random":
+        # random spanning tree keeps it connected, then add some shortcuts
+        seen = set()
+        for i in range(1, size):
+            u = rng.randrange(i)
+            edges.append([u, i])
+            seen.add((u, i))
+        for _ in range(size // 2):
+            u, v = sorted(rng.sample(range(size), 2))
+            if (u, v) not in seen:
+                edges.append([u, v])
+                seen.add((u, v))
+    else:
+        raise ValueError("unknown topology: {}".format(kind))
+    return edges
+
+
+class Simulator:
+    """Headless stand-in for the Atlantis environment.
+
+    Generates a topology and a stream of pearls from a seed and applies
+    the actions of a coordinator to them, so whole games can be played
+    in-process without the environment binary.
+
+    Semantics:
+    - Nom dissolves the outermost layer, the last one in the list, by
+      the rate of the worker's flavor for the layer's color, the layer
+      is gone once its thickness reaches 0 and what's left of the rate
+      is lost
+    - Pass moves a pearl to a neighboring worker's desk at the end of
+      the turn
+    - A pearl without layers on the gatekeeper's desk scores a point
+      and leaves the game
+    - Invalid actions are ignored and counted
+    """
+
+    def __init__(self, size=10, topology="random", arrival_rate=0.3, max_layers=3,
+                 max_thickness=15, seed=0, arrival_turns=None, processing_rate=PROCESSING_RATE):
+        """Constructor for Simulator.
+
+        Keyword arguments:
+        size            -- number of workers, worker 0 is the gatekeeper (default 10)
+        topology        -- shape of the topology, one of TOPOLOGIES (default "random")
+        arrival_rate    -- expected number of new pearls per turn (default 0.3)
+        max_layers      -- maximum number of layers per pearl (default 3)
+        max_thickness   -- maximum thickness of a layer (default 15)
+        seed            -- seed for the topology and the pearls (default 0)
+        arrival_turns   -- number of turns pearls keep arriving, None for all (default None)
+        processing_rate -- flavor to color to rate mapping (default PROCESSING_RATE)
+        """
+        self.rng = random.Random(seed)
+        self.size = size
+        self.arrival_rate = arrival_rate
+        self.max_layers = max_layers
+        self.max_thickness = max_thickness
+        self.arrival_turns = arrival_turns
+        self.processing_rate = processing_rate
+
+        self.neighbor_map = generate_topology(topology, size, self.rng)
+        self.neighbors = [set() for _ in range(size)]
+        for u, v in self.neighbor_map:
+            self.neighbors[u].add(v)
+            self.neighbors[v].add(u)
+
+        # the gatekeeper is always a General worker
+        flavors = list(processing_rate)
+        self.flavors = ["General"] + [self.rng.choice(flavors) for _ in range(size - 1)]
+
+        # desks are updated in place, the state hands out the same lists
+        self.desks = [[] for _ in range(size)]
+        self.workers = [{"id": i, "flavor": self.flavors[i], "desk": self.desks[i]} for i in range(size)]
+
+        self.turn = 0
+        self.score = 0              # pearls brought back to the gatekeeper
+        self.arrived = 0            # pearls that entered the game
+        self.invalid = 0            # actions that couldn't be applied
+        self.pearl_ids = set()
+        self.arrive()
+
+    def state(self):
+        """Current state in the format of the environment.
+
+        Returns:
+        state -- workers with their flavor and desk, neighbor map and score
+        """
+        return {"workers": self.workers, "neighbor_map": self.neighbor_map, "score": self.score}
+
+    def new_pearl(self):
+        """Generate a pearl with a fresh id and random layers."""
+        pid = self.rng.getrandbits(32)
+        while pid in self.pearl_ids:
+            pid = self.rng.getrandbits(32)
+        self.pearl_ids.add(pid)
+        layers = [{"color": self.rng.choice(COLORS), "thickness": self.rng.randint(1, self.max_thickness)}
+                  for _ in range(self.rng.randint(1, self.max_layers))]
+        return {"id": pid, "layers": layers}
+
+    def arrive(self):
+        """Put this turn's new pearls on the gatekeeper's desk."""
+        if self.arrival_turns is not None and self.turn >= self.arrival_turns:
+            return
+        count = int(self.arrival_rate)
+        if self.rng.random() < self.arrival_rate - count:
+            count += 1
+        for _ in range(count):
+            self.desks[0].append(self.new_pearl())
+        self.arrived += count
+
+    def find(self, wid, pid):
+        """Index of a pearl on a worker's desk, -1 if it isn't there."""
+        desk = self.desks[wid]
+        for i in range(len(desk)):
+            if desk[i]["id"] == pid:
+                return i
+        return -1
+
+    def step(self, actions):
+        """Apply the actions of a turn and move on to the next turn.
+
+        Keyword arguments:
+        actions -- worker id to action mapping, as a dict or JSON string
+        """
+        if isinstance(actions, (str, bytes)):
+            actions = loads(actions)
+
+        passes = []
+        for wid, action in actions.items():
+            wid = int(wid)
+            if "Nom" in action:
+                i = self.find(wid, action["Nom"])
+                if i == -1 or not self.desks[wid][i]["layers"]:
+                    self.invalid += 1
+                    continue
+                layers = self.desks[wid][i]["layers"]
+                layers[-1]["thickness"] -= self.processing_rate[self.flavors[wid]][layers[-1]["color"]]
+                if layers[-1]["thickness"] <= 0:
+                    layers.pop()
+            elif "Pass" in action:
+                pid = action["Pass"]["pearl_id"]
+                to = action["Pass"]["to_worker"]
+                i = self.find(wid, pid)
+                if i == -1 or to not in self.neighbors[wid]:
+                    self.invalid += 1
+                    continue
+                passes.append((wid, to, self.desks[wid].pop(i)))
+            else:
+                self.invalid += 1
+
+        # passes happen at the same time, after every worker has acted
+        for wid, to, pearl in passes:
+            self.desks[to].append(pearl)
+
+        # clean pearls at the gatekeeper are done
+        gatekeeper = self.desks[0]
+        done = [pearl for pearl in gatekeeper if not pearl["layers"]]
+        if done:
+            gatekeeper[:] = [pearl for pearl in gatekeeper if pearl["layers"]]
+            for pearl in done:
+                self.pearl_ids.discard(pearl["id"])
+            self.score += len(done)
+
+        self.turn += 1
+        self.arrive()
+
+    def in_flight(self):
+        """Number of pearls currently in the game."""
+        return sum(len(desk) for desk in self.desks)
+
+    def run(self, atlantis, turns):
+        """Play a game with a coordinator.
+
+        Keyword arguments:
+        atlantis -- the coordinator, anything with a process(state) method
+                    returning the actions as a JSON string
+        turns    -- number of turns to play
+
+        Returns:
+        score -- number of pearls brought back to the gatekeeper
+        """
+        for _ in range(turns):
+            self.step(atlantis.process(self.state()))
+        return self.score
@@ -0,0 +1,99 @@
+from bisect import bisect_left, bisect_right
+
+class Timeline:
+    """Calendar of the turns a worker is booked for.
+
+    Bookings are kept as sorted, non-overlapping [start, end) intervals of
+    turns, adjacent bookings are merged. A worker takes one action per
+    turn, so a Nom of n turns books n turns and a Pass books one.
+
+    Workers don't follow the bookings to the turn, so the timeline is
+    synced with the actual backlog of the worker every turn. Booked turns
+    that went by without the work getting done are carried as a lag, which
+    pushes the whole calendar back, see sync.
+    """
+
+    def __init__(self):
+        """Constructor for Timeline."""
+        self.starts = []    # start turn of each booking
+        self.ends = []      # end turn (exclusive) of each booking
+        self.now = 0        # turn of the last sync
+        self.lag = 0        # turns the worker is behind its bookings
+
+    def __len__(self):
+        return len(self.starts)
+
+    def prune(self, now):
+        """Forget bookings that ended before the current turn."""
+        i = bisect_right(self.ends, now)
+        if i:
+            del self.starts[:i]
+            del self.ends[:i]
+
+    def sync(self, now, backlog):
+        """Move the timeline to the current turn.
+
+        Keyword arguments:
+        now     -- the current turn
+        backlog -- number of actions the worker still has to take
+        """
+        self.now = now
+        self.prune(now)
+        booked = 0
+        for start, end in zip(self.starts, self.ends):
+            booked += end - max(start, now)
+        self.lag = max(0, backlog - booked)
+
+    def earliest(self, ready, duration):
+        """Find the earliest free stretch of turns.
+
+        Keyword arguments:
+        ready    -- the first turn the work could start on
+        duration -- number of consecutive turns needed
+
+        Returns:
+        start -- first turn of the earliest free stretch starting at or after ready
+        """
+        starts = self.starts
+        ends = self.ends
+        t = max(ready - self.lag, self.now)
+        i = bisect_right(ends, t)
+        while i < len(starts):
+            if starts[i] >= t + duration:
+                break
+            if ends[i] > t:
+                t = ends[i]
+            i += 1
+        return t + self.lag
+
+    def book(self, start, duration):
+        """Book a free stretch of turns, see earliest.
+
+        Keyword arguments:
+        start    -- first turn of the booking
+        duration -- number of turns to book
+        """
+        if duration <= 0:
+            return
+        start -= self.lag
+        end = start + duration
+        i = bisect_left(self.starts, start)
+
+        # merge with the booking right before and right after
+        if i > 0 and self.ends[i - 1] == start:
+            i -= 1
+            start = self.starts[i]
+            del self.starts[i]
+            del self.ends[i]
+        if i < len(self.starts) and self.starts[i] == end:
+            end = self.ends[i]
+            del self.starts[i]
+            del self.ends[i]
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+    def busy_until(self):
+        """Number of turns from the last sync until the end of the last booking."""
+        if not self.ends:
+            return self.lag
+        return max(0, self.ends[-1] - self.now) + self.lag
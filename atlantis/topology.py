@@ -0,0 +1,204 @@
+import math
+import heapq
+from array import array
+
+# numpy is optional, only needed for the vectorized distance rows
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def classify_topology(neighbors, size):
+    """Tell which class of topology a worker graph is.
+
+    Keyword arguments:
+    neighbors -- worker id to neighboring worker ids mapping
+    size      -- number of workers, ids are assumed to be 0..size-1
+
+    Returns:
+    kind -- "line", "ring", "star", "grid" or "random" for anything else
+    """
+    degrees = [len(neighbors[w]) for w in range(size)]
+    edges = sum(degrees) // 2
+    if size <= 2:
+        return "line"
+    if edges == size - 1 and degrees[0] == size - 1:
+        return "star"
+    if edges == size - 1 and max(degrees) <= 2:
+        return "line"
+    if edges == size and all(d == 2 for d in degrees):
+        return "ring"
+
+    # row-major lattice, width of the square that fits every worker
+    width = math.ceil(math.sqrt(size))
+    grid = 0
+    for w in range(size):
+        right = (w + 1) % width and w + 1 < size
+        down = w + width < size
+        if (right and w + 1 not in neighbors[w]) or (down and w + width not in neighbors[w]):
+            return "random"
+        grid += bool(right) + bool(down)
+    return "grid" if grid == edges else "random"
+
+
+# graphs with at least this many workers keep their adjacency in CSR form
+CSR_SIZE = 10000
+
+class Topology:
+    """Distance index over the worker graph.
+
+    Hop distances only depend on the neighbor map and the origin penalty,
+    so they are computed once per source and reused for every layer of
+    every pearl instead of re-running Dijkstra's for each search.
+
+    Rows are filled in lazily the first time a source is asked for, which
+    keeps large topologies from paying for sources that are never used.
+    With max_rows set, the least recently used rows other than the origin's
+    are dropped once there are more, so memory stays bounded on long runs.
+
+    Large graphs keep their adjacency in compressed sparse row form: the
+    neighbors of worker w are targets[offsets[w]:offsets[w + 1]], sorted
+    by id. Two flat int arrays take half the memory of a tuple per worker
+    and iterate a little faster once the tuples no longer fit in cache,
+    but slicing them boxes every id, so small graphs keep the tuples.
+    Searches go through adjacent(w) either way.
+    """
+
+    def __init__(self, neighbors, size, origin=0, origin_penalty=10, max_rows=None, csr=None):
+        """Constructor for Topology.
+
+        Keyword arguments:
+        neighbors      -- worker id to neighboring worker ids mapping
+        size           -- number of workers, ids are assumed to be 0..size-1
+        origin         -- id of the gatekeeper (default 0)
+        origin_penalty -- extra cost for passing to the origin (default 10)
+        max_rows       -- number of sources whose rows are kept, at least 2, None for all (default None)
+        csr            -- keep the adjacency in CSR form, None to decide by size (default None)
+        """
+        self.size = size
+        self.origin = origin
+        self.origin_penalty = origin_penalty
+        self.max_rows = max_rows
+
+        if csr is None:
+            csr = size >= CSR_SIZE
+        if not csr:
+            # a bound method of the list shadows adjacent() below
+            self.offsets = self.targets = None
+            self.adjacent = [tuple(sorted(neighbors[w])) for w in range(size)].__getitem__
+        else:
+            self.offsets = array("l", [0])
+            self.targets = array("l")
+            for w in range(size):
+                self.targets.extend(sorted(neighbors[w]))
+                self.offsets.append(len(self.targets))
+
+        # source id to precomputed rows
+        self.dist = {}      # hop distance (with origin penalty) to each worker
+        self.pred = {}      # predecessor of each worker on the shortest path
+        self.order = {}     # workers in the order Dijkstra's settles them
+        self.arrays = {}    # distance rows as numpy arrays, inf if unreachable
+
+        # heap operations, replaced by counting ones when profiling
+        self.heappush = heapq.heappush
+        self.heappop = heapq.heappop
+
+    def row(self, source):
+        """Get the distance row for a source, computing it if needed.
+
+        Edges into the origin cost 1 + origin penalty, every other edge
+        costs 1. Ties are broken the same way a heap of (cost, id) would,
+        so the paths match the ones the per-layer search used to find.
+
+        Keyword arguments:
+        source -- worker id the distances are measured from
+
+        Returns:
+        dist  -- list of distances from source, None if unreachable
+        order -- reachable worker ids sorted by (distance, id)
+        """
+        if source in self.dist:
+            if self.max_rows is not None:
+                # move the row to the back, the front is evicted first
+                self.dist[source] = self.dist.pop(source)
+            return self.dist[source], self.order[source]
+
+        dist = [None] * self.size
+        pred = [None] * self.size
+        order = []
+        adjacent = self.adjacent
+        best = {source: 0}
+        pq = [(0, source)]
+        while pq:
+            cost, curr = self.heappop(pq)
+            if dist[curr] is not None: continue
+            dist[curr] = cost
+            order.append(curr)
+            for neighbor in adjacent(curr):
+                if dist[neighbor] is not None: continue
+                cost_new = cost + 1
+                if neighbor == self.origin:
+                    cost_new += self.origin_penalty
+                if neighbor not in best or cost_new < best[neighbor]:
+                    best[neighbor] = cost_new
+                    pred[neighbor] = curr
+                    self.heappush(pq, (cost_new, neighbor))
+
+        self.dist[source] = dist
+        self.pred[source] = pred
+        self.order[source] = order
+        if self.max_rows is not None and len(self.dist) > self.max_rows:
+            self.evict()
+        return dist, order
+
+    def adjacent(self, w):
+        """Neighbors of a worker, sorted by id.
+
+        Keyword arguments:
+        w -- worker id
+
+        Returns:
+        neighbors -- tuple or array of neighboring worker ids
+        """
+        return self.targets[self.offsets[w]:self.offsets[w + 1]]
+
+    def evict(self):
+        """Drop the least recently used row, the origin's row is kept."""
+        for source in self.dist:
+            if source != self.origin:
+                break
+        del self.dist[source]
+        del self.pred[source]
+        del self.order[source]
+        self.arrays.pop(source, None)
+
+    def path(self, source, target):
+        """Rebuild the shortest path between two workers.
+
+        Keyword arguments:
+        source -- where the path begins
+        target -- where the path ends
+
+        Returns:
+        path -- worker ids from source to target, inclusive
+        """
+        self.row(source)
+        pred = self.pred[source]
+        path = [target]
+        while path[-1] != source:
+            path.append(pred[path[-1]])
+        return path[::-1]
+
+    def dist_array(self, source):
+        """Get the distance row for a source as a numpy array.
+
+        Keyword arguments:
+        source -- worker id the distances are measured from
+
+        Returns:
+        dist -- float array of distances from source, inf if unreachable
+        """
+        if source not in self.arrays:
+            dist, _ = self.row(source)
+            self.arrays[source] = np.array([float("inf") if d is None else d for d in dist])
+        return self.arrays[source]
@@ -0,0 +1,194 @@
+import gzip
+import time
+import zlib
+
+from .codec import dumps, loads
+
+# version of the trace format, bumped when it changes
+TRACE_VERSION = 1
+
+# bytes of compressed trace read at a time
+CHUNK = 1 << 16
+
+class TraceWriter:
+    """Records the states a coordinator saw and the actions it answered with.
+
+    A trace is a gzip compressed file of JSON lines. The first line is a
+    header with the format version and the options of the coordinator,
+    after that every turn takes two lines: the change to the state and
+    the actions exactly as they were written out.
+
+    The first state is stored whole, later ones only hold the desks that
+    changed since the previous turn and the top level fields other than
+    the workers that changed, e.g. the score. Most desks don't change
+    from one turn to the next, so this keeps traces small.
+
+    The environment kills the coordinator at the end of a run, so close
+    usually never runs and the gzip trailer is never written. Every turn
+    is flushed with a sync flush, which ends the compressed data on a
+    byte boundary, so everything up to the last turn can be read back
+    from a trace that was never closed, see read_lines.
+    """
+
+    def __init__(self, path, options=None):
+        """Constructor for TraceWriter.
+
+        Keyword arguments:
+        path    -- file to write the trace to
+        options -- options of the coordinator, stored in the header (default None)
+        """
+        self.file = gzip.open(path, "wb")
+        self.desks = None       # worker id to the encoded desk of the previous turn
+        self.fields = {}        # top level field to its encoded value on the previous turn
+        self.turns = 0
+        self.write_line(dumps({"version": TRACE_VERSION, "options": options or {}}))
+        self.flush()
+
+    def write_line(self, line):
+        self.file.write(line.encode() + b"\n")
+
+    def flush(self):
+        """Push what was written so far to the file, readable without a trailer."""
+        self.file.flush(zlib.Z_SYNC_FLUSH)
+
+    def record(self, state, actions):
+        """Add a turn to the trace.
+
+        Keyword arguments:
+        state   -- the state given to the coordinator
+        actions -- the action string it answered with
+        """
+        fields = {}
+        for key, value in state.items():
+            if key == "workers":
+                continue
+            encoded = dumps(value)
+            if self.fields.get(key) != encoded:
+                self.fields[key] = encoded
+                fields[key] = value
+
+        if self.desks is None:
+            self.desks = {worker["id"]: dumps(worker["desk"]) for worker in state["workers"]}
+            delta = {"full": state}
+        else:
+            desks = {}
+            for worker in state["workers"]:
+                encoded = dumps(worker["desk"])
+                if self.desks[worker["id"]] != encoded:
+                    self.desks[worker["id"]] = encoded
+                    desks[worker["id"]] = worker["desk"]
+            delta = {"desks": desks, "fields": fields}
+
+        self.write_line(dumps(delta))
+        self.write_line(actions)
+        self.flush()
+        self.turns += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_lines(path):
+    """Lines of a gzip compressed file that may have been cut short.
+
+    gzip.open raises EOFError on a file without its trailer, even for
+    the lines before the end. Here the file is inflated chunk by chunk
+    and every complete line is given back, a partial last line is
+    dropped.
+
+    Keyword arguments:
+    path -- the file to read
+
+    Returns:
+    lines -- iterator over the lines, without their line breaks
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = b""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            pending += decompressor.decompress(chunk)
+            *lines, pending = pending.split(b"\n")
+            yield from lines
+            if decompressor.eof:
+                break
+
+
+class TraceReader:
+    """Reads back a trace written by TraceWriter.
+
+    Iterating over a reader gives (state, actions) for every turn, with
+    the states rebuilt in full. Desks that didn't change are shared
+    between the states of consecutive turns. A trace that was never
+    closed is read up to its last complete turn.
+    """
+
+    def __init__(self, path):
+        """Constructor for TraceReader.
+
+        Keyword arguments:
+        path -- file the trace was written to
+        """
+        self.path = path
+        header = loads(next(read_lines(path), b"{}"))
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError("unsupported trace version {}".format(header.get("version")))
+        self.options = header["options"]
+
+    def __iter__(self):
+        lines = read_lines(self.path)
+        next(lines, None)
+        state = None
+        for line in lines:
+            actions = next(lines, None)
+            if actions is None:
+                # killed between the state and the actions
+                return
+            delta = loads(line)
+            actions = actions.decode()
+            if "full" in delta:
+                state = delta["full"]
+            else:
+                state = dict(state)
+                state.update(delta["fields"])
+                desks = delta["desks"]
+                if desks:
+                    # JSON keys are strings, worker ids aren't
+                    desks = {int(wid): desk for wid, desk in desks.items()}
+                    state["workers"] = [dict(worker, desk=desks[worker["id"]]) if worker["id"] in desks else worker
+                                        for worker in state["workers"]]
+            yield state, actions
+
+
+def replay(reader, atlantis, max_diffs=10):
+    """Feed a trace through a coordinator and compare its actions.
+
+    Keyword arguments:
+    reader    -- TraceReader of the trace to replay
+    atlantis  -- a fresh coordinator
+    max_diffs -- number of differing turns kept in the result (default 10)
+
+    Returns:
+    result -- dict with the number of turns, the number of turns whose
+              actions differ, the first max_diffs differences as
+              (turn, recorded, replayed) and the time spent in process
+    """
+    turns = 0
+    differing = 0
+    diffs = []
+    timings = []
+    clock = time.perf_counter
+    for state, recorded in reader:
+        start = clock()
+        actions = atlantis.process(state)
+        timings.append(clock() - start)
+        if actions != recorded and loads(actions) != loads(recorded):
+            differing += 1
+            if len(diffs) < max_diffs:
+                diffs.append((turns, recorded, actions))
+        turns += 1
+    return {
+        "turns": turns,
+        "differing": differing,
+        "diffs": diffs,
+        "timings": timings,
+    }
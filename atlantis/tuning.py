@@ -0,0 +1,49 @@
+import json
+
+# cost parameters that can be tuned and the values tried for each
+PARAMETERS = {
+    "origin_penalty": (0, 5, 10, 15, 20, 30),   # Atlantis, extra cost of going through the gatekeeper
+    "nom_penalty": (0, 5, 10, 20, 30, 40),      # Worker, extra cost of a Nom in the queue
+    "layer_weight": (0, 1, 2, 5),               # Worker, weight of the layers left before a Pass
+    "path_weight": (0.5, 1, 1.5, 2),            # Atlantis.search, weight of the path to a worker
+    "workload_weight": (0.5, 1, 1.5, 2),        # Atlantis.search, weight of the workload of a worker
+}
+
+# the hand-picked values the coordinator uses without a config
+DEFAULTS = {
+    "origin_penalty": 10,
+    "nom_penalty": 20,
+    "layer_weight": 1,
+    "path_weight": 1,
+    "workload_weight": 1,
+}
+
+def load_config(path):
+    """Read a config written by the tuner.
+
+    A config maps a topology class (see topology.classify_topology) or
+    "default" to the parameters tuned for it. Other keys of an entry,
+    e.g. the score it got, are ignored.
+
+    Keyword arguments:
+    path -- JSON file to read
+
+    Returns:
+    config -- topology class to parameters mapping
+    """
+    with open(path) as f:
+        config = json.load(f)
+    return {kind: {k: v for k, v in entry.items() if k in DEFAULTS} for kind, entry in config.items()}
+
+def pick_params(config, kind):
+    """Get the parameters for a topology class.
+
+    Keyword arguments:
+    config -- topology class to parameters mapping
+    kind   -- class of the topology being played
+
+    Returns:
+    params -- the entry for the class, else the "default" entry, else nothing
+    """
+    entry = config.get(kind, config.get("default", {}))
+    return {k: v for k, v in entry.items() if k in DEFAULTS}
@@ -1,30 +1,38 @@
 from collections import deque
-import heapq
+from .ipq import IndexedHeap
+from .pearl import NOM, PASS
 
 class Worker:
     """Worker object representing Nautiloids."""
 
-    def __init__(self, wid, mode="pq"):
+    def __init__(self, wid, mode="pq", completions=None):
         """Constructor for Worker.
 
         Keyword arguments:
-        wid  -- Worker id
-        mode -- Order of how worker will process the pearls (default "pq")
-                - "pq" for priority queue, see worker for priority computation
-                - "fifo" for first-in-first-out
-                - "rr"" for round-robin
+        wid         -- Worker id
+        mode        -- Order of how worker will process the pearls (default "pq")
+                       - "pq" for priority queue, see worker for priority computation
+                       - "fifo" for first-in-first-out
+                       - "rr"" for round-robin
+        completions -- queue the ids of pearls whose plan is done get appended to,
+                       usually shared with the coordinator (default None)
         """
         
         self.wid = wid
         self.mode = mode if mode in ("pq", "fifo", "rr") else "pq"
         if mode == "pq":
-            self.pearls = []
+            self.pearls = IndexedHeap()
         else:
             self.pearls = deque()
         self.seen = set()
+        self.released = set()   # pearls dropped from the queue that stay on the desk
+        self.last = None        # (pearl, index of the plan step) of the last action, None if idle
+        self.completions = completions
 
         # makes noms more costly to prioritize moving
         self.nom_penalty = 20 
+        # weight of the layers left when the next action is a Pass
+        self.layer_weight = 1
 
     def compute_cost(self, pearl):
         """Compute the cost of processing the pearl based on the next action.
@@ -36,20 +44,20 @@ class Worker:
         cost -- Cost of processing pearl
                 cost = Work left over for the 
                      + Nom penalty if next action is Nom
-                     + Number of layers remaining if next action is Pass
+                     + Number of layers remaining (times layer_weight) if next action is Pass
         """
 
         cost = 0
-        times, move = pearl.peek()
+        op = pearl.next_op()
 
         # finished pearls only need to be moved and should be given priority
         if not pearl.finished:
             # base cost is number of turns to free pearl
             cost = pearl.work
-            if "Nom" in move:
+            if op == NOM:
                 cost += self.nom_penalty
-            elif "Pass" in move: 
-                cost += pearl.layers
+            elif op == PASS: 
+                cost += pearl.layers * self.layer_weight
         return cost
 
     def resolve(self, state, pearl_map):
@@ -61,16 +69,97 @@ class Worker:
                      pearl processing plan
         """
 
+        # the whole desk is rescanned, so released pearls are picked up as well
+        self.released.clear()
         for pearl in state:
-            if pearl["id"] in self.seen:
-                continue
-            self.seen.add(pearl["id"])
-            p = pearl_map[pearl["id"]]
-            if self.mode == "rr" or self.mode == "fifo":
-                self.pearls.append(p)
-            else:
-                cost = self.compute_cost(p)
-                heapq.heappush(self.pearls, (cost, p.id))
+            self.enqueue(pearl["id"], pearl_map)
+
+    def ingest(self, arrivals, departures, pearl_map):
+        """Updates the worker with the changes to its desk.
+
+        Pearls the worker released while they stayed on the desk, e.g.
+        after their last Nom, are queued again unless they departed.
+
+        Keyword arguments:
+        arrivals   -- ids of pearls new to the desk
+        departures -- ids of pearls that left the desk
+        pearl_map  -- pearl id to Pearl object map used to access
+                      pearl processing plan
+        """
+
+        for pid in departures:
+            self.released.discard(pid)
+        if self.released:
+            released = self.released
+            self.released = set()
+            for pid in released:
+                self.enqueue(pid, pearl_map)
+        for pid in arrivals:
+            self.enqueue(pid, pearl_map)
+
+    def enqueue(self, pid, pearl_map):
+        """Adds a pearl to the queue of the worker if it isn't there yet.
+
+        Keyword arguments:
+        pid       -- id of the pearl on the desk
+        pearl_map -- pearl id to Pearl object map
+        """
+
+        if pid in self.seen:
+            return
+        self.seen.add(pid)
+        p = pearl_map[pid]
+        if self.mode == "rr" or self.mode == "fifo":
+            self.pearls.append(p)
+        else:
+            cost = self.compute_cost(p)
+            self.pearls.push(p.id, cost)
+
+    def refresh(self, pearl):
+        """Recompute the priority of a queued pearl after its plan changed.
+
+        Only does something in "pq" mode and if the pearl is queued.
+
+        Keyword arguments:
+        pearl -- the pearl whose plan changed
+        """
+
+        if self.mode == "pq" and pearl.id in self.pearls:
+            self.pearls.update(pearl.id, self.compute_cost(pearl))
+
+    def queued(self, pearl_map):
+        """Pearls in the queue of the worker in the order they'll be served,
+        along with the turns of queued work ahead of each.
+
+        Keyword arguments:
+        pearl_map -- pearl id to Pearl object map
+
+        Returns:
+        queued -- list of (pearl, turns of work ahead of it)
+        """
+
+        if self.mode == "pq":
+            pearls = [pearl_map[pid] for pid in sorted(self.pearls.heap, key=lambda pid: (self.pearls.cost[pid], pid))]
+        else:
+            pearls = list(self.pearls)
+        queued = []
+        ahead = 0
+        for pearl in pearls:
+            queued.append((pearl, ahead))
+            ahead += pearl.local_work()
+        return queued
+
+    def release(self, pearl, step):
+        """Stops tracking a pearl.
+
+        Keyword arguments:
+        pearl -- the pearl to stop tracking
+        step  -- index of the plan step just taken for the pearl
+        """
+
+        self.seen.remove(pearl.id)
+        if pearl.ops[step] != PASS:
+            self.released.add(pearl.id)
 
     def process(self, state, pearl_map):
         """Resolves new state and redirects processing based on mode.
@@ -84,6 +173,70 @@ class Worker:
         """
 
         self.resolve(state, pearl_map)
+        ret = self.dispatch(pearl_map)
+        if ret is None:
+            return None
+        pearl, step = ret
+        return pearl.action(step)
+
+    def process_delta(self, arrivals, departures, pearl_map):
+        """Ingests the changes to the desk and redirects processing based on mode.
+
+        Keyword arguments:
+        arrivals   -- ids of pearls new to the desk
+        departures -- ids of pearls that left the desk
+        pearl_map  -- Pearl planning information
+
+        Returns:
+        ret -- Action for the current worker as a JSON fragment
+        """
+
+        self.ingest(arrivals, departures, pearl_map)
+        ret = self.dispatch(pearl_map)
+        if ret is None:
+            return None
+        pearl, step = ret
+        return pearl.fragments[step]
+
+    def compact(self):
+        """Rebuild the queue and the sets of the worker at their current size."""
+        self.seen = set(self.seen)
+        self.released = set(self.released)
+        if self.mode == "pq":
+            self.pearls.compact()
+
+    def pass_wait(self):
+        """Turns a pearl done with its layers would wait here before its Pass,
+        if it arrived now.
+
+        In "pq" mode pearls done with their layers go first, so it only waits
+        for the ones already queued. In "fifo" mode it waits for all the work
+        queued ahead of it and in "rr" mode for a turn of every queued pearl.
+
+        Returns:
+        wait -- turns of waiting
+        """
+        if self.mode == "pq":
+            return sum(1 for cost in self.pearls.cost.values() if cost == 0)
+        if self.mode == "fifo":
+            return sum(pearl.local_work() for pearl in self.pearls)
+        return len(self.pearls)
+
+    def idle(self):
+        """Whether the worker has nothing queued or waiting to be queued."""
+        return not self.pearls and not self.released
+
+    def dispatch(self, pearl_map):
+        """Redirects processing based on mode.
+
+        Keyword arguments:
+        pearl_map -- Pearl planning information
+
+        Returns:
+        ret -- (pearl, index of the plan step taken) for the current worker
+        """
+
+        self.last = None
         if not self.pearls:
             return None
         ret = None
@@ -93,45 +246,58 @@ class Worker:
             ret = self.process_fifo()
         elif self.mode == "pq":
             ret = self.process_pq(pearl_map)
+
+        # report pearls that just took the last step of their plan
+        if ret is not None and ret[0].work == 0 and self.completions is not None:
+            self.completions.append(ret[0].id)
+        self.last = ret
         return ret
 
     def process_rr(self):
-        """Processes pearls in Round-Robin fashion."""
+        """Processes pearls in Round-Robin fashion.
+
+        Returns:
+        ret -- (pearl, index of the plan step taken), None if there's no pearl
+        """
 
         if self.pearls:
             pearl = self.pearls.popleft()
-            action = pearl.process()
+            step = pearl.advance()
             
             # If pearl is finished, we don't need to keep track of it anymore
             if pearl.finished: 
-                self.seen.remove(pearl.id)
+                self.release(pearl, step)
             else:
                 # We only need to keep the pearl if it's not a Pass
-                if "Pass" not in action:
+                if pearl.ops[step] != PASS:
                     self.pearls.append(pearl)
                 else:
                     self.seen.remove(pearl.id)
-            return action
+            return pearl, step
         else:
             return None
 
     def process_fifo(self):
-        """Processes pearls in FIFO fashion."""
+        """Processes pearls in FIFO fashion.
+
+        Returns:
+        ret -- (pearl, index of the plan step taken), None if there's no pearl
+        """
 
         if self.pearls:
             pearl = self.pearls[0]
-            action = pearl.process()
+            step = pearl.advance()
 
             # We are done processing the current pearl and can move on
             if pearl.finished:
-                self.seen.remove(pearl.id)
+                self.release(pearl, step)
                 self.pearls.popleft()
             else: # Pearl is not done 
                 # Passing the pearl means it's moved from the front of the queue
-                if "Pass" in action:
+                if pearl.ops[step] == PASS:
                     self.pearls.popleft()
                     self.seen.remove(pearl.id)
-            return action
+            return pearl, step
         else:
             return None
 
@@ -140,25 +306,29 @@ class Worker:
 
         Keyword arguments: 
         pearl_map -- map of current pearls, used to help compute cost
+
+        Returns:
+        ret -- (pearl, index of the plan step taken), None if there's no pearl
         """
 
         if self.pearls:
             # Get minimum cost move
-            cost, pid = heapq.heappop(self.pearls)
+            cost, pid = self.pearls.peek()
             pearl = pearl_map[pid]
-            action = pearl.process()
+            step = pearl.advance()
             
             # We are done processing the current pearl and can move on
             if pearl.finished:
-                self.seen.remove(pearl.id)
+                self.pearls.pop()
+                self.release(pearl, step)
             else:
-                # If we still need to process the pearl, recompute the cost
-                # and put it back into the priority queue
-                if "Pass" not in action:
-                    cost = self.compute_cost(pearl)
-                    heapq.heappush(self.pearls, (cost, pearl.id))
+                # If we still need to process the pearl, refresh its cost
+                # in place in the priority queue
+                if pearl.ops[step] != PASS:
+                    self.pearls.update(pid, self.compute_cost(pearl))
                 else:
+                    self.pearls.pop()
                     self.seen.remove(pearl.id)
-            return action
+            return pearl, step
         else:
             return None
@@ -0,0 +1,274 @@
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+from atlantis.atlantis import Atlantis
+from atlantis.pearl import Pearl
+from atlantis.simulator import Simulator, TOPOLOGIES
+from atlantis.worker import Worker
+
+# Scalability benchmarks for the planner and worker hot paths.
+#
+# Every case plays a seeded game against the local simulator and times
+# each Atlantis.process call, then times the individual hot paths on the
+# resulting coordinator. Results are written as JSON and can be compared
+# against a stored baseline.
+
+SIZES = (10, 100, 1000)
+FULL_SIZES = (10, 100, 1000, 10000)
+RATES = {
+    "trickle": 0.05,
+    "steady": 0.5,
+    "busy": 2,
+    "burst": 20,
+}
+
+
+def percentile(samples, q):
+    """Get the q-th percentile of a list of samples (nearest rank)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summarize(samples):
+    """Summary statistics of timings in seconds, reported in microseconds."""
+    return {
+        "count": len(samples),
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "mean_us": (sum(samples) / len(samples) * 1e6) if samples else 0.0,
+    }
+
+
+def play(size, topology, rate, mode, planner, turns, seed, warmup=0, vectorized=False):
+    """Play a game and time every turn of the coordinator.
+
+    Returns:
+    atlantis -- the coordinator after the game
+    sim      -- the simulator after the game
+    timings  -- duration of each timed Atlantis.process call in seconds
+    planned  -- number of pearls planned during the timed turns
+    """
+    sim = Simulator(size=size, topology=topology, arrival_rate=rate, seed=seed)
+    atlantis = Atlantis(mode=mode, planner=planner, vectorized=vectorized)
+    timings = []
+    planned = 0
+    clock = time.perf_counter
+    for turn in range(warmup + turns):
+        state = sim.state()
+        new = sum(1 for pearl in sim.desks[0] if pearl["id"] not in atlantis.pearl_map)
+        start = clock()
+        actions = atlantis.process(state)
+        elapsed = clock() - start
+        if turn >= warmup:
+            timings.append(elapsed)
+            planned += new
+        sim.step(actions)
+    return atlantis, sim, timings, planned
+
+
+def peak_memory(size, topology, rate, mode, planner, turns, seed, vectorized=False):
+    """Peak traced memory in bytes over a shorter game."""
+    tracemalloc.start()
+    play(size, topology, rate, mode, planner, turns, seed, vectorized=vectorized)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_planner(atlantis, rng, samples):
+    """Time search, return_path and the coordinator's planner.
+
+    Work and bookings added by the planner are rolled back after every
+    sample so each sample sees the workload the game left behind.
+    """
+    size = len(atlantis.workers)
+    colors = ("Red", "Green", "Blue")
+    pearls = [{"id": -1 - i, "layers": [{"color": rng.choice(colors), "thickness": rng.randint(1, 15)}
+                                        for _ in range(rng.randint(1, 3))]} for i in range(samples)]
+    clock = time.perf_counter
+    results = {}
+
+    timings = []
+    for pearl in pearls:
+        start = clock()
+        atlantis.search(pearl["id"], atlantis.origin, pearl["layers"])
+        timings.append(clock() - start)
+    results["search"] = summarize(timings)
+
+    timings = []
+    for _ in range(samples):
+        start_id = rng.randrange(size)
+        start = clock()
+        atlantis.return_path(start_id, atlantis.origin)
+        timings.append(clock() - start)
+    results["return_path"] = summarize(timings)
+
+    # time the planner the case plays with, batches are timed a few pearls at a time
+    plan = {
+        "greedy": lambda group: [atlantis.plan_pearl(pearl) for pearl in group],
+        "dp": lambda group: [atlantis.plan_pearl(pearl) for pearl in group],
+        "batch": atlantis.plan_batch,
+        "timeline": lambda group: [atlantis.plan_timed(pearl) for pearl in group],
+    }[atlantis.planner]
+    group_size = 4 if atlantis.planner == "batch" else 1
+    timings = []
+    for i in range(0, len(pearls), group_size):
+        group = pearls[i:i + group_size]
+        workload = list(atlantis.workload)
+        timelines = copy.deepcopy(atlantis.timelines)
+        start = clock()
+        plan(group)
+        timings.append(clock() - start)
+        atlantis.workload[:] = workload
+        atlantis.timelines = timelines
+    results["plan_" + atlantis.planner] = summarize(timings)
+    return results
+
+
+def bench_worker(mode, desk_size, turns):
+    """Time a worker with a full desk of pearls that need Noms.
+
+    process_delta is what the coordinator calls every turn, the desk
+    arrives on the first turn and doesn't change after. process, which
+    rescans the whole desk every turn, is timed as well for comparison.
+    """
+    def setup():
+        desk = []
+        pearl_map = {}
+        for pid in range(desk_size):
+            plan = [[turns, {"Nom": pid}], [1, {"Pass": {"pearl_id": pid, "to_worker": 0}}]]
+            pearl_map[pid] = Pearl(pid, plan, turns + 1, 1)
+            desk.append({"id": pid, "layers": [{"color": "Red", "thickness": turns}]})
+        return Worker(1, mode), desk, pearl_map
+
+    clock = time.perf_counter
+    worker, desk, pearl_map = setup()
+    arrivals = [pearl["id"] for pearl in desk]
+    timings = []
+    for _ in range(turns):
+        start = clock()
+        worker.process_delta(arrivals, (), pearl_map)
+        timings.append(clock() - start)
+        arrivals = ()
+    result = summarize(timings)
+
+    worker, desk, pearl_map = setup()
+    timings = []
+    for _ in range(turns):
+        start = clock()
+        worker.process(desk, pearl_map)
+        timings.append(clock() - start)
+    result["process"] = summarize(timings)
+    return result
+
+
+def run_case(size, topology, rate_name, mode, planner, turns, seed, memory, vectorized=False):
+    """Run a single benchmark case."""
+    rate = RATES[rate_name]
+    warmup = min(turns, 20)
+    atlantis, sim, timings, planned = play(size, topology, rate, mode, planner, turns, seed, warmup, vectorized)
+    elapsed = sum(timings)
+    result = {
+        "size": size,
+        "topology": topology,
+        "rate": rate_name,
+        "mode": mode,
+        "planner": planner,
+        "vectorized": atlantis.vectorized,
+        "turns": turns,
+        "turn": summarize(timings),
+        "pearls_per_s": planned / elapsed if elapsed else 0.0,
+        "score": sim.score,
+        "in_flight": sim.in_flight(),
+    }
+    result["hot_paths"] = bench_planner(atlantis, random.Random(seed), samples=20)
+    if memory:
+        result["peak_memory_bytes"] = peak_memory(size, topology, rate, mode, planner, min(turns, 50), seed, vectorized)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Print how the per-turn latency changed against a baseline.
+
+    Returns:
+    regressions -- number of cases whose p50 latency got slower than threshold
+    """
+    regressions = 0
+    for name, result in results["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        old = baseline["cases"][name]["turn"]["p50_us"]
+        new = result["turn"]["p50_us"]
+        ratio = new / old if old else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  <-- regression"
+            regressions += 1
+        print("{:<40} p50 {:>10.1f}us -> {:>10.1f}us  x{:.2f}{}".format(name, old, new, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scalability benchmarks for the planner and worker hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None, help="numbers of workers (default={})".format(list(SIZES)))
+    parser.add_argument("--full", action="store_true", help="run sizes {} and every topology".format(list(FULL_SIZES)))
+    parser.add_argument("--topologies", nargs="+", default=["line", "grid", "random"], choices=TOPOLOGIES)
+    parser.add_argument("--rates", nargs="+", default=["trickle", "busy", "burst"], choices=list(RATES))
+    parser.add_argument("--modes", nargs="+", default=["pq"], choices=["pq", "rr", "fifo"])
+    parser.add_argument("--planner", default="greedy", choices=["greedy", "batch", "timeline", "dp"])
+    parser.add_argument("--vectorized", action="store_true", help="score candidate workers with numpy arrays")
+    parser.add_argument("--turns", type=int, default=200, help="timed turns per case (default=200)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced peak memory pass")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression (default=1.2)")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (FULL_SIZES if args.full else SIZES)
+    topologies = TOPOLOGIES if args.full else args.topologies
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cases": {},
+        "workers": {},
+    }
+    for size in sizes:
+        for topology in topologies:
+            for rate_name in args.rates:
+                for mode in args.modes:
+                    name = "{}-{}-{}-{}-{}".format(topology, size, rate_name, mode, args.planner)
+                    if args.vectorized:
+                        name += "-vectorized"
+                    result = run_case(size, topology, rate_name, mode, args.planner, args.turns, args.seed,
+                                      not args.no_memory, args.vectorized)
+                    results["cases"][name] = result
+                    print("{:<40} p50 {:>10.1f}us  p99 {:>10.1f}us  {:>10.1f} pearls/s".format(
+                        name, result["turn"]["p50_us"], result["turn"]["p99_us"], result["pearls_per_s"]), file=sys.stderr)
+
+    for mode in ("pq", "rr", "fifo"):
+        for desk_size in (10, 100, 1000):
+            results["workers"]["{}-{}".format(mode, desk_size)] = bench_worker(mode, desk_size, args.turns)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
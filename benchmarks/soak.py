@@ -0,0 +1,119 @@
+import sys
+import json
+import time
+import argparse
+import platform
+
+from atlantis.atlantis import Atlantis
+from atlantis.simulator import Simulator, TOPOLOGIES
+
+# Soak benchmark for long games.
+#
+# Plays one very long seeded game against the local simulator and samples
+# the resident memory of the process, the number of live allocated blocks
+# and the size of the coordinator's bookkeeping every so many turns. Bursts
+# of pearls can be mixed in to check that memory goes back down after them.
+#
+# CPython has no cheap counter of allocations made, so the allocation rate
+# is reported as the net growth of live blocks per 1,000 turns, which is
+# what makes memory creep on a long run.
+
+
+def rss_bytes():
+    """Resident memory of the process, the peak if the current isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bookkeeping(atlantis):
+    """Number of entries in the structures of the coordinator that grow with pearls."""
+    workers = atlantis.workers.values()
+    return {
+        "pearl_map": len(atlantis.pearl_map),
+        "seen": sum(len(worker.seen) for worker in workers),
+        "queued": sum(len(worker.pearls) for worker in workers),
+        "drift": len(atlantis.drift),
+        "rows": len(atlantis.topology.dist),
+    }
+
+
+def soak(args):
+    """Play the game and take a sample every `args.every` turns.
+
+    Returns:
+    samples -- list of dicts, one per sample
+    """
+    sim = Simulator(size=args.size, topology=args.topology, arrival_rate=args.rate, seed=args.seed)
+    atlantis = Atlantis(mode=args.mode, planner=args.planner, replan_budget=args.replan, steal=args.steal,
+                        long_run=args.long_run)
+
+    samples = []
+    clock = time.perf_counter
+    start = clock()
+    last_time = start
+    last_blocks = sys.getallocatedblocks()
+    for turn in range(1, args.turns + 1):
+        # bursts raise the arrival rate for a while
+        if args.burst_every:
+            bursting = turn % args.burst_every < args.burst_length
+            sim.arrival_rate = args.burst_rate if bursting else args.rate
+        sim.step(atlantis.process(sim.state()))
+
+        if turn % args.every == 0:
+            now = clock()
+            blocks = sys.getallocatedblocks()
+            sample = {
+                "turn": turn,
+                "elapsed_s": now - start,
+                "turns_per_s": args.every / (now - last_time),
+                "rss_mb": rss_bytes() / 2 ** 20,
+                "blocks": blocks,
+                "block_growth_per_1k_turns": (blocks - last_blocks) * 1000 / args.every,
+                "score": sim.score,
+                "in_flight": sim.in_flight(),
+            }
+            sample.update(bookkeeping(atlantis))
+            samples.append(sample)
+            print("{:>10} turns {:>9.0f} turns/s  rss {:>7.1f}MB  blocks {:>9}  {:>+9.1f}/1k turns  in flight {:>6}".format(
+                turn, sample["turns_per_s"], sample["rss_mb"], blocks, sample["block_growth_per_1k_turns"],
+                sample["in_flight"]), file=sys.stderr)
+            last_time = now
+            last_blocks = blocks
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak benchmark, memory of the coordinator over a very long game")
+    parser.add_argument("--turns", type=int, default=1000000, help="turns to play (default=1000000)")
+    parser.add_argument("--every", type=int, default=10000, help="turns between samples (default=10000)")
+    parser.add_argument("--size", type=int, default=100, help="number of workers (default=100)")
+    parser.add_argument("--topology", default="random", choices=TOPOLOGIES)
+    parser.add_argument("--rate", type=float, default=0.5, help="expected new pearls per turn (default=0.5)")
+    parser.add_argument("--burst-every", type=int, default=0, help="turns between bursts, 0 for none (default=0)")
+    parser.add_argument("--burst-length", type=int, default=50, help="turns a burst lasts (default=50)")
+    parser.add_argument("--burst-rate", type=float, default=20, help="expected new pearls per turn in a burst (default=20)")
+    parser.add_argument("--mode", default="pq", choices=["pq", "rr", "fifo"])
+    parser.add_argument("--planner", default="greedy", choices=["greedy", "batch", "timeline", "dp"])
+    parser.add_argument("--replan", type=int, default=0, help="maximum number of drifting pearls replanned per turn")
+    parser.add_argument("--steal", action="store_true", help="let idle workers take queued Noms off overloaded neighbors")
+    parser.add_argument("--long-run", action="store_true", help="cap cached topology rows and compact after bursts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="soak_results.json", help="where to write the samples")
+    args = parser.parse_args()
+
+    samples = soak(args)
+    with open(args.output, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "options": vars(args),
+            "samples": samples,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
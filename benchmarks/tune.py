@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import random
+import argparse
+from multiprocessing import Pool
+
+from atlantis.atlantis import Atlantis
+from atlantis.simulator import Simulator, TOPOLOGIES
+from atlantis.tuning import PARAMETERS, DEFAULTS
+
+# Tuner for the cost parameters of the coordinator.
+#
+# For every topology class, candidate parameter sets are scored by the
+# mean score of seeded games against the local simulator, with the games
+# spread over a process pool. Random candidates are tried first, the
+# defaults always among them, then the best one is refined one parameter
+# step at a time until no step helps. The best set of each class is
+# written to a JSON config that Atlantis(config=...) loads.
+
+
+def play(job):
+    """Score a parameter set on one seeded game.
+
+    Keyword arguments:
+    job -- (params, topology, size, rate, turns, mode, seed)
+
+    Returns:
+    score -- pearls brought back to the gatekeeper
+    """
+    params, topology, size, rate, turns, mode, seed = job
+    sim = Simulator(size=size, topology=topology, arrival_rate=rate, seed=seed)
+    return sim.run(Atlantis(mode=mode, config={"default": params}), turns)
+
+
+def evaluate(pool, candidates, topology, args):
+    """Mean score of each candidate over the seeded games.
+
+    Keyword arguments:
+    pool       -- process pool the games are played on
+    candidates -- list of parameter sets
+    topology   -- class of topology to play on
+    args       -- parsed command line arguments
+
+    Returns:
+    scores -- mean score of each candidate, in the same order
+    """
+    seeds = range(args.seed, args.seed + args.games)
+    jobs = [(params, topology, args.size, args.rate, args.turns, args.mode, seed)
+            for params in candidates for seed in seeds]
+    results = pool.map(play, jobs)
+    return [sum(results[i:i + args.games]) / args.games for i in range(0, len(results), args.games)]
+
+
+def neighbors(params):
+    """Parameter sets one step away from params in a single parameter."""
+    for name, values in PARAMETERS.items():
+        i = values.index(params[name]) if params[name] in values else None
+        if i is None:
+            continue
+        for j in (i - 1, i + 1):
+            if 0 <= j < len(values):
+                yield dict(params, **{name: values[j]})
+
+
+def tune(pool, topology, args, rng):
+    """Find the best parameters for a topology class.
+
+    Returns:
+    best  -- the best parameter set found
+    score -- its mean score
+    base  -- mean score of the defaults
+    """
+    candidates = [dict(DEFAULTS)]
+    while len(candidates) < args.trials:
+        candidates.append({name: rng.choice(values) for name, values in PARAMETERS.items()})
+    scores = evaluate(pool, candidates, topology, args)
+    base = scores[0]
+    score, i = max((s, -i) for i, s in enumerate(scores))
+    best = candidates[-i]
+
+    # hill climb one parameter at a time from the best random candidate
+    tried = {json.dumps(c, sort_keys=True) for c in candidates}
+    for _ in range(args.rounds):
+        steps = [c for c in neighbors(best) if json.dumps(c, sort_keys=True) not in tried]
+        if not steps:
+            break
+        tried.update(json.dumps(c, sort_keys=True) for c in steps)
+        step_scores = evaluate(pool, steps, topology, args)
+        step_score, i = max((s, -i) for i, s in enumerate(step_scores))
+        if step_score <= score:
+            break
+        best, score = steps[-i], step_score
+    return best, score, base
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tunes the cost parameters of the coordinator for each topology class")
+    parser.add_argument("--topologies", nargs="+", default=list(TOPOLOGIES), choices=TOPOLOGIES)
+    parser.add_argument("--size", type=int, default=30, help="number of workers (default=30)")
+    parser.add_argument("--rate", type=float, default=1, help="expected new pearls per turn (default=1)")
+    parser.add_argument("--turns", type=int, default=500, help="turns per game (default=500)")
+    parser.add_argument("--games", type=int, default=4, help="seeded games per candidate (default=4)")
+    parser.add_argument("--trials", type=int, default=40, help="random candidates per topology, the defaults included (default=40)")
+    parser.add_argument("--rounds", type=int, default=10, help="maximum hill climbing rounds (default=10)")
+    parser.add_argument("--mode", default="pq", choices=["pq", "rr", "fifo"])
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="size of the process pool (default=number of CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="first game seed, also seeds the random candidates")
+    parser.add_argument("--output", default="tuned.json", help="where to write the config")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    config = {}
+    with Pool(args.processes) as pool:
+        for topology in args.topologies:
+            best, score, base = tune(pool, topology, args, rng)
+            config[topology] = dict(best, score=score, default_score=base)
+            print("{:<8} score {:>8.2f} (defaults {:>8.2f})  {}".format(topology, score, base, json.dumps(best)), file=sys.stderr)
+
+    # anything that isn't one of the simulator's shapes counts as random
+    if "random" in config:
+        config["default"] = dict(config["random"])
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
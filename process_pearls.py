@@ -1,6 +1,6 @@
 import sys
 import json
-from atlantis import atlantis 
+from atlantis import atlantis, codec, trace, tuning
 import argparse
 
 # Entrypoint for processing pearls
@@ -10,6 +10,25 @@ mode_help_text = "mode for worker, either PriorityQueue (pq), Round-Robin (rr),
   rr - processes pearls in round-robin fashion\n\
 fifo - processes pearls in first in, first out fashion"
 parser.add_argument("mode", nargs='?', default="pq", help=mode_help_text)
+planner_help_text = "how new pearls are planned (default=\"greedy\")\n\
+ greedy - plans each new pearl in arrival order\n\
+  batch - assigns the layers of all pearls arriving in the same turn jointly\n\
+timeline - plans each new pearl against the turns workers are booked for\n\
+     dp - plans each new pearl over all its layers at once, return leg included"
+parser.add_argument("--planner", default="greedy", choices=["greedy", "batch", "timeline", "dp"], help=planner_help_text)
+parser.add_argument("--replan", type=int, default=0, help="maximum number of drifting pearls replanned per turn, 0 is off, not used with the timeline planner (default=0)")
+parser.add_argument("--steal", action="store_true", help="let idle workers take queued Noms off overloaded neighbors")
+parser.add_argument("--long-run", action="store_true", help="cap cached topology rows and compact the bookkeeping after bursts")
+parser.add_argument("--config", default=None, metavar="PATH", help="tuned cost parameters per topology class, see benchmarks/tune.py")
+parser.add_argument("--calibrate", action="store_true", help="estimate the processing rates from the Noms and plan with the estimates")
+parser.add_argument("--plan-cache", type=int, default=0, help="number of plan templates kept for pearls with the same layers, 0 is off, greedy planner only (default=0)")
+parser.add_argument("--return-tree", action="store_true", help="walk return paths up a shortest-path tree to the gatekeeper built once per turn")
+parser.add_argument("--refine", action="store_true", help="refine the plans of waiting pearls in a background thread while waiting for the next state,\nnot used with the timeline planner")
+parser.add_argument("--time-budget", type=float, default=0, metavar="MS", help="milliseconds a turn should take at most, pearls that don't fit get a quick plan\nand a full one on a later turn, 0 is off, not used with the timeline planner (default=0)")
+parser.add_argument("--vectorized", action="store_true", help="score candidate workers with numpy arrays, needs numpy")
+parser.add_argument("--profile", default=None, metavar="PATH", help="profile every turn and write it to PATH as JSON lines as the turn ends,\nPATH keeps at least the last 1024 turns")
+parser.add_argument("--record", default=None, metavar="PATH", help="record every state and the actions to a compressed trace at PATH, see replay.py")
+parser.add_argument("--fast-io", action="store_true", help="read binary stdin, use orjson when installed and skip fields the coordinator doesn't read")
 args = parser.parse_args()
 
 # Set mode, default is pq
@@ -19,9 +38,38 @@ if args.mode == "rr":
 elif args.mode == "fifo":
     mode = "fifo"
 
-atlan = atlantis.Atlantis(mode=mode)
+options = {"mode": mode, "planner": args.planner, "vectorized": args.vectorized,
+           "replan_budget": args.replan, "steal": args.steal, "long_run": args.long_run,
+           "config": tuning.load_config(args.config) if args.config else None, "calibrate": args.calibrate,
+           "plan_cache": args.plan_cache, "return_tree": args.return_tree, "refine": args.refine,
+           "time_budget": args.time_budget}
+atlan = atlantis.Atlantis(profile=args.profile is not None, **options)
+if atlan.profiler is not None:
+    # the environment kills us at the end of a run, nothing after the loop runs there
+    atlan.profiler.autosave(args.profile)
+recorder = trace.TraceWriter(args.record, options) if args.record else None
 
-for line in sys.stdin:
-    state = json.loads(line)
-    actions = atlan.process(state)
-    print(actions, flush=True)
+if args.fast_io:
+    # bytes in and out, one write and flush per turn without the text layer
+    out = sys.stdout.buffer
+    for line in sys.stdin.buffer:
+        state = codec.decode_state(line, atlan.initialized)
+        actions = atlan.process(state)
+        if recorder is not None:
+            recorder.record(state, actions)
+        out.write(actions.encode() + b"\n")
+        out.flush()
+else:
+    for line in sys.stdin:
+        state = json.loads(line)
+        actions = atlan.process(state)
+        if recorder is not None:
+            recorder.record(state, actions)
+        print(actions, flush=True)
+
+atlan.stop_refining()
+if recorder is not None:
+    recorder.close()
+if atlan.profiler is not None:
+    atlan.profiler.close()
+    atlan.profiler.dump(args.profile)
@@ -0,0 +1,29 @@
+import sys
+import argparse
+from atlantis import atlantis, trace
+from benchmarks.bench import summarize
+
+# Entrypoint for replaying a recorded trace, see process_pearls.py --record
+parser = argparse.ArgumentParser(description="Replays a recorded trace and compares the actions")
+parser.add_argument("trace", help="trace written by process_pearls.py --record")
+parser.add_argument("--vectorized", action="store_true", help="score candidate workers with numpy arrays, gives the same actions")
+parser.add_argument("--diffs", type=int, default=10, help="number of differing turns to print (default=10)")
+args = parser.parse_args()
+
+reader = trace.TraceReader(args.trace)
+# the recorded states follow the recorded actions, so the coordinator is
+# rebuilt with the recorded options, a different mode or planner would be
+# handed desks holding pearls it never sent there
+options = dict(reader.options)
+if args.vectorized:
+    options["vectorized"] = True
+
+result = trace.replay(reader, atlantis.Atlantis(**options), args.diffs)
+for turn, recorded, replayed in result["diffs"]:
+    print("turn {}:\n  recorded {}\n  replayed {}".format(turn, recorded, replayed))
+
+timing = summarize(result["timings"])
+print("{} turns, {} differ, p50 {:.1f}us p99 {:.1f}us per turn".format(
+    result["turns"], result["differing"], timing["p50_us"], timing["p99_us"]), file=sys.stderr)
+if result["differing"]:
+    sys.exit(1)
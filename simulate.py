@@ -0,0 +1,52 @@
+import sys
+import json
+import time
+import argparse
+from atlantis import atlantis, simulator
+
+# Entrypoint for playing games against the local simulator
+parser = argparse.ArgumentParser(description="Plays games against the local simulator", formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument("mode", nargs='?', default="pq", choices=["pq", "rr", "fifo"], help="mode for worker, see process_pearls.py (default=\"pq\")")
+parser.add_argument("--planner", default="greedy", choices=["greedy", "batch", "timeline", "dp"], help="how new pearls are planned (default=\"greedy\")")
+parser.add_argument("--replan", type=int, default=0, help="maximum number of drifting pearls replanned per turn, 0 is off, not used with the timeline planner (default=0)")
+parser.add_argument("--steal", action="store_true", help="let idle workers take queued Noms off overloaded neighbors")
+parser.add_argument("--profile", action="store_true", help="print the mean time per phase of each game to stderr")
+parser.add_argument("--long-run", action="store_true", help="cap cached topology rows and compact the bookkeeping after bursts")
+parser.add_argument("--config", default=None, metavar="PATH", help="tuned cost parameters per topology class, see benchmarks/tune.py")
+parser.add_argument("--calibrate", action="store_true", help="estimate the processing rates from the Noms and plan with the estimates")
+parser.add_argument("--rates", default=None, metavar="JSON", help="flavor to color to rate mapping the simulator uses instead of the default rates")
+parser.add_argument("--plan-cache", type=int, default=0, help="number of plan templates kept for pearls with the same layers, 0 is off, greedy planner only (default=0)")
+parser.add_argument("--return-tree", action="store_true", help="walk return paths up a shortest-path tree to the gatekeeper built once per turn")
+parser.add_argument("--refine", action="store_true", help="refine the plans of waiting pearls in a background thread between turns")
+parser.add_argument("--time-budget", type=float, default=0, metavar="MS", help="milliseconds a turn should take at most, 0 is off (default=0)")
+parser.add_argument("--vectorized", action="store_true", help="score candidate workers with numpy arrays, needs numpy")
+parser.add_argument("--topology", default="random", choices=simulator.TOPOLOGIES, help="shape of the topology (default=\"random\")")
+parser.add_argument("--size", type=int, default=10, help="number of workers (default=10)")
+parser.add_argument("--rate", type=float, default=0.3, help="expected number of new pearls per turn (default=0.3)")
+parser.add_argument("--turns", type=int, default=1000, help="number of turns per game (default=1000)")
+parser.add_argument("--games", type=int, default=1, help="number of games, seeded 0..games-1 (default=1)")
+args = parser.parse_args()
+
+total = 0
+start = time.perf_counter()
+for seed in range(args.games):
+    sim = simulator.Simulator(size=args.size, topology=args.topology, arrival_rate=args.rate, seed=seed,
+                              processing_rate=json.loads(args.rates) if args.rates else atlantis.PROCESSING_RATE)
+    coordinator = atlantis.Atlantis(mode=args.mode, planner=args.planner, vectorized=args.vectorized,
+                                    replan_budget=args.replan, steal=args.steal, profile=args.profile,
+                                    long_run=args.long_run, config=args.config, calibrate=args.calibrate,
+                                    plan_cache=args.plan_cache, return_tree=args.return_tree, refine=args.refine,
+                                    time_budget=args.time_budget)
+    score = sim.run(coordinator, args.turns)
+    coordinator.stop_refining()
+    total += score
+    print("seed {}: score {} of {} pearls, {} in flight, {} invalid actions".format(
+        seed, score, sim.arrived, sim.in_flight(), sim.invalid))
+    if args.time_budget:
+        print("{} quick plans, {} replaced by full ones".format(coordinator.total_degraded, coordinator.total_deferred),
+              file=sys.stderr)
+    if coordinator.profiler is not None:
+        print(json.dumps(coordinator.profiler.summary()), file=sys.stderr)
+elapsed = time.perf_counter() - start
+
+print("average score {:.2f}, {:.0f} turns/s".format(total / args.games, args.games * args.turns / elapsed), file=sys.stderr)
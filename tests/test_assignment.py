@@ -0,0 +1,29 @@
+import unittest
+from atlantis.assignment import min_cost_assignment
+
+class TestAssignment(unittest.TestCase):
+    def test_empty(self):
+        assert(min_cost_assignment([]) == [])
+
+    def test_square(self):
+        costs = [[4, 1, 3],
+                 [2, 0, 5],
+                 [3, 2, 2]]
+        assignment = min_cost_assignment(costs)
+        assert(assignment == [1, 0, 2])
+
+    def test_rectangular(self):
+        costs = [[7, 3, 9, 1],
+                 [2, 8, 9, 1]]
+        assignment = min_cost_assignment(costs)
+        assert(assignment == [3, 0])
+
+    def test_unreachable(self):
+        inf = float("inf")
+        costs = [[1, inf, inf],
+                 [0, 5, inf]]
+        assignment = min_cost_assignment(costs)
+        assert(assignment == [0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 import unittest
 import json
-from atlantis.atlantis import Atlantis
+import threading
+from atlantis.atlantis import Atlantis, np
+from atlantis.pearl import Pearl, NOM
+from atlantis.simulator import Simulator
+from atlantis.tuning import DEFAULTS
 
 class TestAtlantis(unittest.TestCase):
 
@@ -39,7 +43,7 @@ class TestAtlantis(unittest.TestCase):
         assert(plan[3][1]["Nom"] == 5)
 
     def test_search_simple(self):
-        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Red","thickness":12},{"color":"Green","thickness":13}])
+        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Green","thickness":13},{"color":"Red","thickness":12}])
         assert(workload[0] == 1)
         assert(workload[1] == 15)
         assert(workload[2] == 0)
@@ -53,7 +57,7 @@ class TestAtlantis(unittest.TestCase):
         assert(plan[2][1]["Nom"] == 5)
 
     def test_search_simple2(self):
-        state1 = {"workers": [{"id":0,"flavor":"General","desk":[{"id": 5,"layers":[{"color":"Red","thickness":12},{"color":"Green","thickness":13}]}]},
+        state1 = {"workers": [{"id":0,"flavor":"General","desk":[{"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]}]},
                              {"id":1,"flavor":"Vector","desk":[]},
                              {"id":2,"flavor":"Matrix","desk":[]}],
                              "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
@@ -62,10 +66,10 @@ class TestAtlantis(unittest.TestCase):
         assert(actions["0"]["Pass"]["to_worker"] == 1)
 
         state2 = {"workers": [{"id":0,"flavor":"General","desk":[]},
-                             {"id":1,"flavor":"Vector","desk":[{"id": 5,"layers":[{"color":"Red","thickness":12},{"color":"Green","thickness":13}]}]},
+                             {"id":1,"flavor":"Vector","desk":[{"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]}]},
                              {"id":2,"flavor":"Matrix","desk":[]}],
                              "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
-        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Red","thickness":12},{"color":"Green","thickness":13}])
+        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Green","thickness":13},{"color":"Red","thickness":12}])
         assert(workload[0] == 1)
         assert(workload[1] == 0)
         assert(workload[2] == 19)
@@ -78,22 +82,38 @@ class TestAtlantis(unittest.TestCase):
         assert(plan[2][0] == 7)
         assert(plan[2][1]["Nom"] == 5)
 
+    def test_search_sparse(self):
+        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Green","thickness":13},{"color":"Red","thickness":12}], sparse=True)
+        assert(workload == {0: 1, 1: 15})
+        assert(end == 1)
+        assert(len(plan) == 3)
+
     def test_return_path_simple(self):
-        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Red","thickness":12},{"color":"Green","thickness":13}])
+        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Green","thickness":13},{"color":"Red","thickness":12}])
         assert(end == 1)
         path = self.atlantis.return_path(1, 0)
         assert(path[0] == 1)
         assert(path[1] == 0)
 
+    def test_return_path_busy_gatekeeper(self):
+        # line 0 - 1 - ... - 29, every worker but the gatekeeper is free
+        atlantis = Atlantis()
+        atlantis.initialize({"workers": [{"id":i,"flavor":"General","desk":[]} for i in range(30)],
+                             "neighbor_map":[[i,i+1] for i in range(29)]})
+        atlantis.workload[0] = 5
+        assert(atlantis.return_path(3, 0) == [3, 2, 1, 0])
+        # the free workers past the start are never settled
+        assert(sum(s == atlantis.stamp for s in atlantis.settled) == 4)
+
     def test_plan_pearl_simple(self):
-        plan, work = self.atlantis.plan_pearl({"id": 5,"layers":[{"color":"Red","thickness":12},{"color":"Green","thickness":13}]})
+        plan, work = self.atlantis.plan_pearl({"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]})
         assert(work == 17)
         assert(plan[3][0] == 1)
         assert(plan[3][1]["Pass"]["pearl_id"] == 5)
         assert(plan[3][1]["Pass"]["to_worker"] == 0)
 
     def test_process_simple(self):
-        state1 = {"workers": [{"id":0,"flavor":"General","desk":[{"id": 5,"layers":[{"color":"Red","thickness":12},{"color":"Green","thickness":13}]}]},
+        state1 = {"workers": [{"id":0,"flavor":"General","desk":[{"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]}]},
                              {"id":1,"flavor":"Vector","desk":[]},
                              {"id":2,"flavor":"Matrix","desk":[]}],
                              "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
@@ -102,7 +122,7 @@ class TestAtlantis(unittest.TestCase):
         assert(actions["0"]["Pass"]["to_worker"] == 1)
 
         state2 = {"workers": [{"id":0,"flavor":"General","desk":[]},
-                             {"id":1,"flavor":"Vector","desk":[{"id": 5,"layers":[{"color":"Red","thickness":12},{"color":"Green","thickness":13}]}]},
+                             {"id":1,"flavor":"Vector","desk":[{"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]}]},
                              {"id":2,"flavor":"Matrix","desk":[]}],
                              "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
         for i in range(15):
@@ -114,5 +134,789 @@ class TestAtlantis(unittest.TestCase):
         assert(actions["1"]["Pass"]["pearl_id"] == 5)
         assert(actions["1"]["Pass"]["to_worker"] == 0)
 
+    def test_completion_events(self):
+        state1 = {"workers": [{"id":0,"flavor":"General","desk":[{"id": 5,"layers":[{"color":"Red","thickness":1}]}]},
+                             {"id":1,"flavor":"Vector","desk":[]},
+                             {"id":2,"flavor":"Matrix","desk":[]}],
+                             "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.process(state1)
+        assert(self.atlantis.turn_completed == 0)
+        assert(self.atlantis.in_flight == 1)
+
+        state2 = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                             {"id":1,"flavor":"Vector","desk":[{"id": 5,"layers":[{"color":"Red","thickness":1}]}]},
+                             {"id":2,"flavor":"Matrix","desk":[]}],
+                             "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.process(state2)
+        assert(self.atlantis.in_flight == 1)
+        state2["workers"][1]["desk"][0]["layers"] = []
+        actions = json.loads(self.atlantis.process(state2))
+        assert(actions["1"]["Pass"]["to_worker"] == 0)
+        assert(self.atlantis.turn_completed == 1)
+        assert(self.atlantis.total_completed == 1)
+        assert(self.atlantis.in_flight == 0)
+        assert(not self.atlantis.pearl_map)
+        assert(not self.atlantis.completions)
+
+    def test_profile(self):
+        assert(self.atlantis.profiler is None)
+        sim = Simulator(size=20, topology="random", arrival_rate=1, seed=4)
+        atlantis = Atlantis(profile=True)
+        for _ in range(50):
+            sim.step(atlantis.process(sim.state()))
+        records = list(atlantis.profiler.records)
+        assert(len(records) == 50)
+        assert("initialize" in records[0]["phases_us"])
+        assert("serialization" in records[-1]["phases_us"])
+        assert(len(records[-1]["queue_depths"]) == 20)
+        assert(sum(record["heap_pops"] for record in records) > 0)
+
+    def test_pearl_map_matches_simulator(self):
+        sim = Simulator(size=20, topology="random", arrival_rate=1, seed=4)
+        atlantis = Atlantis()
+        for _ in range(200):
+            sim.step(atlantis.process(sim.state()))
+        assert(atlantis.in_flight == len(atlantis.pearl_map))
+        assert(set(atlantis.pearl_map) <= sim.pearl_ids)
+        assert(atlantis.total_completed == sim.score)
+
+class TestAtlantisBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.atlantis = Atlantis(planner="batch")
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.process(self.state)
+
+    def test_planner(self):
+        assert(self.atlantis.planner == 'batch')
+        assert(Atlantis(planner='af').planner == 'greedy')
+
+    def test_single_pearl_matches_greedy(self):
+        pearl = {"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]}
+        greedy = Atlantis()
+        greedy.initialize(self.state)
+        assert(self.atlantis.plan_batch([pearl]) == [greedy.plan_pearl(pearl)])
+        assert(self.atlantis.workload == greedy.workload)
+
+    def test_batch_keeps_specialist_free(self):
+        # greedy gives the Red pearl to the Matrix worker (lowest id on a tie),
+        # pushing the Blue pearl to the slower Vector worker
+        setting = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                               {"id":1,"flavor":"Matrix","desk":[]},
+                               {"id":2,"flavor":"Vector","desk":[]}],
+                               "neighbor_map":[[0,1],[0,2]],"score":0}
+        pearls = [{"id": 5,"layers":[{"color":"Red","thickness":10}]},
+                  {"id": 6,"layers":[{"color":"Blue","thickness":10}]}]
+        greedy = Atlantis()
+        greedy.initialize(setting)
+        plan5, _ = greedy.plan_pearl(pearls[0])
+        plan6, _ = greedy.plan_pearl(pearls[1])
+        assert(plan5[0][1]["Pass"]["to_worker"] == 1)
+        assert(plan6[0][1]["Pass"]["to_worker"] == 2)
+        assert(plan6[1][0] == 5)
+
+        batch = Atlantis(planner="batch")
+        batch.initialize(setting)
+        planned = batch.plan_batch(pearls)
+        (plan5, work5), (plan6, work6) = planned
+        assert(plan5[0][1]["Pass"]["to_worker"] == 2)
+        assert(plan5[1][0] == 10)
+        assert(plan6[0][1]["Pass"]["to_worker"] == 1)
+        assert(plan6[1][0] == 1)
+        assert(plan6[2][1]["Pass"]["to_worker"] == 0)
+        assert(work5 == 12)
+        assert(work6 == 3)
+        assert(sum(batch.workload) == work5 + work6)
+
+    def test_process_batch(self):
+        state1 = {"workers": [{"id":0,"flavor":"General","desk":[{"id": 5,"layers":[{"color":"Blue","thickness":20}]},
+                                                                {"id": 6,"layers":[{"color":"Green","thickness":20}]}]},
+                             {"id":1,"flavor":"Vector","desk":[]},
+                             {"id":2,"flavor":"Matrix","desk":[]}],
+                             "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        actions = json.loads(self.atlantis.process(state1))
+        assert(5 in self.atlantis.pearl_map)
+        assert(6 in self.atlantis.pearl_map)
+        assert("Pass" in actions["0"])
+
+
+class TestAtlantisReplan(unittest.TestCase):
+
+    def setUp(self):
+        self.atlantis = Atlantis(replan_budget=1)
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.initialize(self.state)
+
+    def test_off_by_default(self):
+        assert(Atlantis().replan_budget == 0)
+        assert(Atlantis(planner="timeline", replan_budget=4).replan_budget == 0)
+
+    def test_replan_pearl(self):
+        layers = [{"color":"Blue","thickness":20}]
+        plan, work = self.atlantis.plan_pearl({"id": 5, "layers": layers})
+        assert(plan[0][1]["Pass"]["to_worker"] == 2)
+        pearl = Pearl(5, plan, work, 1)
+
+        # passed to the Matrix worker, which got congested since
+        pearl.process()
+        self.atlantis.workload[0] -= 1
+        self.atlantis.workload[2] += 50
+        self.atlantis.pearl_map[5] = pearl
+        self.atlantis.replan_pearl(pearl, 2, layers)
+        assert(pearl.plan == [[1, {"Pass":{"pearl_id":5,"to_worker":1}}],
+                              [10, {"Nom": 5}],
+                              [1, {"Pass":{"pearl_id":5,"to_worker":0}}]])
+        assert(pearl.work == 12)
+        assert(self.atlantis.workload == [0, 11, 51])
+
+    def test_skips_mid_nom(self):
+        self.atlantis.replan_factor = 0
+        pearl = {"id": 5, "layers": [{"color":"Blue","thickness":20}]}
+        self.state["workers"][0]["desk"] = [pearl]
+        # with a factor of 0 pearls drift as soon as they arrive,
+        # the replans keep it on its way to the Matrix worker
+        actions = json.loads(self.atlantis.process(self.state))
+        assert(self.atlantis.turn_replanned == 1)
+        assert(actions["0"] == {"Pass":{"pearl_id":5,"to_worker":2}})
+
+        self.state["workers"][0]["desk"] = []
+        self.state["workers"][2]["desk"] = [pearl]
+        actions = json.loads(self.atlantis.process(self.state))
+        assert(self.atlantis.turn_replanned == 1)
+        assert(actions["2"] == {"Nom": 5})
+
+        # the Nom is under way
+        self.state["workers"][2]["desk"] = [{"id": 5, "layers": [{"color":"Blue","thickness":10}]}]
+        actions = json.loads(self.atlantis.process(self.state))
+        assert(self.atlantis.turn_replanned == 0)
+        assert(self.atlantis.total_replanned == 2)
+        assert(actions["2"] == {"Nom": 5})
+
+    def test_game(self):
+        sim = Simulator(size=30, topology="grid", arrival_rate=1, seed=2)
+        atlantis = Atlantis(replan_budget=2)
+        for _ in range(300):
+            sim.step(atlantis.process(sim.state()))
+            assert(atlantis.turn_replanned <= 2)
+        assert(atlantis.total_replanned > 0)
+        assert(sim.invalid == 0)
+        assert(atlantis.total_completed == sim.score)
+        assert(set(atlantis.located) == set(atlantis.pearl_map))
+
+
+class TestAtlantisSteal(unittest.TestCase):
+
+    def setUp(self):
+        self.atlantis = Atlantis(steal=True)
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Matrix","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.initialize(self.state)
+
+        # two Blue pearls queued at worker 1, worker 2 has nothing to do
+        for pid in (5, 6):
+            plan = [[2, {"Nom": pid}], [1, {"Pass":{"pearl_id":pid,"to_worker":0}}]]
+            self.atlantis.pearl_map[pid] = Pearl(pid, plan, 3, 1)
+            self.state["workers"][1]["desk"].append({"id": pid, "layers": [{"color":"Blue","thickness":20}]})
+        self.atlantis.workers[1].ingest([5, 6], [], self.atlantis.pearl_map)
+        self.atlantis.workload[1] = 6
+
+    def test_off_by_default(self):
+        assert(not Atlantis().steal)
+        assert(not Atlantis(planner="timeline", steal=True).steal)
+
+    def test_steal(self):
+        self.atlantis.steal_work(self.state)
+        assert(self.atlantis.turn_stolen == 1)
+
+        # the first pearl is served right away, the second one would wait
+        assert(self.atlantis.pearl_map[5].plan[0] == [2, {"Nom": 5}])
+        assert(self.atlantis.pearl_map[6].plan == [[1, {"Pass":{"pearl_id":6,"to_worker":2}}],
+                                                   [2, {"Nom": 6}],
+                                                   [1, {"Pass":{"pearl_id":6,"to_worker":0}}]])
+        assert(self.atlantis.pearl_map[6].work == 4)
+        assert(self.atlantis.workload == [0, 4, 3])
+
+    def test_busy_neighbor_not_stolen_for(self):
+        self.state["workers"][2]["desk"].append({"id": 7, "layers": []})
+        self.atlantis.steal_work(self.state)
+        assert(self.atlantis.turn_stolen == 0)
+        assert(self.atlantis.pearl_map[6].next_op() == NOM)
+
+    def test_planned_work_not_busy(self):
+        # work planned for later doesn't keep an idle worker from stealing
+        self.atlantis.workload[2] = 5
+        self.atlantis.steal_work(self.state)
+        assert(self.atlantis.turn_stolen == 1)
+        assert(self.atlantis.workload == [0, 4, 8])
+
+    def test_started_not_stolen(self):
+        self.atlantis.pearl_map[6].advance()
+        self.atlantis.steal_work(self.state)
+        assert(self.atlantis.turn_stolen == 0)
+
+    def test_game(self):
+        sim = Simulator(size=20, topology="random", arrival_rate=1, seed=0)
+        atlantis = Atlantis(mode="fifo", steal=True)
+        for _ in range(300):
+            sim.step(atlantis.process(sim.state()))
+        assert(atlantis.total_stolen > 0)
+        assert(sim.invalid == 0)
+        assert(atlantis.total_completed == sim.score)
+
+    def test_game_modes(self):
+        for mode in ("pq", "fifo", "rr"):
+            for topology in ("line", "grid"):
+                sim = Simulator(size=30, topology=topology, arrival_rate=1.5, seed=1)
+                atlantis = Atlantis(mode=mode, steal=True)
+                sim.run(atlantis, 300)
+                assert(atlantis.total_stolen > 0)
+                assert(sim.invalid == 0)
+
+
+class TestAtlantisTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.atlantis = Atlantis(planner="timeline")
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.initialize(self.state)
+        self.pearl = {"id": 5,"layers":[{"color":"Green","thickness":13},{"color":"Red","thickness":12}]}
+
+    def test_planner(self):
+        assert(self.atlantis.planner == 'timeline')
+        assert(len(self.atlantis.timelines) == 3)
+        assert(Atlantis().timelines is None)
+
+    def test_first_pearl_matches_greedy(self):
+        greedy = Atlantis()
+        greedy.initialize(self.state)
+        assert(self.atlantis.plan_timed(self.pearl) == greedy.plan_pearl(self.pearl))
+        assert(self.atlantis.workload == greedy.workload)
+
+    def test_bookings(self):
+        self.atlantis.plan_timed(self.pearl)
+        timelines = self.atlantis.timelines
+        assert((timelines[0].starts, timelines[0].ends) == ([0], [1]))
+        assert((timelines[1].starts, timelines[1].ends) == ([1], [17]))
+        assert(len(timelines[2]) == 0)
+
+    def test_booked_worker_avoided(self):
+        self.atlantis.plan_timed(self.pearl)
+        plan, work = self.atlantis.plan_timed({"id": 6,"layers":[{"color":"Red","thickness":12}]})
+        assert(plan[0][1]["Pass"]["to_worker"] == 2)
+        assert(plan[1][0] == 12)
+        assert(plan[2][1]["Pass"]["to_worker"] == 0)
+        assert(work == 14)
+        assert(self.atlantis.timelines[0].ends == [2])
+        assert(self.atlantis.timelines[2].starts == [2])
+
+    def test_lag(self):
+        self.atlantis.plan_timed(self.pearl)
+        self.atlantis.turn = 5
+        timeline = self.atlantis.timeline(1)
+        assert(timeline.now == 5)
+        assert(timeline.lag == 4)
+        assert(timeline.earliest(5, 1) == 21)
+
+    def test_game(self):
+        sim = Simulator(size=20, topology="line", arrival_rate=0.5, seed=1)
+        atlantis = Atlantis(planner="timeline")
+        for _ in range(200):
+            sim.step(atlantis.process(sim.state()))
+        assert(atlantis.turn == 200)
+        assert(sim.score > 0)
+        assert(sim.invalid == 0)
+        assert(atlantis.total_completed == sim.score)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestAtlantisVectorized(unittest.TestCase):
+
+    def setUp(self):
+        self.atlantis = Atlantis(vectorized=True)
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.process(self.state)
+
+    def test_initialized(self):
+        assert(self.atlantis.vectorized)
+        assert(list(self.atlantis.flavor_code) == [0, 1, 2])
+        assert(all([work == 0 for work in self.atlantis.workload]))
+
+    def test_search_simple(self):
+        plan, workload, end = self.atlantis.search(5, 0, [{"color":"Green","thickness":13},{"color":"Red","thickness":12}])
+        assert(workload == [1, 15, 0])
+        assert(end == 1)
+        assert(plan[1][0] == 12)
+        assert(plan[2][0] == 3)
+
+    def test_matches_pure_python(self):
+        sim = Simulator(size=30, topology="grid", arrival_rate=1, seed=2)
+        pure = Atlantis()
+        pure.initialize(sim.state())
+        self.atlantis = Atlantis(vectorized=True)
+        self.atlantis.initialize(sim.state())
+        for _ in range(40):
+            pearl = sim.new_pearl()
+            assert(self.atlantis.plan_pearl(pearl) == pure.plan_pearl(pearl))
+            assert(list(self.atlantis.workload) == pure.workload)
+
+
+class TestAtlantisLongRun(unittest.TestCase):
+    def setUp(self):
+        self.atlantis = Atlantis(long_run=True)
+        self.atlantis.row_limit = 4
+        self.atlantis.compact_floor = 8
+
+    def test_off_by_default(self):
+        atlantis = Atlantis()
+        atlantis.process(Simulator(size=5, seed=0).state())
+        assert(atlantis.topology.max_rows is None)
+
+    def test_burst(self):
+        # a burst of pearls followed by a trickle, same actions as without long run
+        sim = Simulator(size=20, topology="random", arrival_rate=5, seed=3)
+        plain = Atlantis()
+        compactions = 0
+        peak = 0
+        for turn in range(300):
+            if turn == 10:
+                sim.arrival_rate = 0.2
+            state = sim.state()
+            actions = self.atlantis.process(state)
+            assert(actions == plain.process(state))
+            if self.atlantis.peak_in_flight < peak:
+                compactions += 1
+            peak = self.atlantis.peak_in_flight
+            sim.step(actions)
+            assert(len(self.atlantis.topology.dist) <= 4)
+        assert(compactions > 0)
+        assert(self.atlantis.pearl_map.keys() == plain.pearl_map.keys())
+        assert(self.atlantis.total_completed == sim.score)
+
+
+
+class TestAtlantisConfig(unittest.TestCase):
+    def setUp(self):
+        # the three workers form a ring
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+
+    def test_topology_class(self):
+        atlantis = Atlantis(config={"ring": {"origin_penalty": 3, "nom_penalty": 7, "layer_weight": 2},
+                                    "default": {"origin_penalty": 30}})
+        atlantis.process(self.state)
+        assert(atlantis.origin_penalty == 3)
+        assert(atlantis.topology.origin_penalty == 3)
+        assert(all(worker.nom_penalty == 7 for worker in atlantis.workers.values()))
+        assert(all(worker.layer_weight == 2 for worker in atlantis.workers.values()))
+        assert(atlantis.path_weight == 1)
+
+    def test_default_entry(self):
+        atlantis = Atlantis(config={"grid": {"origin_penalty": 3}, "default": {"workload_weight": 0.5}})
+        atlantis.process(self.state)
+        assert(atlantis.origin_penalty == 10)
+        assert(atlantis.workload_weight == 0.5)
+        assert(atlantis.params == {"workload_weight": 0.5})
+
+    def test_defaults_match(self):
+        sim = Simulator(size=20, topology="grid", arrival_rate=1, seed=1)
+        plain = Atlantis()
+        atlantis = Atlantis(config={"default": DEFAULTS})
+        for _ in range(100):
+            state = sim.state()
+            actions = atlantis.process(state)
+            assert(actions == plain.process(state))
+            sim.step(actions)
+
+
+
+class TestAtlantisCalibrate(unittest.TestCase):
+    # Vector and Matrix workers slower on their specialties than planned for
+    RATES = {"General": {"Red": 1, "Green": 1, "Blue": 1},
+             "Vector": {"Red": 2, "Green": 3, "Blue": 1},
+             "Matrix": {"Red": 1, "Green": 1, "Blue": 6}}
+
+    def test_off_by_default(self):
+        sim = Simulator(size=20, topology="grid", arrival_rate=1, seed=1)
+        atlantis = Atlantis()
+        sim.run(atlantis, 50)
+        assert(not atlantis.noms)
+        assert(not atlantis.rate_counts)
+
+    def test_observe_rate(self):
+        atlantis = Atlantis(calibrate=True)
+        atlantis.observe_rate("Vector", "Green", 3, False)
+        atlantis.observe_rate("Vector", "Green", 3, False)
+        assert(atlantis.processing_rate["Vector"]["Green"] == 3)
+        # dissolving a layer of 4 in one Nom means the rate is at least 4
+        atlantis.observe_rate("Vector", "Green", 4, True)
+        assert(atlantis.processing_rate["Vector"]["Green"] == 4)
+        atlantis.observe_rate("Matrix", "Blue", 2, True)
+        assert(atlantis.processing_rate["Matrix"]["Blue"] == 10)
+
+    def test_true_rates(self):
+        sim = Simulator(size=20, topology="grid", arrival_rate=1, seed=1)
+        plain = Atlantis()
+        atlantis = Atlantis(calibrate=True)
+        for _ in range(200):
+            state = sim.state()
+            actions = atlantis.process(state)
+            assert(actions == plain.process(state))
+            sim.step(actions)
+        assert(atlantis.total_corrected == 0)
+        assert(atlantis.processing_rate == plain.processing_rate)
+
+    def test_learns_rates(self):
+        sim = Simulator(size=30, topology="grid", arrival_rate=1, seed=1, processing_rate=self.RATES)
+        atlantis = Atlantis(calibrate=True)
+        sim.run(atlantis, 300)
+        assert(atlantis.total_corrected > 0)
+        assert(sim.invalid == 0)
+        for (flavor, color), count in atlantis.rate_counts.items():
+            assert(atlantis.processing_rate[flavor][color] == self.RATES[flavor][color])
+        assert(atlantis.processing_rate["Matrix"]["Blue"] == 6)
+
+    def test_zero_thinning(self):
+        atlantis = Atlantis(calibrate=True)
+        atlantis.observe_rate("Matrix", "Blue", 0, False)
+        atlantis.observe_rate("Matrix", "Blue", -3, False)
+        assert(atlantis.processing_rate["Matrix"]["Blue"] == 10)
+        assert(not atlantis.rate_counts)
+
+    def test_dropped_nom(self):
+        # the environment drops a Nom, the layer is as thick on the next turn
+        atlantis = Atlantis(calibrate=True)
+        layers = [{"color":"Blue","thickness":20}]
+        def state(wid):
+            workers = [{"id":0,"flavor":"General","desk":[]}, {"id":1,"flavor":"Matrix","desk":[]}]
+            workers[wid]["desk"].append({"id": 5, "layers": [dict(layer) for layer in layers]})
+            return {"workers": workers, "neighbor_map": [[0, 1]], "score": 0}
+        assert(json.loads(atlantis.process(state(0))) == {"0": {"Pass": {"pearl_id": 5, "to_worker": 1}}})
+        assert(json.loads(atlantis.process(state(1))) == {"1": {"Nom": 5}})
+        assert(json.loads(atlantis.process(state(1))) == {"1": {"Nom": 5}})
+        assert(atlantis.processing_rate["Matrix"]["Blue"] == 10)
+
+
+class TestAtlantisPlanCache(unittest.TestCase):
+    def setUp(self):
+        self.atlantis = Atlantis(plan_cache=2)
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                                  "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+        self.atlantis.process(self.state)
+        self.layers = [{"color":"Green","thickness":13},{"color":"Red","thickness":12}]
+
+    def test_off_by_default(self):
+        atlantis = Atlantis()
+        atlantis.process(self.state)
+        atlantis.plan_pearl({"id": 5, "layers": self.layers})
+        assert(not atlantis.plan_cache)
+        assert(atlantis.cache_misses == 0)
+
+    def test_hit(self):
+        plan, work = self.atlantis.plan_pearl({"id": 5, "layers": self.layers})
+        workload = list(self.atlantis.workload)
+        plan2, work2 = self.atlantis.plan_pearl({"id": 6, "layers": self.layers})
+        assert(self.atlantis.cache_hits == 1)
+        assert(self.atlantis.cache_misses == 1)
+        assert(work2 == work == 17)
+        assert(json.dumps(plan2) == json.dumps(plan).replace('"pearl_id": 5', '"pearl_id": 6').replace('"Nom": 5', '"Nom": 6'))
+        # nothing was planned before, so the same route doubles the workload
+        assert(self.atlantis.workload == [2 * w for w in workload])
+
+    def test_stale(self):
+        self.atlantis.plan_cache_drift = 10
+        self.atlantis.plan_pearl({"id": 5, "layers": self.layers})
+        plan, work = self.atlantis.plan_pearl({"id": 6, "layers": self.layers})
+        assert(self.atlantis.cache_hits == 0)
+        assert(self.atlantis.cache_misses == 2)
+        # the first pearl keeps Vector busy, so the second one goes to Matrix
+        assert(plan[0][1]["Pass"]["to_worker"] == 2)
+
+    def test_lru(self):
+        red = [{"color":"Red","thickness":1}]
+        green = [{"color":"Green","thickness":1}]
+        blue = [{"color":"Blue","thickness":1}]
+        self.atlantis.plan_pearl({"id": 5, "layers": red})
+        self.atlantis.plan_pearl({"id": 6, "layers": green})
+        self.atlantis.plan_pearl({"id": 7, "layers": red})
+        self.atlantis.plan_pearl({"id": 8, "layers": blue})
+        keys = [key[0] for key in self.atlantis.plan_cache]
+        assert(keys == [(("Red", 1),), (("Blue", 1),)])
+
+    def test_rates_change(self):
+        atlantis = Atlantis(plan_cache=2, calibrate=True)
+        atlantis.process(self.state)
+        atlantis.plan_pearl({"id": 5, "layers": self.layers})
+        atlantis.observe_rate("Vector", "Red", 1, False)
+        assert(len(atlantis.plan_cache) == 1)
+        atlantis.observe_rate("Vector", "Green", 3, False)
+        assert(not atlantis.plan_cache)
+
+    def test_game(self):
+        sim = Simulator(size=30, topology="grid", arrival_rate=2, seed=2, max_layers=1, max_thickness=4)
+        atlantis = Atlantis(plan_cache=64)
+        sim.run(atlantis, 300)
+        assert(atlantis.cache_hits > 0)
+        assert(sim.invalid == 0)
+        assert(atlantis.total_completed == sim.score)
+
+
+
+class TestAtlantisReturnTree(unittest.TestCase):
+    def cost(self, atlantis, path):
+        return sum(atlantis.workload[w] for w in path[1:])
+
+    def test_off_by_default(self):
+        sim = Simulator(size=20, topology="random", arrival_rate=1, seed=1)
+        atlantis = Atlantis()
+        sim.run(atlantis, 50)
+        assert(atlantis.return_tree is None)
+
+    def test_matches_return_path(self):
+        sim = Simulator(size=40, topology="random", arrival_rate=2, seed=3)
+        atlantis = Atlantis(return_tree=True)
+        sim.run(atlantis, 100)
+        atlantis.build_return_tree()
+        for start in range(40):
+            path = atlantis.tree_return_path(start)
+            expected = atlantis.return_path(start, 0)
+            assert(path[:1] == expected[:1])
+            assert(path[-1:] == expected[-1:] == ([0] if start else []))
+            assert(self.cost(atlantis, path) == self.cost(atlantis, expected))
+            for u, v in zip(path, path[1:]):
+                assert(v in atlantis.neighbors[u])
+
+    def test_game(self):
+        sim = Simulator(size=30, topology="grid", arrival_rate=2, seed=2)
+        atlantis = Atlantis(return_tree=True)
+        sim.run(atlantis, 200)
+        assert(0 < atlantis.tree_builds <= 200)
+        assert(sim.invalid == 0)
+        assert(atlantis.total_completed == sim.score)
+
+
+class TestAtlantisRefine(unittest.TestCase):
+    def setUp(self):
+        # line 0 - 1 - 2 - 3 with Matrix workers at 1 and 3
+        self.atlantis = Atlantis()
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[{"id":5,"layers":[{"color":"Blue","thickness":20}]},
+                                                                     {"id":6,"layers":[{"color":"Blue","thickness":20}]}]},
+                                  {"id":1,"flavor":"Matrix","desk":[]},
+                                  {"id":2,"flavor":"General","desk":[]},
+                                  {"id":3,"flavor":"Matrix","desk":[]}],
+                      "neighbor_map":[[0,1],[1,2],[2,3]],"score":0}
+        self.atlantis.process(self.state)
+
+    def test_candidates(self):
+        # 5 was passed on this turn, 6 is waiting at the gatekeeper
+        candidates = self.atlantis.refine_candidates(self.state)
+        assert(candidates == [(6, 0, [{"color":"Blue","thickness":20}])])
+
+    def test_no_better_plan(self):
+        workload = list(self.atlantis.workload)
+        self.atlantis.refine(self.atlantis.refine_candidates(self.state))
+        assert(self.atlantis.refined == {})
+        assert(self.atlantis.workload == workload)
+        assert(self.atlantis.refine_checked == {6: 1})
+
+    def test_better_plan(self):
+        # 6 was sent to the Matrix at 3, which got busy since
+        assert(self.atlantis.pearl_map[6].plan[2] == [1, {"Pass": {"pearl_id": 6, "to_worker": 3}}])
+        self.atlantis.workload[3] += 30
+        self.atlantis.refine(self.atlantis.refine_candidates(self.state))
+        assert(self.atlantis.workload == [1, 6, 0, 30])
+        # staged until the swap
+        assert(len(self.atlantis.pearl_map[6].plan) == 7)
+        self.atlantis.apply_refined()
+        assert(self.atlantis.pearl_map[6].plan == [[1, {"Pass": {"pearl_id": 6, "to_worker": 1}}], [2, {"Nom": 6}],
+                                                   [1, {"Pass": {"pearl_id": 6, "to_worker": 0}}]])
+        assert(self.atlantis.pearl_map[6].work == 4)
+        assert(self.atlantis.turn_refined == 1)
+        assert(self.atlantis.refined == {})
+
+    def test_stopped(self):
+        stop = threading.Event()
+        stop.set()
+        self.atlantis.refine(self.atlantis.refine_candidates(self.state), stop)
+        assert(self.atlantis.refine_checked == {})
+
+    def test_ignored_with_timeline(self):
+        assert(not Atlantis(planner="timeline", refine=True).refine_between)
+
+    def test_game(self):
+        sim = Simulator(size=20, topology="line", arrival_rate=1, seed=1)
+        atlantis = Atlantis(refine=True)
+        sim.run(atlantis, 200)
+        atlantis.stop_refining()
+        assert(atlantis.refiner is None)
+        assert(sim.invalid == 0)
+        assert(atlantis.total_completed == sim.score)
+
+
+class TestAtlantisTimeBudget(unittest.TestCase):
+    def setUp(self):
+        self.layers = [{"color":"Green","thickness":13},{"color":"Red","thickness":12}]
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[{"id":i,"layers":[dict(l) for l in self.layers]}
+                                                                     for i in (5, 6, 7)]},
+                                  {"id":1,"flavor":"Vector","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                      "neighbor_map":[[0,1],[1,2],[0,2]],"score":0}
+
+    def test_quick_plan(self):
+        atlantis = Atlantis()
+        atlantis.initialize(self.state)
+        plan, work = atlantis.quick_plan({"id": 5, "layers": self.layers})
+        # all layers at the Vector, the cheapest round trip
+        assert(plan == [[1, {"Pass": {"pearl_id": 5, "to_worker": 1}}], [12, {"Nom": 5}], [3, {"Nom": 5}],
+                        [1, {"Pass": {"pearl_id": 5, "to_worker": 0}}]])
+        assert(work == 17)
+        assert(atlantis.workload == [1, 16, 0])
+
+    def test_degraded(self):
+        # only the first pearl is planned in full before a plan is timed
+        atlantis = Atlantis(time_budget=1e-6, profile=True)
+        atlantis.process(self.state)
+        assert(atlantis.turn_degraded == 2)
+        assert(atlantis.degraded_fraction == 2 / 3)
+        assert(list(atlantis.deferred) == [6, 7])
+        assert(atlantis.profiler.records[-1]["degraded_fraction"] == 2 / 3)
+        assert(atlantis.profiler.summary()["degraded_fraction"] == 2 / 3)
+
+        # no time left for the deferred pearls on the next turn either
+        atlantis.process(self.state)
+        assert(atlantis.turn_deferred == 0)
+        assert(atlantis.degraded_fraction == 0.0)
+
+    def test_deferred(self):
+        atlantis = Atlantis(time_budget=1e-6)
+        atlantis.process(self.state)
+        quick = {pid: atlantis.pearl_map[pid].plan for pid in (6, 7)}
+        atlantis.time_budget = 1000
+        atlantis.process(self.state)
+        assert(not atlantis.deferred)
+        assert(atlantis.turn_deferred == 2)
+        # the full plan Noms the Red layer at the gatekeeper
+        assert(atlantis.pearl_map[7].plan[0] == [12, {"Nom": 7}])
+        assert(atlantis.pearl_map[7].plan != quick[7])
+
+    def test_ample_budget(self):
+        greedy = Atlantis()
+        atlantis = Atlantis(time_budget=1000)
+        assert(atlantis.process(self.state) == greedy.process(self.state))
+        assert(atlantis.turn_degraded == 0)
+
+    def test_ignored_with_timeline(self):
+        assert(Atlantis(planner="timeline", time_budget=10).time_budget == 0)
+
+    def test_game(self):
+        for planner in ("greedy", "batch"):
+            sim = Simulator(size=30, topology="random", arrival_rate=3, seed=4)
+            atlantis = Atlantis(planner=planner, time_budget=0.5)
+            sim.run(atlantis, 200)
+            assert(sim.invalid == 0)
+            assert(atlantis.total_completed == sim.score)
+
+
+class TestAtlantisDP(unittest.TestCase):
+    def setUp(self):
+        # a thin outer Red layer the Matrix is slow at, then a thick Blue one it's fast at
+        self.layers = [{"color":"Blue","thickness":20},{"color":"Red","thickness":1}]
+        self.state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                                  {"id":1,"flavor":"General","desk":[]},
+                                  {"id":2,"flavor":"Matrix","desk":[]}],
+                      "neighbor_map":[[0,1],[0,2]],"score":0}
+
+    def test_search(self):
+        atlantis = Atlantis(planner="dp")
+        atlantis.initialize(self.state)
+        plan, workload, last = atlantis.search_dp(5, 0, self.layers)
+        # both layers at the Matrix, greedy takes the Red one to worker 1 first
+        assert(plan == [[1, {"Pass": {"pearl_id": 5, "to_worker": 2}}], [1, {"Nom": 5}], [2, {"Nom": 5}]])
+        assert(workload == {0: 1, 2: 3})
+        assert(last == 2)
+
+    def test_beats_greedy(self):
+        turns = {}
+        for planner in ("greedy", "dp"):
+            atlantis = Atlantis(planner=planner)
+            atlantis.initialize(self.state)
+            plan, _, last = atlantis.search(5, 0, self.layers) if planner == "greedy" else atlantis.search_dp(5, 0, self.layers)
+            # the return path starts at the last worker, one Pass per step after it
+            turns[planner] = sum(step[0] for step in plan) + len(atlantis.return_path(last, 0)) - 1
+        assert(turns == {"greedy": 7, "dp": 5})
+
+    def test_home_queue(self):
+        # two Matrix workers for a Blue layer, 2 is a hop closer but its way
+        # home goes through worker 1
+        state = {"workers": [{"id":0,"flavor":"General","desk":[]},
+                             {"id":1,"flavor":"General","desk":[]},
+                             {"id":2,"flavor":"Matrix","desk":[]},
+                             {"id":3,"flavor":"General","desk":[]},
+                             {"id":4,"flavor":"General","desk":[]},
+                             {"id":5,"flavor":"Matrix","desk":[]}],
+                 "neighbor_map":[[0,1],[1,2],[0,3],[3,4],[4,5]],"score":0}
+        layers = [{"color":"Blue","thickness":20}]
+        atlantis = Atlantis(planner="dp")
+        atlantis.initialize(state)
+        assert(atlantis.search_dp(9, 0, layers)[2] == 2)
+
+        # work planned at worker 1 is mostly Noms, which a pearl on its way home skips
+        atlantis.workload[1] = 50
+        atlantis.home = None
+        assert(atlantis.search_dp(9, 0, layers)[2] == 2)
+
+        # three pearls done with their layers queued at worker 1 go first
+        atlantis.workload[1] = 0
+        for pid in (5, 6, 7):
+            pearl = Pearl(pid, [], 0, 0)
+            pearl.replan([[1, {"Pass":{"pearl_id":pid,"to_worker":0}}]], 1, 0)
+            atlantis.pearl_map[pid] = pearl
+        atlantis.workers[1].ingest([5, 6, 7], [], atlantis.pearl_map)
+        atlantis.home = None
+        assert(atlantis.home_costs() == [0, 1, 5, 1, 2, 3])
+        plan, _, last = atlantis.search_dp(9, 0, layers)
+        assert(last == 5)
+        assert(plan[:3] == [[1, {"Pass": {"pearl_id": 9, "to_worker": 3}}], [1, {"Pass": {"pearl_id": 9, "to_worker": 4}}],
+                            [1, {"Pass": {"pearl_id": 9, "to_worker": 5}}]])
+
+    def test_no_layers(self):
+        atlantis = Atlantis(planner="dp")
+        atlantis.initialize(self.state)
+        assert(atlantis.search_dp(5, 1, []) == ([], {}, 1))
+
+    def test_process(self):
+        atlantis = Atlantis(planner="dp")
+        state = dict(self.state)
+        state["workers"] = [dict(self.state["workers"][0], desk=[{"id":5,"layers":[dict(l) for l in self.layers]}])] + self.state["workers"][1:]
+        actions = json.loads(atlantis.process(state))
+        assert(actions == {"0": {"Pass": {"pearl_id": 5, "to_worker": 2}}})
+        assert(atlantis.pearl_map[5].plan == [[1, {"Nom": 5}], [2, {"Nom": 5}], [1, {"Pass": {"pearl_id": 5, "to_worker": 0}}]])
+
+    def test_game(self):
+        for topology in ("line", "grid", "random"):
+            sim = Simulator(size=30, topology=topology, arrival_rate=2, seed=3)
+            atlantis = Atlantis(planner="dp", replan_budget=4, refine=True, plan_cache=16)
+            sim.run(atlantis, 200)
+            atlantis.stop_refining()
+            assert(sim.invalid == 0)
+            assert(sim.score > 0)
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import json
+from atlantis import codec
+
+class TestCodec(unittest.TestCase):
+    def test_dumps_int_keys(self):
+        actions = {0: {"Nom": 5}, 3: {"Pass": {"pearl_id": 6, "to_worker": 0}}}
+        assert(json.loads(codec.dumps(actions)) == {"0": {"Nom": 5}, "3": {"Pass": {"pearl_id": 6, "to_worker": 0}}})
+
+    def test_loads(self):
+        assert(codec.loads(b'{"a": [1, 2]}') == {"a": [1, 2]})
+        assert(codec.loads('{"a": [1, 2]}') == {"a": [1, 2]})
+
+    def test_skip_field_middle(self):
+        data = b'{"workers":[],"neighbor_map":[[0,1],[1,2]],"score":0}'
+        assert(json.loads(codec.skip_field(data, b"neighbor_map")) == {"workers": [], "score": 0})
+
+    def test_skip_field_last(self):
+        data = b'{"workers": [], "neighbor_map": [[0, 1], [1, 2]]}'
+        assert(json.loads(codec.skip_field(data, b"neighbor_map")) == {"workers": []})
+
+    def test_skip_field_first(self):
+        data = b'{"neighbor_map": [[0, 1]], "score": 0}'
+        assert(json.loads(codec.skip_field(data, b"neighbor_map")) == {"score": 0})
+
+    def test_skip_field_empty(self):
+        data = b'{"workers": [], "neighbor_map": [ ], "score": 0}'
+        assert(json.loads(codec.skip_field(data, b"neighbor_map")) == {"workers": [], "score": 0})
+
+    def test_skip_field_missing(self):
+        data = b'{"workers": [], "score": 0}'
+        assert(codec.skip_field(data, b"neighbor_map") == data)
+
+    def test_skip_field_in_pearl(self):
+        # the key's name in a pearl, as a value and as a nested field, comes before the real one
+        data = (b'{"workers":[{"id":0,"flavor":"General","desk":[{"id":3,"note":"neighbor_map",'
+                b'"neighbor_map":[[5,6]],"layers":[{"color":"\\"neighbor_map\\": [[7]]","thickness":1}]}]}],'
+                b'"neighbor_map":[[0,1]],"score":0}')
+        state = json.loads(codec.skip_field(data, b"neighbor_map"))
+        assert("neighbor_map" not in state)
+        assert(state["workers"] == json.loads(data)["workers"])
+
+    def test_skip_field_nested_only(self):
+        data = b'{"workers":[{"id":0,"desk":[],"neighbor_map":[[0,1]]}],"score":0}'
+        assert(codec.skip_field(data, b"neighbor_map") == data)
+
+    def test_skip_field_first_long_tail(self):
+        # the top level is checked on the short side, here the head
+        data = b'{"neighbor_map":[[0,1]],"workers":[{"id":0,"desk":[{"id":3,"neighbor_map":[[5]]}]}]}'
+        assert(json.loads(codec.skip_field(data, b"neighbor_map")) == {"workers": [{"id": 0, "desk": [{"id": 3, "neighbor_map": [[5]]}]}]})
+
+    def test_skip_field_not_number_lists(self):
+        data = b'{"workers":[],"neighbor_map":[["a]]"]],"score":0}'
+        assert(codec.skip_field(data, b"neighbor_map") == data)
+
+    def test_decode_state(self):
+        data = b'{"workers":[{"id":0,"flavor":"General","desk":[]}],"neighbor_map":[[0,1]],"score":0}'
+        assert("neighbor_map" in codec.decode_state(data, False))
+        state = codec.decode_state(data, True)
+        assert("neighbor_map" not in state)
+        assert(state["workers"][0]["id"] == 0)
+
+    def test_decode_state_pearl_mentions_key(self):
+        data = (b'{"workers":[{"id":0,"flavor":"General","desk":[{"id":3,"layers":[{"color":"neighbor_map",'
+                b'"thickness":2}]}]}],"neighbor_map":[[0,1]],"score":0}')
+        state = codec.decode_state(data, True)
+        assert(state == {"workers": [{"id": 0, "flavor": "General", "desk": [{"id": 3, "layers": [{"color": "neighbor_map", "thickness": 2}]}]}],
+                         "score": 0})
+
+    def test_decode_state_fallback(self):
+        # a neighbor map that isn't numbers is decoded and dropped
+        data = b'{"workers":[],"neighbor_map":[["a"]],"score":0}'
+        assert(codec.decode_state(data, True) == {"workers": [], "score": 0})
+
+if __name__ == '__main__':
+    unittest.main()
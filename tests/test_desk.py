@@ -0,0 +1,30 @@
+import unittest
+from atlantis.desk import DeskTracker
+
+class TestDeskTracker(unittest.TestCase):
+    def setUp(self):
+        self.desks = DeskTracker()
+
+    def test_empty_desk_unchanged(self):
+        assert(self.desks.diff(0, []) is None)
+
+    def test_arrivals(self):
+        arrivals, departures = self.desks.diff(0, [{"id": 5}, {"id": 6}])
+        assert(arrivals == [5, 6])
+        assert(departures == [])
+        assert(self.desks.diff(0, [{"id": 5}, {"id": 6}]) is None)
+
+    def test_departures(self):
+        self.desks.diff(0, [{"id": 5}, {"id": 6}])
+        arrivals, departures = self.desks.diff(0, [{"id": 6}, {"id": 7}])
+        assert(arrivals == [7])
+        assert(departures == [5])
+
+    def test_workers_are_separate(self):
+        self.desks.diff(0, [{"id": 5}])
+        arrivals, departures = self.desks.diff(1, [{"id": 5}])
+        assert(arrivals == [5])
+        assert(departures == [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import heapq
+import random
+from atlantis.ipq import IndexedHeap
+
+class TestIndexedHeap(unittest.TestCase):
+    def setUp(self):
+        self.heap = IndexedHeap()
+        for key, cost in [(5, 3), (2, 7), (9, 1), (4, 3)]:
+            self.heap.push(key, cost)
+
+    def test_order(self):
+        assert(len(self.heap) == 4)
+        assert(self.heap.peek() == (1, 9))
+        popped = [self.heap.pop() for _ in range(4)]
+        assert(popped == [(1, 9), (3, 4), (3, 5), (7, 2)])
+        assert(not self.heap)
+
+    def test_decrease_key(self):
+        self.heap.update(2, 0)
+        assert(self.heap.peek() == (0, 2))
+
+    def test_increase_key(self):
+        self.heap.update(9, 10)
+        assert(self.heap.pop() == (3, 4))
+        assert(self.heap.cost[9] == 10)
+
+    def test_push_existing(self):
+        self.heap.push(5, 0)
+        assert(len(self.heap) == 4)
+        assert(self.heap.peek() == (0, 5))
+
+    def test_remove(self):
+        self.heap.remove(9)
+        assert(9 not in self.heap)
+        assert(5 in self.heap)
+        assert(self.heap.pop() == (3, 4))
+
+    def test_matches_heapq(self):
+        rng = random.Random(0)
+        heap = IndexedHeap()
+        costs = {}
+        for _ in range(2000):
+            op = rng.random()
+            if op < 0.5 or not costs:
+                key = rng.randrange(100)
+                costs[key] = rng.randrange(20)
+                heap.push(key, costs[key])
+            elif op < 0.8:
+                expected = min((cost, key) for key, cost in costs.items())
+                assert(heap.pop() == expected)
+                del costs[expected[1]]
+            else:
+                key = rng.choice(list(costs))
+                heap.remove(key)
+                del costs[key]
+            assert(len(heap) == len(costs))
+        reference = [(cost, key) for key, cost in costs.items()]
+        heapq.heapify(reference)
+        while reference:
+            assert(heap.pop() == heapq.heappop(reference))
+    def test_compact(self):
+        for key in range(10, 20):
+            self.heap.push(key, key)
+        for key in range(10, 20):
+            self.heap.remove(key)
+        self.heap.compact()
+        assert(len(self.heap) == len(self.heap.pos) == len(self.heap.cost))
+        assert(self.heap.pop() == (1, 9))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from atlantis.pearl import Pearl
+import json
+from atlantis.pearl import Pearl, NOM, PASS
 
 # Tests moving pearl
 class TestPearlMoving(unittest.TestCase):
@@ -21,6 +22,64 @@ class TestPearlMoving(unittest.TestCase):
         assert(self.pearl.work == 19)
         assert(len(self.pearl.plan) == 6)
 
+    def test_compact_plan(self):
+        assert(not hasattr(self.pearl, "__dict__"))
+        assert(list(self.pearl.ops) == [PASS, NOM, PASS, NOM, PASS, PASS])
+        assert(list(self.pearl.targets) == [8, -1, 9, -1, 10, 0])
+        assert(list(self.pearl.counts) == [1, 12, 1, 3, 1, 1])
+        assert(self.pearl.cursor == 0)
+        assert(self.pearl.next_op() == PASS)
+
+    def test_fragments(self):
+        assert(len(self.pearl.fragments) == 6)
+        for i in range(6):
+            assert(json.loads(self.pearl.fragments[i]) == self.pearl.action(i))
+        # every Nom of a pearl shares the same fragment
+        assert(self.pearl.fragments[1] is self.pearl.fragments[3])
+
+    def test_advance(self):
+        assert(self.pearl.advance() == 0)
+        assert(self.pearl.advance() == 1)
+        assert(self.pearl.work == 17)
+        assert(self.pearl.fragments[1] == '{"Nom":3076927177}')
+
+    def test_cursor(self):
+        self.pearl.process()
+        assert(self.pearl.cursor == 1)
+        assert(self.pearl.next_op() == NOM)
+        assert(len(self.pearl.plan) == 5)
+        self.pearl.process()
+        assert(self.pearl.cursor == 1)
+        assert(self.pearl.plan[0] == [11, {'Nom': 3076927177}])
+
+    def test_started(self):
+        assert(not self.pearl.started)
+        self.pearl.process()
+        assert(not self.pearl.started)
+        self.pearl.process()
+        assert(self.pearl.started)
+        for _ in range(11):
+            self.pearl.process()
+        assert(not self.pearl.started)
+
+    def test_local_work(self):
+        assert(self.pearl.local_work() == 1)
+        self.pearl.process()
+        assert(self.pearl.local_work() == 13)
+
+    def test_replan(self):
+        self.pearl.process()
+        plan = [[2, {'Nom': 3076927177}], [1, {'Pass': {'pearl_id': 3076927177, 'to_worker': 0}}]]
+        self.pearl.replan(plan, 3, 1)
+        assert(self.pearl.cursor == 0)
+        assert(self.pearl.plan == plan)
+        assert(self.pearl.work == 3)
+        assert(self.pearl.layers == 1)
+        assert(not self.pearl.finished)
+        assert(json.loads(self.pearl.fragments[1]) == plan[1][1])
+        self.pearl.replan(plan[1:], 1, 0)
+        assert(self.pearl.finished)
+
     def test_peek_doesnt_change(self):
         times, action = self.pearl.peek()
         assert(times == 1)
@@ -93,6 +152,12 @@ class TestPearlStationary(unittest.TestCase):
         assert(self.pearl.work == 15)
         assert(len(self.pearl.plan) == 2)
 
+    def test_local_work(self):
+        # no Pass hands the pearl on, so all of the plan is local
+        assert(self.pearl.local_work() == 15)
+        self.pearl.process()
+        assert(self.pearl.local_work() == 14)
+
     def test_peek_doesnt_change(self):
         times, action = self.pearl.peek()
         assert(times == 12)
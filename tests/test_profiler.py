@@ -0,0 +1,112 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+import subprocess
+from atlantis.profiler import Profiler, PHASES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler(capacity=3)
+
+    def play_turn(self, turn):
+        self.profiler.begin(turn)
+        heap = []
+        self.profiler.heappush(heap, (2, 1))
+        self.profiler.heappush(heap, (1, 2))
+        assert(self.profiler.heappop(heap) == (1, 2))
+        for phase in PHASES:
+            self.profiler.mark(phase)
+        self.profiler.mark("dispatch")
+        self.profiler.end([turn, 0])
+
+    def test_record(self):
+        self.play_turn(0)
+        record = self.profiler.records[0]
+        assert(record["turn"] == 0)
+        assert(set(record["phases_us"]) == set(PHASES))
+        assert(all(us >= 0 for us in record["phases_us"].values()))
+        assert(record["heap_pushes"] == 2)
+        assert(record["heap_pops"] == 1)
+        assert(record["queue_depths"] == [0, 0])
+
+    def test_ring_buffer(self):
+        for turn in range(5):
+            self.play_turn(turn)
+        assert([record["turn"] for record in self.profiler.records] == [2, 3, 4])
+        summary = self.profiler.summary()
+        assert(summary["turns"] == 3)
+        assert(summary["heap_pushes"] == 2)
+        assert(summary["max_queue_depth"] == 4)
+
+    def test_counters(self):
+        self.play_turn(0)
+        self.profiler.begin(1)
+        self.profiler.end([], {"degraded_fraction": 0.5})
+        assert(self.profiler.records[-1]["degraded_fraction"] == 0.5)
+        assert(self.profiler.summary()["degraded_fraction"] == 0.25)
+        assert("degraded_fraction" not in self.profiler.records[0])
+
+    def test_empty_summary(self):
+        assert(self.profiler.summary() == {"turns": 0})
+
+    def test_dump(self):
+        for turn in range(2):
+            self.play_turn(turn)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.profiler.dump(path)
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        finally:
+            os.remove(path)
+        assert([record["turn"] for record in records] == [0, 1])
+
+    def test_autosave(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.profiler.autosave(path)
+            turns = []
+            for turn in range(7):
+                self.play_turn(turn)
+                # every record is in the file as soon as its turn ends
+                with open(path) as f:
+                    turns.append([json.loads(line)["turn"] for line in f])
+            self.profiler.close()
+        finally:
+            os.remove(path)
+        assert(turns[1] == [0, 1])
+        # trimmed to the ring buffer at twice the capacity
+        assert(turns[5] == [3, 4, 5])
+        assert(turns[6] == [3, 4, 5, 6])
+
+    def test_killed(self):
+        # the environment kills the coordinator without closing its stdin
+        state = {"workers": [{"id":0,"flavor":"General","desk":[{"id":5,"layers":[{"color":"Red","thickness":2}]}]},
+                             {"id":1,"flavor":"Vector","desk":[]}],
+                 "neighbor_map":[[0,1]],"score":0}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "profile.jsonl")
+            proc = subprocess.Popen([sys.executable, "process_pearls.py", "--profile", path], cwd=ROOT,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            try:
+                for _ in range(3):
+                    proc.stdin.write(json.dumps(state) + "\n")
+                    proc.stdin.flush()
+                    proc.stdout.readline()
+            finally:
+                proc.kill()
+                proc.wait()
+                proc.stdin.close()
+                proc.stdout.close()
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        assert([record["turn"] for record in records] == [0, 1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import random
+from atlantis.atlantis import Atlantis
+from atlantis.simulator import Simulator, generate_topology, TOPOLOGIES
+
+class TestTopologies(unittest.TestCase):
+    def connected(self, size, edges):
+        neighbors = {i: set() for i in range(size)}
+        for u, v in edges:
+            neighbors[u].add(v)
+            neighbors[v].add(u)
+        seen = {0}
+        stack = [0]
+        while stack:
+            for v in neighbors[stack.pop()]:
+                if v not in seen:
+                    seen.add(v)
+                    stack.append(v)
+        return len(seen) == size
+
+    def test_connected(self):
+        for kind in TOPOLOGIES:
+            for size in (2, 3, 10, 17):
+                edges = generate_topology(kind, size, random.Random(0))
+                assert(self.connected(size, edges))
+
+    def test_shapes(self):
+        rng = random.Random(0)
+        assert(generate_topology("line", 3, rng) == [[0, 1], [1, 2]])
+        assert(generate_topology("ring", 3, rng) == [[0, 1], [1, 2], [2, 0]])
+        assert(generate_topology("star", 3, rng) == [[0, 1], [0, 2]])
+        assert(generate_topology("grid", 4, rng) == [[0, 1], [0, 2], [1, 3], [2, 3]])
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            generate_topology("cube", 3, random.Random(0))
+
+
+class TestSimulator(unittest.TestCase):
+    def setUp(self):
+        self.sim = Simulator(size=3, topology="line", arrival_rate=0, seed=0)
+        self.sim.flavors = ["General", "Vector", "Matrix"]
+        self.sim.desks[0].append({"id": 5, "layers": [{"color": "Green", "thickness": 6}]})
+
+    def test_state(self):
+        state = self.sim.state()
+        assert(len(state["workers"]) == 3)
+        assert(state["workers"][0]["desk"][0]["id"] == 5)
+        assert(state["neighbor_map"] == [[0, 1], [1, 2]])
+
+    def test_seeded(self):
+        sim1 = Simulator(seed=3, arrival_rate=2)
+        sim2 = Simulator(seed=3, arrival_rate=2)
+        assert(sim1.neighbor_map == sim2.neighbor_map)
+        assert(sim1.flavors == sim2.flavors)
+        assert(sim1.desks[0] == sim2.desks[0])
+        assert(len(sim1.desks[0]) == 2)
+
+    def test_nom_and_pass(self):
+        self.sim.step({0: {"Pass": {"pearl_id": 5, "to_worker": 1}}})
+        assert(not self.sim.desks[0])
+        assert(self.sim.desks[1][0]["id"] == 5)
+        self.sim.step('{"1": {"Nom": 5}}')
+        assert(self.sim.desks[1][0]["layers"][0]["thickness"] == 1)
+        self.sim.step({1: {"Nom": 5}})
+        assert(not self.sim.desks[1][0]["layers"])
+        self.sim.step({1: {"Pass": {"pearl_id": 5, "to_worker": 0}}})
+        assert(not self.sim.desks[0])
+        assert(self.sim.score == 1)
+        assert(self.sim.turn == 4)
+        assert(self.sim.invalid == 0)
+
+    def test_nom_last_layer(self):
+        # as seen from the environment binary (seed 1): a Vector gatekeeper
+        # Nommed Blue 11, Green 13 into Blue 11, Green 8, then Blue 11, Green 3,
+        # then Blue 11 with the 2 left of its rate lost
+        sim = Simulator(size=1, topology="line", arrival_rate=0, seed=0)
+        sim.flavors = ["Vector"]
+        sim.desks[0].append({"id": 7, "layers": [{"color": "Blue", "thickness": 11}, {"color": "Green", "thickness": 13}]})
+        seen = []
+        for _ in range(4):
+            sim.step({0: {"Nom": 7}})
+            seen.append([(layer["color"], layer["thickness"]) for layer in sim.desks[0][0]["layers"]])
+        assert(seen == [[("Blue", 11), ("Green", 8)], [("Blue", 11), ("Green", 3)], [("Blue", 11)], [("Blue", 9)]])
+
+    def test_invalid(self):
+        self.sim.step({0: {"Pass": {"pearl_id": 5, "to_worker": 2}}})
+        self.sim.step({1: {"Nom": 5}})
+        assert(self.sim.invalid == 2)
+        assert(self.sim.desks[0][0]["layers"][0]["thickness"] == 6)
+
+    def test_run(self):
+        sim = Simulator(size=10, arrival_rate=0.5, seed=1)
+        score = sim.run(Atlantis(), 300)
+        assert(score > 0)
+        assert(sim.invalid == 0)
+        assert(score + sim.in_flight() == sim.arrived)
+
+if __name__ == '__main__':
+    unittest.main()
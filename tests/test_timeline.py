@@ -0,0 +1,65 @@
+import unittest
+from atlantis.timeline import Timeline
+
+class TestTimeline(unittest.TestCase):
+    def setUp(self):
+        self.timeline = Timeline()
+        self.timeline.book(2, 3)
+        self.timeline.book(8, 2)
+
+    def test_empty(self):
+        timeline = Timeline()
+        assert(timeline.earliest(4, 10) == 4)
+        assert(timeline.busy_until() == 0)
+
+    def test_earliest(self):
+        assert(self.timeline.earliest(0, 2) == 0)
+        assert(self.timeline.earliest(0, 3) == 5)
+        assert(self.timeline.earliest(3, 3) == 5)
+        assert(self.timeline.earliest(3, 4) == 10)
+        assert(self.timeline.earliest(9, 1) == 10)
+        assert(self.timeline.earliest(12, 5) == 12)
+
+    def test_book_merges(self):
+        self.timeline.book(5, 3)
+        assert(self.timeline.starts == [2])
+        assert(self.timeline.ends == [10])
+        self.timeline.book(0, 2)
+        assert(self.timeline.starts == [0])
+        assert(self.timeline.ends == [10])
+        assert(len(self.timeline) == 1)
+
+    def test_book_in_gap(self):
+        self.timeline.book(6, 1)
+        assert(self.timeline.starts == [2, 6, 8])
+        assert(self.timeline.ends == [5, 7, 10])
+
+    def test_prune(self):
+        self.timeline.prune(5)
+        assert(self.timeline.starts == [8])
+        self.timeline.prune(9)
+        assert(self.timeline.starts == [8])
+        self.timeline.prune(10)
+        assert(len(self.timeline) == 0)
+
+    def test_sync_without_lag(self):
+        self.timeline.sync(3, 4)
+        assert(self.timeline.lag == 0)
+        assert(self.timeline.earliest(0, 1) == 5)
+        assert(self.timeline.busy_until() == 7)
+
+    def test_sync_with_lag(self):
+        # 5 booked turns, 2 of them went by without the work getting done
+        self.timeline.sync(4, 5)
+        assert(self.timeline.lag == 2)
+        assert(self.timeline.earliest(4, 1) == 7)
+        assert(self.timeline.earliest(4, 2) == 7)
+        assert(self.timeline.earliest(4, 3) == 7)
+        assert(self.timeline.earliest(4, 4) == 12)
+        self.timeline.book(7, 3)
+        assert(self.timeline.starts == [2])
+        assert(self.timeline.ends == [10])
+        assert(self.timeline.busy_until() == 8)
+
+if __name__ == '__main__':
+    unittest.main()
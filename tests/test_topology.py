@@ -0,0 +1,88 @@
+import unittest
+from collections import defaultdict
+from atlantis.topology import Topology, classify_topology
+
+class TestTopology(unittest.TestCase):
+    def setUp(self):
+        # 0 - 1 - 2 - 3 line with a shortcut 0 - 3
+        neighbors = defaultdict(set)
+        for u, v in [[0,1],[1,2],[2,3],[0,3]]:
+            neighbors[u].add(v)
+            neighbors[v].add(u)
+        self.topology = Topology(neighbors, 4, origin=0, origin_penalty=10)
+
+    def test_neighbors(self):
+        assert(list(self.topology.adjacent(0)) == [1, 3])
+        assert(list(self.topology.adjacent(2)) == [1, 3])
+
+    def test_csr(self):
+        assert(self.topology.offsets is None)
+        neighbors = defaultdict(set)
+        for u, v in [[0,1],[1,2],[2,3],[0,3]]:
+            neighbors[u].add(v)
+            neighbors[v].add(u)
+        csr = Topology(neighbors, 4, origin=0, origin_penalty=10, csr=True)
+        assert(list(csr.offsets) == [0, 2, 4, 6, 8])
+        assert(list(csr.targets) == [1, 3, 0, 2, 1, 3, 0, 2])
+        assert(list(csr.adjacent(2)) == [1, 3])
+        for source in range(4):
+            assert(csr.row(source) == self.topology.row(source))
+            assert(csr.path(source, 2) == self.topology.path(source, 2))
+
+    def test_row_from_origin(self):
+        dist, order = self.topology.row(0)
+        assert(dist == [0, 1, 2, 1])
+        assert(order == [0, 1, 3, 2])
+
+    def test_row_origin_penalty(self):
+        dist, order = self.topology.row(2)
+        assert(dist[1] == 1)
+        assert(dist[3] == 1)
+        assert(dist[0] == 12)
+        assert(order[-1] == 0)
+
+    def test_row_is_cached(self):
+        dist, order = self.topology.row(1)
+        dist2, order2 = self.topology.row(1)
+        assert(dist is dist2)
+        assert(order is order2)
+        assert(2 not in self.topology.dist)
+
+    def test_path(self):
+        assert(self.topology.path(0, 0) == [0])
+        assert(self.topology.path(0, 2) == [0, 1, 2])
+        assert(self.topology.path(2, 0) == [2, 1, 0])
+        # passing through the origin is penalized
+        assert(self.topology.path(3, 1) == [3, 2, 1])
+    def test_max_rows(self):
+        self.topology.max_rows = 2
+        self.topology.row(0)
+        self.topology.row(1)
+        self.topology.row(2)
+        # the origin's row is kept, the least recently used other row goes
+        assert(set(self.topology.dist) == {0, 2})
+        self.topology.row(0)
+        assert(self.topology.path(3, 1) == [3, 2, 1])
+        assert(set(self.topology.dist) == {0, 3})
+        assert(set(self.topology.pred) == {0, 3})
+        assert(self.topology.row(0)[0] == [0, 1, 2, 1])
+
+class TestClassifyTopology(unittest.TestCase):
+    def classify(self, size, edges):
+        neighbors = defaultdict(set)
+        for u, v in edges:
+            neighbors[u].add(v)
+            neighbors[v].add(u)
+        return classify_topology(neighbors, size)
+
+    def test_shapes(self):
+        assert(self.classify(4, [[0,1],[1,2],[2,3]]) == "line")
+        assert(self.classify(4, [[0,1],[1,2],[2,3],[3,0]]) == "ring")
+        assert(self.classify(4, [[0,1],[0,2],[0,3]]) == "star")
+        # 3 wide, 2 rows
+        assert(self.classify(6, [[0,1],[1,2],[3,4],[4,5],[0,3],[1,4],[2,5]]) == "grid")
+        assert(self.classify(6, [[0,1],[1,2],[3,4],[4,5],[0,3],[1,4],[2,5],[0,5]]) == "random")
+        assert(self.classify(5, [[0,1],[1,2],[2,3],[3,4],[0,2]]) == "random")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import json
+import os
+import sys
+import gzip
+import tempfile
+import subprocess
+from atlantis.atlantis import Atlantis
+from atlantis.simulator import Simulator
+from atlantis.trace import TraceWriter, TraceReader, replay
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".gz")
+        os.close(fd)
+        self.options = {"mode": "pq", "planner": "greedy"}
+
+        # play a game and keep a copy of every state to compare against
+        sim = Simulator(size=12, topology="grid", arrival_rate=0.5, seed=4)
+        atlantis = Atlantis(**self.options)
+        writer = TraceWriter(self.path, self.options)
+        self.turns = []
+        for _ in range(60):
+            state = sim.state()
+            actions = atlantis.process(state)
+            self.turns.append((json.loads(json.dumps(state)), actions))
+            writer.record(state, actions)
+            sim.step(actions)
+        writer.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        reader = TraceReader(self.path)
+        assert(reader.options == self.options)
+        turns = list(reader)
+        assert(len(turns) == len(self.turns))
+        for (state, actions), (expected, expected_actions) in zip(turns, self.turns):
+            assert(actions == expected_actions)
+            assert(state["score"] == expected["score"])
+            assert(state["workers"] == expected["workers"])
+            assert(state["neighbor_map"] == expected["neighbor_map"])
+
+    def test_replay(self):
+        result = replay(TraceReader(self.path), Atlantis(**self.options))
+        assert(result["turns"] == 60)
+        assert(result["differing"] == 0)
+        assert(result["diffs"] == [])
+        assert(len(result["timings"]) == 60)
+
+    def test_replay_diff(self):
+        # record the game again with the actions of two turns swapped
+        writer = TraceWriter(self.path, self.options)
+        turns = list(self.turns)
+        turns[10], turns[11] = (turns[10][0], turns[11][1]), (turns[11][0], turns[10][1])
+        for state, actions in turns:
+            writer.record(state, actions)
+        writer.close()
+        result = replay(TraceReader(self.path), Atlantis(**self.options), max_diffs=1)
+        assert(result["differing"] == 2)
+        assert(result["diffs"] == [(10, self.turns[11][1], self.turns[10][1])])
+
+    def test_never_closed(self):
+        # what's on disk before close is what a killed coordinator leaves
+        writer = TraceWriter(self.path, self.options)
+        for state, actions in self.turns[:20]:
+            writer.record(state, actions)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        writer.close()
+        with open(self.path, "wb") as f:
+            f.write(data)
+        with self.assertRaises(EOFError):
+            with gzip.open(self.path, "rb") as f:
+                f.read()
+        result = replay(TraceReader(self.path), Atlantis(**self.options))
+        assert(result["turns"] == 20)
+        assert(result["differing"] == 0)
+
+    def test_cut_mid_turn(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:len(data) // 2])
+        turns = list(TraceReader(self.path))
+        assert(0 < len(turns) < 60)
+        for (state, actions), (expected, expected_actions) in zip(turns, self.turns):
+            assert(actions == expected_actions)
+            assert(state["workers"] == expected["workers"])
+
+    def test_killed(self):
+        sim = Simulator(size=12, topology="grid", arrival_rate=0.5, seed=4)
+        proc = subprocess.Popen([sys.executable, "process_pearls.py", "--record", self.path], cwd=ROOT,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            for _ in range(10):
+                proc.stdin.write(json.dumps(sim.state()) + "\n")
+                proc.stdin.flush()
+                sim.step(proc.stdout.readline())
+        finally:
+            proc.kill()
+            proc.wait()
+            proc.stdin.close()
+            proc.stdout.close()
+        result = replay(TraceReader(self.path), Atlantis(**self.options))
+        assert(result["turns"] == 10)
+        assert(result["differing"] == 0)
+
+    def test_version(self):
+        with gzip.open(self.path, "wb") as f:
+            f.write(b'{"version": 0, "options": {}}\n')
+        with self.assertRaises(ValueError):
+            TraceReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
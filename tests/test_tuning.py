@@ -0,0 +1,30 @@
+import unittest
+import json
+import os
+import tempfile
+from atlantis.tuning import PARAMETERS, DEFAULTS, load_config, pick_params
+
+class TestTuning(unittest.TestCase):
+    def test_defaults_are_candidates(self):
+        assert(set(PARAMETERS) == set(DEFAULTS))
+        for name, value in DEFAULTS.items():
+            assert(value in PARAMETERS[name])
+
+    def test_load_config(self):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"grid": {"origin_penalty": 5, "score": 12.5}, "default": {"nom_penalty": 30}}, f)
+        try:
+            config = load_config(path)
+        finally:
+            os.remove(path)
+        assert(config == {"grid": {"origin_penalty": 5}, "default": {"nom_penalty": 30}})
+
+    def test_pick_params(self):
+        config = {"grid": {"origin_penalty": 5}, "default": {"nom_penalty": 30}}
+        assert(pick_params(config, "grid") == {"origin_penalty": 5})
+        assert(pick_params(config, "line") == {"nom_penalty": 30})
+        assert(pick_params({"grid": {"origin_penalty": 5}}, "line") == {})
+
+if __name__ == '__main__':
+    unittest.main()
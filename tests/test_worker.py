@@ -1,6 +1,7 @@
 import unittest
+import json
 from atlantis.worker import Worker
-from atlantis.pearl import Pearl
+from atlantis.pearl import Pearl, NOM
 
 class TestWorker(unittest.TestCase):
     def setUp(self):
@@ -80,6 +81,19 @@ class TestWorkerProcessPQ(TestWorkerProcess):
             assert(action['Nom'] == 3076927176)
         assert(not self.worker.seen)
 
+    def test_refresh(self):
+        self.worker.resolve(self.state, self.pearl_map)
+        assert(self.worker.pearls.peek()[1] == 3076927177)
+        # the moving pearl's plan changes to a long Nom, the other goes first
+        pearl = self.pearl_map[3076927177]
+        pearl.ops[0] = NOM
+        pearl.counts[0] = 30
+        pearl.work += 29
+        self.worker.refresh(pearl)
+        assert(self.worker.pearls.peek()[1] == 3076927176)
+        action = self.worker.process(self.state, self.pearl_map)
+        assert(action['Nom'] == 3076927176)
+
 class TestWorkerProcessRR(TestWorkerProcess):
     def setUp(self):
         super(TestWorkerProcessRR, self).setUp()
@@ -130,5 +144,70 @@ class TestWorkerProcessFIFO(TestWorkerProcess):
         assert(action['Pass']['to_worker'] == 8)
         assert(not self.worker.seen)
 
+class TestWorkerProcessDelta(TestWorkerProcess):
+    def setUp(self):
+        super(TestWorkerProcessDelta, self).setUp()
+        wid = 0
+        self.worker = Worker(wid, mode='pq')
+
+    def test_process_delta(self):
+        action = json.loads(self.worker.process_delta([3076927176, 3076927177], [], self.pearl_map))
+        assert(action['Pass']['pearl_id'] == 3076927177)
+        assert(self.worker.seen == {3076927176})
+        for _ in range(15):
+            action = json.loads(self.worker.process_delta([], [3076927177], self.pearl_map))
+            assert(action['Nom'] == 3076927176)
+        assert(not self.worker.seen)
+        assert(self.worker.released == {3076927176})
+        assert(not self.worker.idle())
+
+    def test_released_pearl_requeued(self):
+        # pearl finishes with a Nom but stays on the desk
+        pid = 3076927178
+        plan = [[1, {'Nom': pid}], [1, {'Pass': {'pearl_id': pid, 'to_worker': 8}}]]
+        self.pearl_map[pid] = Pearl(pid, plan, 2, 1)
+        action = json.loads(self.worker.process_delta([pid], [], self.pearl_map))
+        assert(action['Nom'] == pid)
+        assert(pid in self.worker.released)
+        action = json.loads(self.worker.process_delta([], [], self.pearl_map))
+        assert(action['Pass']['pearl_id'] == pid)
+        assert(not self.worker.released)
+
+    def test_completions(self):
+        completions = []
+        worker = Worker(0, mode='pq', completions=completions)
+        worker.process_delta([3076927176], [], self.pearl_map)
+        for _ in range(14):
+            worker.process_delta([], [], self.pearl_map)
+        assert(completions == [3076927176])
+
+    def test_queued(self):
+        pid = 3076927178
+        plan = [[2, {'Nom': pid}], [1, {'Pass': {'pearl_id': pid, 'to_worker': 8}}]]
+        self.pearl_map[pid] = Pearl(pid, plan, 3, 1)
+        self.worker.ingest([3076927176, pid], [], self.pearl_map)
+        queued = self.worker.queued(self.pearl_map)
+        assert([(pearl.id, ahead) for pearl, ahead in queued] == [(pid, 0), (3076927176, 3)])
+
+    def test_released_pearl_departed(self):
+        self.worker.released.add(3076927177)
+        action = self.worker.process_delta([], [3076927177], self.pearl_map)
+        assert(action is None)
+        assert(self.worker.idle())
+
+class TestWorkerPassWait(TestWorkerProcess):
+    def test_pass_wait(self):
+        done = 3076927178
+        pearl = Pearl(done, [], 0, 0)
+        pearl.replan([[1, {'Pass': {'pearl_id': done, 'to_worker': 0}}]], 1, 0)
+        self.pearl_map[done] = pearl
+        waits = {}
+        for mode in ("pq", "fifo", "rr"):
+            worker = Worker(0, mode=mode)
+            worker.ingest([3076927176, done], [], self.pearl_map)
+            waits[mode] = worker.pass_wait()
+        # in pq only the pearl done with its layers goes first, in fifo the 15 turns of Noms as well
+        assert(waits == {"pq": 1, "fifo": 16, "rr": 2})
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()